@@ -1,26 +1,41 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Query
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response, RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
 from app.core.database import get_db
-from app.schemas.kml import KMLGenerateResponse, GenerateHistoryResponse
+from app.schemas.kml import KMLGenerateResponse, KMLJobStatusResponse, GenerateHistoryResponse, GenerateHistoryItem
 from app.services.kml_service import KMLService
-from app.services.file_service import FileService
+from app.services.cache_service import CacheService
+from app.services.file_service import FileService, KML_MEDIA_TYPES, TILE_ROOT_NAME
+from app.services.job_service import JobService
 from .user import get_current_user_id
+from typing import Optional, List, Tuple
+from urllib.parse import urlsplit, parse_qs
+import asyncio
 import json
+import math
+import os
 
 
 router = APIRouter(prefix="/api/kml", tags=["KML生成"])
 
 
-@router.post("/generate", response_model=KMLGenerateResponse, summary="生成KML文件")
+# 生成结果写入后不再变化，允许客户端长期缓存（需登录访问，不允许共享缓存）
+DOWNLOAD_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+@router.post("/generate", response_model=KMLGenerateResponse, summary="提交KML生成任务")
 async def generate_kml(
     request: Request,
     file_id: str = Query(..., description="文件ID"),
     layer_type: str = Query(..., description="图层类型"),
     config: str = Query(None, description="图层配置（JSON格式）"),
+    output_format: str = Query("kml", alias="format", description="输出格式（kml、kmz或tiles分块）"),
+    bbox: str = Query(None, description="经纬度范围过滤：西,南,东,北"),
+    polygon: str = Query(None, description="多边形范围过滤（JSON格式）：[[经度, 纬度], ...]"),
     db: AsyncSession = Depends(get_db)
 ):
-    """生成KML文件"""
+    """提交KML生成任务，立即返回任务ID"""
     try:
         # 验证用户身份
         user_id = get_current_user_id(request)
@@ -30,15 +45,22 @@ async def generate_kml(
         if config:
             config_dict = json.loads(config)
         
-        # 生成KML
-        kml_service = KMLService()
-        result = await kml_service.generate_kml(db, user_id, file_id, layer_type, config_dict)
+        # 解析范围过滤条件
+        spatial_filter = parse_spatial_filter(bbox, polygon)
+        
+        # 提交生成任务（分块KML中的链接需要服务的对外访问地址）
+        base_url = settings.PUBLIC_BASE_URL or str(request.base_url)
+        job = await JobService.submit_generation(
+            db, user_id, file_id, layer_type, config_dict, output_format, base_url.rstrip("/"), spatial_filter
+        )
         
         return KMLGenerateResponse(
             code=0,
-            message="生成成功",
-            kml_url=result["kml_url"],
-            history_id=result["history_id"]
+            message="生成成功" if job["status"] == "success" else "任务已提交",
+            job_id=job["job_id"],
+            status=job["status"],
+            history_id=job["history_id"],
+            kml_url=await resolve_kml_url(db, job["kml_url"])
         )
     except HTTPException:
         raise
@@ -46,24 +68,56 @@ async def generate_kml(
         raise HTTPException(status_code=500, detail=f"生成失败: {str(e)}")
 
 
+@router.get("/job", response_model=KMLJobStatusResponse, summary="查询生成任务状态")
+async def get_job_status(
+    request: Request,
+    job_id: str = Query(..., description="任务ID"),
+    db: AsyncSession = Depends(get_db)
+):
+    """查询KML生成任务的状态与进度"""
+    try:
+        # 验证用户身份
+        user_id = get_current_user_id(request)
+        
+        job = JobService.get_job(job_id, user_id)
+        
+        kml_url = await resolve_kml_url(db, job["kml_url"])
+        return KMLJobStatusResponse(code=0, message="获取成功", **{**job, "kml_url": kml_url})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取失败: {str(e)}")
+
+
 @router.get("/history", response_model=GenerateHistoryResponse, summary="获取生成历史")
 async def get_history(
     request: Request,
+    limit: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[int] = Query(None, description="分页游标（上一页返回的next_cursor）"),
+    layer_type: Optional[str] = Query(None, description="按图层类型过滤"),
+    status: Optional[str] = Query(None, description="按状态过滤：pending、success、failed、expired"),
     db: AsyncSession = Depends(get_db)
 ):
-    """获取用户的KML生成历史"""
+    """按时间倒序分页获取用户的KML生成历史"""
     try:
         # 验证用户身份
         user_id = get_current_user_id(request)
         
         # 获取历史记录
         kml_service = KMLService()
-        history_list = await kml_service.get_generate_history(db, user_id)
+        rows, next_cursor = await kml_service.get_generate_history(
+            db, user_id, limit, cursor, layer_type, status
+        )
+        history_list = [GenerateHistoryItem.model_validate(row) for row in rows]
+        kml_urls = await resolve_kml_urls(db, [item.kml_url for item in history_list])
+        for item, kml_url in zip(history_list, kml_urls):
+            item.kml_url = kml_url
         
         return GenerateHistoryResponse(
             code=0,
             message="获取成功",
-            data=history_list
+            data=history_list,
+            next_cursor=next_cursor
         )
     except HTTPException:
         raise
@@ -74,27 +128,210 @@ async def get_history(
 @router.get("/download", summary="下载KML文件")
 async def download_kml(
     request: Request,
-    filename: str = Query(..., description="KML文件名")
+    filename: str = Query(..., description="KML文件名"),
+    db: AsyncSession = Depends(get_db)
 ):
-    """下载KML文件"""
+    """下载KML文件
+    
+    分块KML包内的文件由Google Earth通过NetworkLink直接加载，无法携带token，
+    凭不可猜测的包名访问。对象存储后端下重定向到预签名地址，由对象存储提供文件。
+    """
     try:
+        file_service = FileService()
+        
         # 验证用户身份
-        get_current_user_id(request)
+        if not file_service.is_tile_file(filename):
+            get_current_user_id(request)
+        
+        # 刷新生成结果的访问时间（分块KML只在加载入口文件时刷新）
+        if not file_service.is_tile_file(filename) or os.path.basename(filename) == TILE_ROOT_NAME:
+            await CacheService.touch(db, filename)
+        
+        download_url = file_service.get_kml_download_url(filename)
+        if download_url:
+            return RedirectResponse(download_url, status_code=307)
         
         # 获取文件路径
-        file_service = FileService()
         kml_path = file_service.get_kml_path(filename)
         
         if not kml_path:
             raise HTTPException(status_code=404, detail="文件不存在")
         
+        output_format = filename.rsplit(".", 1)[-1].lower()
+        media_type = KML_MEDIA_TYPES.get(output_format, "application/octet-stream")
+        content_hash = await asyncio.to_thread(file_service.get_kml_hash, kml_path)
+        
+        # 断点续传需要按原始字节定位，带Range请求时不压缩传输
+        range_header = request.headers.get("Range")
+        use_gzip = output_format == "kml" and not range_header and accepts_gzip(request)
+        
+        # 以内容哈希作为强ETag，gzip编码的表示使用单独的ETag
+        etag = f'"{content_hash}-gzip"' if use_gzip else f'"{content_hash}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": DOWNLOAD_CACHE_CONTROL,
+            "Accept-Ranges": "bytes",
+            "Vary": "Accept-Encoding"
+        }
+        
+        # 客户端缓存的版本仍然有效时不再传输内容
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return Response(status_code=304, headers=headers)
+        
+        content_disposition = f'attachment; filename="{os.path.basename(filename)}"'
+        
+        # 客户端支持时对未压缩的KML进行gzip压缩传输
+        if use_gzip:
+            return StreamingResponse(
+                file_service.iter_gzip_file(kml_path),
+                media_type=media_type,
+                headers={**headers, "Content-Encoding": "gzip", "Content-Disposition": content_disposition}
+            )
+        
+        # 范围请求（If-Range不匹配时返回完整文件）
+        if range_header and etag_matches(request.headers.get("If-Range", etag), etag, strong=True):
+            file_size = os.path.getsize(kml_path)
+            byte_range = parse_byte_range(range_header, file_size)
+            if byte_range == ():
+                return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{file_size}"})
+            if byte_range:
+                start, end = byte_range
+                return StreamingResponse(
+                    file_service.iter_file_range(kml_path, start, end),
+                    status_code=206,
+                    media_type=media_type,
+                    headers={
+                        **headers,
+                        "Content-Range": f"bytes {start}-{end}/{file_size}",
+                        "Content-Length": str(end - start + 1),
+                        "Content-Disposition": content_disposition
+                    }
+                )
+        
         # 返回文件
         return FileResponse(
             path=kml_path,
-            filename=filename,
-            media_type="application/vnd.google-earth.kml+xml"
+            filename=os.path.basename(filename),
+            media_type=media_type,
+            headers=headers
         )
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"下载失败: {str(e)}")
+
+
+def parse_spatial_filter(bbox: Optional[str], polygon: Optional[str]) -> Optional[dict]:
+    """解析范围过滤参数，返回 {"bbox": [...]} 或 {"polygon": [...]}，未指定时返回None"""
+    if bbox and polygon:
+        raise HTTPException(status_code=400, detail="bbox与polygon不能同时指定")
+    
+    if bbox:
+        try:
+            west, south, east, north = [float(value) for value in bbox.split(",")]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="bbox格式错误，应为: 西,南,东,北")
+        if not all(math.isfinite(value) for value in (west, south, east, north)) or west > east or south > north:
+            raise HTTPException(status_code=400, detail="bbox范围无效")
+        return {"bbox": [west, south, east, north]}
+    
+    if polygon:
+        try:
+            vertices = [[float(lon), float(lat)] for lon, lat in json.loads(polygon)]
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="polygon格式错误，应为: [[经度, 纬度], ...]")
+        if len(vertices) < 3 or not all(math.isfinite(value) for vertex in vertices for value in vertex):
+            raise HTTPException(status_code=400, detail="polygon至少需要3个有效顶点")
+        return {"polygon": vertices}
+    
+    return None
+
+
+async def resolve_kml_url(db: AsyncSession, kml_url: Optional[str]) -> Optional[str]:
+    """对象存储后端下把下载接口地址换成预签名地址，客户端直接从对象存储下载"""
+    return (await resolve_kml_urls(db, [kml_url]))[0]
+
+
+async def resolve_kml_urls(db: AsyncSession, kml_urls: List[Optional[str]]) -> List[Optional[str]]:
+    """批量换成预签名地址
+    
+    客户端拿到预签名地址后不再经过下载接口，签发时刷新生成结果的访问时间，
+    存储清理仍按最近访问淘汰。
+    """
+    file_service = FileService()
+    resolved = []
+    issued = []
+    for kml_url in kml_urls:
+        filename = parse_qs(urlsplit(kml_url).query).get("filename") if kml_url else None
+        download_url = file_service.get_kml_download_url(filename[0]) if filename else None
+        if download_url:
+            issued.append(filename[0])
+        resolved.append(download_url or kml_url)
+    if issued:
+        await CacheService.touch(db, *issued)
+    return resolved
+
+
+def accepts_gzip(request: Request) -> bool:
+    """判断客户端是否接受gzip编码"""
+    accept_encoding = request.headers.get("Accept-Encoding", "")
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        if coding.strip().lower() not in ("gzip", "*"):
+            continue
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def etag_matches(header: Optional[str], etag: str, strong: bool = False) -> bool:
+    """判断If-None-Match/If-Range中的ETag列表是否包含指定ETag
+    
+    If-None-Match使用弱比较，忽略弱校验前缀；If-Range须使用强比较（strong=True），
+    弱ETag与*都不匹配，此时返回完整文件。
+    """
+    if not header:
+        return False
+    for item in header.split(","):
+        item = item.strip()
+        if strong:
+            if item == etag and not item.startswith("W/"):
+                return True
+        elif item == "*" or item.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def parse_byte_range(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    """解析单个字节范围，返回 (起始, 结束)（含两端）
+    
+    格式不支持（如多个范围）或无效（结束位置小于起始位置）时返回None，按完整文件返回；
+    起始位置超出文件大小等无法满足的范围返回空元组。
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    
+    start, sep, end = ranges.strip().partition("-")
+    if not sep or not (start or end) or not (start + end).isdigit():
+        return None
+    
+    if not start:
+        # 后缀范围：最后N个字节
+        length = int(end)
+        if length == 0 or file_size == 0:
+            return ()
+        return max(0, file_size - length), file_size - 1
+    
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= file_size:
+        return ()
+    end = min(int(end), file_size - 1) if end else file_size - 1
+    return start, end
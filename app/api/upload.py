@@ -1,36 +1,164 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.database import get_db
-from app.schemas.kml import FileUploadResponse
+from app.schemas.kml import FileUploadResponse, ChunkedUploadInitRequest, ChunkedUploadStatusResponse
 from app.services.file_service import FileService
+from app.services.job_service import JobService
+from app.services.lifecycle_service import LifecycleService
+from app.services.upload_service import UploadService
 from .user import get_current_user_id
 
 
 router = APIRouter(prefix="/api/upload", tags=["文件上传"])
 
 
-@router.post("/file", response_model=FileUploadResponse, summary="上传文件")
+# 请求体由接口自行流式解析，在文档中声明multipart表单结构
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary", "description": "Excel或CSV文件"}}
+                }
+            }
+        }
+    }
+}
+
+# 分片内容以原始字节作为请求体
+CHUNK_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/octet-stream": {"schema": {"type": "string", "format": "binary"}}}
+    }
+}
+
+
+@router.post("/file", response_model=FileUploadResponse, summary="上传文件", openapi_extra=UPLOAD_REQUEST_BODY)
 async def upload_file(
     request: Request,
-    file: UploadFile = File(...),
     db: AsyncSession = Depends(get_db)
 ):
-    """上传Excel或CSV文件"""
+    """上传Excel或CSV文件（流式接收，先验证身份再读取请求体）"""
     try:
         # 验证用户身份
-        get_current_user_id(request)
+        user_id = get_current_user_id(request)
         
         # 上传文件
         file_service = FileService()
-        result = await file_service.upload_file(file)
-        
-        return FileUploadResponse(
-            code=0,
-            message="上传成功",
-            file_id=result["file_id"],
-            file_name=result["file_name"]
-        )
+        result = await file_service.upload_file(request)
+        
+        return await record_upload(db, user_id, result)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+
+
+@router.post("/chunked", response_model=ChunkedUploadStatusResponse, summary="创建分片上传任务")
+async def init_chunked_upload(
+    request: Request,
+    data: ChunkedUploadInitRequest
+):
+    """创建分片上传任务，返回任务ID与分片大小"""
+    try:
+        # 验证用户身份
+        user_id = get_current_user_id(request)
+        
+        file_service = FileService()
+        status = await asyncio.to_thread(file_service.init_chunked_upload, user_id, data.file_name, data.file_size)
+        
+        return ChunkedUploadStatusResponse(code=0, message="创建成功", **status)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"创建失败: {str(e)}")
+
+
+@router.put(
+    "/chunked/{upload_id}", response_model=ChunkedUploadStatusResponse, summary="上传分片",
+    openapi_extra=CHUNK_REQUEST_BODY
+)
+async def upload_chunk(
+    request: Request,
+    upload_id: str,
+    offset: int = Query(..., description="分片在文件中的偏移量（字节）")
+):
+    """上传一个分片，请求体为分片的原始字节"""
+    try:
+        # 验证用户身份
+        user_id = get_current_user_id(request)
+        
+        file_service = FileService()
+        status = await file_service.write_chunk(upload_id, user_id, offset, request)
+        
+        return ChunkedUploadStatusResponse(code=0, message="上传成功", **status)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+
+
+@router.get("/chunked/{upload_id}", response_model=ChunkedUploadStatusResponse, summary="查询分片上传状态")
+async def get_chunked_upload(
+    request: Request,
+    upload_id: str
+):
+    """查询已接收的分片，断点续传时只需上传缺少的分片"""
+    try:
+        # 验证用户身份
+        user_id = get_current_user_id(request)
+        
+        file_service = FileService()
+        status = await asyncio.to_thread(file_service.get_chunked_upload, upload_id, user_id)
+        
+        return ChunkedUploadStatusResponse(code=0, message="获取成功", **status)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取失败: {str(e)}")
+
+
+@router.post("/chunked/{upload_id}/complete", response_model=FileUploadResponse, summary="完成分片上传")
+async def complete_chunked_upload(
+    request: Request,
+    upload_id: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """所有分片上传完成后合成文件，返回文件ID"""
+    try:
+        # 验证用户身份
+        user_id = get_current_user_id(request)
+        
+        file_service = FileService()
+        result = await file_service.complete_chunked_upload(upload_id, user_id)
+        
+        return await record_upload(db, user_id, result)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+
+
+async def record_upload(db: AsyncSession, user_id: int, result: dict) -> FileUploadResponse:
+    """登记上传完成的文件，新文件在后台解析列名与行数
+    
+    超出用户配额时删除该用户最久未使用的其他文件。
+    """
+    uploaded_file = await UploadService.record(db, user_id, result)
+    await LifecycleService.enforce_user_quota(
+        db, user_id, JobService.active_file_ids() | {uploaded_file.file_id}
+    )
+    if uploaded_file.columns is None:
+        JobService.submit_analysis(uploaded_file.file_id, UploadService.get_path(uploaded_file))
+    
+    return FileUploadResponse(
+        code=0,
+        message="上传成功",
+        file_id=uploaded_file.file_id,
+        file_name=uploaded_file.file_name
+    )
@@ -5,7 +5,14 @@ from typing import List
 class Settings(BaseSettings):
     """应用配置类"""
     # 数据库配置
-    DATABASE_URL: str = "sqlite+aiosqlite:///./app.db"
+    DATABASE_URL: str = "sqlite+aiosqlite:///./app.db"  # 生产环境可使用 postgresql+asyncpg://
+    DATABASE_ECHO: bool = False  # 是否输出执行的SQL（仅调试使用）
+    DATABASE_POOL_SIZE: int = 10  # 连接池大小（SQLite不使用）
+    DATABASE_MAX_OVERFLOW: int = 20  # 连接池满时允许额外创建的连接数
+    DATABASE_POOL_RECYCLE: int = 1800  # 连接最长复用时间（秒）
+    SQLITE_JOURNAL_MODE: str = "WAL"  # WAL模式下读写互不阻塞
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # WAL模式下NORMAL即可保证一致性
+    SQLITE_BUSY_TIMEOUT_MS: int = 30000  # 并发写入时等待锁的最长时间
     
     # JWT配置
     SECRET_KEY: str = "dev-secret-key"
@@ -19,7 +26,42 @@ class Settings(BaseSettings):
     # 文件存储配置
     UPLOAD_DIR: str = "./uploads"
     KML_DIR: str = "./kml"
-    MAX_FILE_SIZE: int = 5 * 1024 * 1024  # 5MB
+    PUBLIC_BASE_URL: str = ""  # 服务对外访问地址，用于分块KML中的链接；为空时取请求地址
+    MAX_FILE_SIZE: int = 500 * 1024 * 1024  # 500MB，上传时边接收边校验
+    UPLOAD_CHUNK_SIZE: int = 2 * 1024 * 1024  # 分片上传的分片大小（2MB）
+    
+    # 生成结果存储配置
+    STORAGE_BACKEND: str = "local"  # local（本地KML_DIR）或s3（S3兼容对象存储，如MinIO）
+    S3_ENDPOINT_URL: str = ""  # 对象存储地址，为空时使用AWS S3
+    S3_PUBLIC_ENDPOINT_URL: str = ""  # 预签名下载地址使用的对外地址，为空时同S3_ENDPOINT_URL
+    S3_REGION: str = ""
+    S3_BUCKET: str = ""
+    S3_ACCESS_KEY: str = ""
+    S3_SECRET_KEY: str = ""
+    S3_PREFIX: str = "kml/"  # 生成结果在桶内的路径前缀
+    S3_ADDRESSING_STYLE: str = "path"  # MinIO等自建存储通常使用path风格
+    S3_MULTIPART_CHUNK_SIZE: int = 8 * 1024 * 1024  # 分段上传的分段大小（不小于5MB）
+    S3_PRESIGN_EXPIRES_SECONDS: int = 3600  # 预签名下载地址的有效期
+    
+    # 生成任务配置
+    GENERATION_WORKERS: int = 2  # 生成任务工作进程数
+    JOB_RETENTION_SECONDS: int = 3600  # 已结束任务状态的保留时间
+    GENERATION_SHARD_WORKERS: int = 1  # 单个任务内并行渲染的进程数（1为不分片）
+    GENERATION_SHARD_MIN_ROWS: int = 200000  # 达到该行数才启用分片渲染
+    CSV_CHUNK_ROWS: int = 50000  # CSV流式读取的每块行数
+    HISTORY_FLUSH_INTERVAL_MS: int = 200  # 生成历史批量写入的间隔（毫秒）
+    HISTORY_FLUSH_BATCH_SIZE: int = 100  # 待写入的生成历史达到该条数时立即写入
+    HISTORY_ID_BLOCK_SIZE: int = 100  # 每次预留的生成历史ID数量
+    
+    # 生成结果缓存配置
+    KML_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024  # 缓存的KML文件总大小上限（1GB）
+    
+    # 存储生命周期配置
+    STORAGE_MAX_BYTES: int = 20 * 1024 * 1024 * 1024  # 上传文件与生成结果的总大小上限（20GB）
+    USER_STORAGE_QUOTA_BYTES: int = 2 * 1024 * 1024 * 1024  # 每个用户上传文件的总大小上限（2GB）
+    UPLOAD_TTL_SECONDS: int = 7 * 24 * 3600  # 上传文件超过该时间未使用则删除（7天）
+    KML_TTL_SECONDS: int = 30 * 24 * 3600  # 生成结果超过该时间未访问则删除（30天）
+    STORAGE_SWEEP_INTERVAL_SECONDS: int = 600  # 后台清理的执行间隔
     
     # 跨域配置
     CORS_ORIGINS: List[str] = ["*"]
@@ -1,14 +1,50 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+import os
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Connection, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 from .config import settings
 
 
+# 数据库迁移配置文件（项目根目录），以及早于迁移管理的数据库对应的初始版本
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "alembic.ini")
+BASELINE_REVISION = "0001"
+
+
+def create_engine() -> AsyncEngine:
+    """按配置创建异步数据库引擎
+    
+    SQLite在每个连接上设置WAL日志、同步级别与忙等待超时，读写可以并发，
+    并发写入时等待锁而不是直接报 database is locked；
+    其他数据库（如postgresql+asyncpg）使用可配置大小的连接池。
+    """
+    url = make_url(settings.DATABASE_URL)
+    options = {"echo": settings.DATABASE_ECHO, "future": True}
+    if url.get_backend_name() != "sqlite":
+        options.update(
+            pool_size=settings.DATABASE_POOL_SIZE,
+            max_overflow=settings.DATABASE_MAX_OVERFLOW,
+            pool_recycle=settings.DATABASE_POOL_RECYCLE,
+            pool_pre_ping=True
+        )
+    
+    async_engine = create_async_engine(url, **options)
+    if url.get_backend_name() == "sqlite":
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return async_engine
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """新建SQLite连接时设置PRAGMA"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.close()
+
+
 # 创建异步数据库引擎
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    echo=settings.DEBUG,
-    future=True
-)
+engine = create_engine()
 
 # 创建异步会话工厂
 AsyncSessionLocal = async_sessionmaker(
@@ -32,6 +68,24 @@ async def get_db():
 
 
 async def init_db():
-    """初始化数据库表结构"""
+    """初始化数据库：执行数据库迁移到最新版本"""
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_run_migrations)
+
+
+def _run_migrations(connection: Connection) -> None:
+    """在给定连接上执行迁移
+    
+    早于迁移管理、由create_all建表的数据库先标记为初始版本，再执行后续迁移。
+    """
+    from alembic import command
+    from alembic.config import Config
+    
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_INI), "migrations"))
+    config.attributes["connection"] = connection
+    
+    tables = inspect(connection).get_table_names()
+    if "alembic_version" not in tables and "users" in tables:
+        command.stamp(config, BASELINE_REVISION)
+    command.upgrade(config, "head")
@@ -0,0 +1,277 @@
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Optional, Iterator, BinaryIO
+from .config import settings
+
+
+class StorageBackend(ABC):
+    """生成结果存储后端
+    
+    对象以相对路径（键）标识，分块KML包内的文件为 包名/文件名。
+    """
+    
+    @abstractmethod
+    def open_writer(self, key: str, content_type: str) -> Iterator[BinaryIO]:
+        """打开新对象用于流式写入，写入出错时不保留不完整的对象"""
+    
+    @abstractmethod
+    def open_directory(self, prefix: str) -> Iterator[str]:
+        """返回用于写入一组文件的本地目录，完成后以 prefix/文件名 保存，出错时全部丢弃"""
+    
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """对象是否存在"""
+    
+    @abstractmethod
+    def size(self, key: str) -> int:
+        """对象大小，不存在时返回0"""
+    
+    @abstractmethod
+    def directory_size(self, prefix: str) -> int:
+        """一组文件的总大小"""
+    
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """删除对象，不存在时忽略"""
+    
+    @abstractmethod
+    def delete_directory(self, prefix: str) -> None:
+        """删除一组文件"""
+    
+    def download_url(self, key: str, filename: str) -> Optional[str]:
+        """客户端直接下载的地址，返回None时由下载接口提供文件"""
+        return None
+
+
+class LocalStorage(StorageBackend):
+    """本地磁盘存储（KML_DIR）"""
+    
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+    
+    def path(self, key: str) -> Optional[str]:
+        """对象的本地路径，不允许访问存储目录之外的文件"""
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, key))
+        if os.path.commonpath([root, path]) != root:
+            return None
+        return path
+    
+    @contextmanager
+    def open_writer(self, key: str, content_type: str) -> Iterator[BinaryIO]:
+        path = os.path.join(self.root, key)
+        try:
+            with open(path, "wb") as f:
+                yield f
+        except Exception:
+            self.delete(key)
+            raise
+    
+    @contextmanager
+    def open_directory(self, prefix: str) -> Iterator[str]:
+        directory = os.path.join(self.root, prefix)
+        os.makedirs(directory)
+        try:
+            yield directory
+        except Exception:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+    
+    def exists(self, key: str) -> bool:
+        path = self.path(key)
+        return path is not None and os.path.isfile(path)
+    
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.path(key)) if self.exists(key) else 0
+    
+    def directory_size(self, prefix: str) -> int:
+        directory = self.path(prefix)
+        if not directory or not os.path.isdir(directory):
+            return 0
+        return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+    
+    def delete(self, key: str) -> None:
+        path = self.path(key)
+        if path and os.path.isfile(path):
+            os.remove(path)
+    
+    def delete_directory(self, prefix: str) -> None:
+        directory = self.path(prefix)
+        if directory and directory != os.path.realpath(self.root):
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class S3MultipartWriter:
+    """S3分段上传的写入流
+    
+    数据累积到分段大小后上传一段，内存占用与对象大小无关；
+    不足一个分段的小对象在完成时直接整体上传。
+    """
+    
+    def __init__(self, client, bucket: str, key: str, content_type: str, part_size: int):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+    
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+    
+    def flush(self) -> None:
+        pass
+    
+    def _upload_part(self, data: bytes) -> None:
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+            )["UploadId"]
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=data
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+    
+    def complete(self) -> None:
+        """上传剩余数据并完成对象"""
+        if self.upload_id is None:
+            self.client.put_object(
+                Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), ContentType=self.content_type
+            )
+            return
+        if self.buffer:
+            self._upload_part(bytes(self.buffer))
+            self.buffer.clear()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+        )
+    
+    def abort(self) -> None:
+        """放弃上传，已上传的分段由对象存储清理"""
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+class S3Storage(StorageBackend):
+    """S3兼容对象存储（AWS S3、MinIO等）
+    
+    生成结果以分段上传流式写入，下载时返回预签名地址，由对象存储直接提供文件。
+    """
+    
+    def __init__(self):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise RuntimeError("使用S3存储需要安装boto3")
+        
+        config = Config(signature_version="s3v4", s3={"addressing_style": settings.S3_ADDRESSING_STYLE})
+        options = {
+            "region_name": settings.S3_REGION or None,
+            "aws_access_key_id": settings.S3_ACCESS_KEY or None,
+            "aws_secret_access_key": settings.S3_SECRET_KEY or None,
+            "config": config
+        }
+        self.client = boto3.client("s3", endpoint_url=settings.S3_ENDPOINT_URL or None, **options)
+        # 服务内部访问地址与客户端访问地址不同时（如容器内的MinIO），预签名使用对外地址
+        public_endpoint = settings.S3_PUBLIC_ENDPOINT_URL or settings.S3_ENDPOINT_URL
+        self.presign_client = boto3.client("s3", endpoint_url=public_endpoint or None, **options)
+        self.bucket = settings.S3_BUCKET
+        self.prefix = settings.S3_PREFIX
+    
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+    
+    @contextmanager
+    def open_writer(self, key: str, content_type: str) -> Iterator[BinaryIO]:
+        writer = S3MultipartWriter(
+            self.client, self.bucket, self._key(key), content_type, settings.S3_MULTIPART_CHUNK_SIZE
+        )
+        try:
+            yield writer
+            writer.complete()
+        except Exception:
+            writer.abort()
+            raise
+    
+    @contextmanager
+    def open_directory(self, prefix: str) -> Iterator[str]:
+        with tempfile.TemporaryDirectory() as directory:
+            yield directory
+            for entry in os.scandir(directory):
+                if entry.is_file():
+                    self.client.upload_file(
+                        entry.path, self.bucket, self._key(f"{prefix}/{entry.name}"),
+                        ExtraArgs={"ContentType": "application/vnd.google-earth.kml+xml"}
+                    )
+    
+    def exists(self, key: str) -> bool:
+        return self._head(key) is not None
+    
+    def size(self, key: str) -> int:
+        head = self._head(key)
+        return head["ContentLength"] if head else 0
+    
+    def _head(self, key: str) -> Optional[dict]:
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+    
+    def _list(self, prefix: str) -> Iterator[dict]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(f"{prefix}/")):
+            yield from page.get("Contents", [])
+    
+    def directory_size(self, prefix: str) -> int:
+        return sum(item["Size"] for item in self._list(prefix))
+    
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+    
+    def delete_directory(self, prefix: str) -> None:
+        keys = [{"Key": item["Key"]} for item in self._list(prefix)]
+        # 单次批量删除最多1000个对象
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys[start:start + 1000]})
+    
+    def download_url(self, key: str, filename: str) -> Optional[str]:
+        return self.presign_client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self._key(key),
+                "ResponseContentDisposition": f'attachment; filename="{filename}"'
+            },
+            ExpiresIn=settings.S3_PRESIGN_EXPIRES_SECONDS
+        )
+
+
+_storage: Optional[StorageBackend] = None
+
+
+def get_storage() -> StorageBackend:
+    """按配置创建（每个进程一次）生成结果存储后端"""
+    global _storage
+    if _storage is None:
+        if settings.STORAGE_BACKEND == "s3":
+            _storage = S3Storage()
+        elif settings.STORAGE_BACKEND == "local":
+            _storage = LocalStorage(settings.KML_DIR)
+        else:
+            raise RuntimeError(f"不支持的存储后端: {settings.STORAGE_BACKEND}")
+    return _storage
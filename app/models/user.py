@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, JSON, Index
 from sqlalchemy.sql import func
 from app.core.database import Base
 
@@ -18,6 +18,7 @@ class User(Base):
 class GenerateHistory(Base):
     """生成历史模型"""
     __tablename__ = "generate_history"
+    __table_args__ = (Index("ix_generate_history_user_created", "user_id", "created_at", "id"),)
     
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     user_id = Column(Integer, nullable=False)
@@ -26,3 +27,42 @@ class GenerateHistory(Base):
     kml_url = Column(String, nullable=False)
     status = Column(String, nullable=False, default="success")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class UploadedFile(Base):
+    """上传文件模型"""
+    __tablename__ = "uploaded_files"
+    __table_args__ = (Index("ix_uploaded_files_user_hash", "user_id", "content_hash"),)
+    
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    file_id = Column(String, unique=True, index=True, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    file_name = Column(String, nullable=False)  # 用户上传时的原始文件名
+    stored_name = Column(String, nullable=False)  # 上传目录中的文件名
+    file_size = Column(BigInteger, nullable=False, default=0)
+    content_hash = Column(String, nullable=False)
+    columns = Column(JSON, nullable=True)  # 列名，后台解析完成前为空
+    row_count = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_accessed_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+class KMLCacheEntry(Base):
+    """KML生成结果缓存模型"""
+    __tablename__ = "kml_cache"
+    
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    cache_key = Column(String, unique=True, index=True, nullable=False)
+    kml_filename = Column(String, nullable=False)
+    file_size = Column(BigInteger, nullable=False, default=0)
+    hit_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_accessed_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+class IdBlock(Base):
+    """ID分配模型，按hi/lo方式每次预留一段ID，next_id为下一段的起始值"""
+    __tablename__ = "id_blocks"
+    
+    name = Column(String, primary_key=True)
+    next_id = Column(BigInteger, nullable=False)
@@ -13,9 +13,26 @@ class KMLGenerateRequest(BaseModel):
 class KMLGenerateResponse(BaseModel):
     """KML生成响应"""
     code: int = 0
-    message: str = "生成成功"
-    kml_url: str
+    message: str = "任务已提交"
+    job_id: str
+    status: str
+    history_id: int
+    kml_url: Optional[str] = None
+
+
+class KMLJobStatusResponse(BaseModel):
+    """KML生成任务状态响应"""
+    code: int = 0
+    message: str = "获取成功"
+    job_id: str
+    status: str
+    stage: str
+    rows_processed: int = 0
+    total_rows: Optional[int] = None
+    dropped_points: Optional[int] = Field(default=None, description="去重抽稀丢弃的RSRP采样点数")
     history_id: int
+    kml_url: Optional[str] = None
+    error: Optional[str] = None
 
 
 class GenerateHistoryItem(BaseModel):
@@ -36,6 +53,7 @@ class GenerateHistoryResponse(BaseModel):
     code: int = 0
     message: str = "获取成功"
     data: List[GenerateHistoryItem]
+    next_cursor: Optional[int] = Field(default=None, description="下一页游标，没有更多记录时为空")
 
 
 class FileUploadResponse(BaseModel):
@@ -44,3 +62,22 @@ class FileUploadResponse(BaseModel):
     message: str = "上传成功"
     file_id: str
     file_name: str
+
+
+class ChunkedUploadInitRequest(BaseModel):
+    """分片上传初始化请求"""
+    file_name: str = Field(..., description="文件名")
+    file_size: int = Field(..., description="文件大小（字节）")
+
+
+class ChunkedUploadStatusResponse(BaseModel):
+    """分片上传状态响应"""
+    code: int = 0
+    message: str = "获取成功"
+    upload_id: str
+    file_name: str
+    file_size: int
+    chunk_size: int = Field(..., description="分片大小，分片偏移量须为其整数倍")
+    received_offsets: List[int] = Field(..., description="已接收分片的偏移量")
+    received_bytes: int
+    complete: bool = Field(..., description="是否已接收全部分片")
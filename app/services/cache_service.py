@@ -0,0 +1,112 @@
+import asyncio
+import hashlib
+import json
+from typing import Optional, Dict, Any
+from sqlalchemy import select, update, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.models.user import KMLCacheEntry
+from app.services.file_service import FileService
+from app.services.lifecycle_service import LifecycleService
+
+
+class CacheService:
+    """KML生成结果缓存服务
+    
+    以 上传文件内容哈希 + 图层类型 + 输出格式 + 规范化配置 作为缓存键，
+    相同文件与配置的重复生成直接复用已有的KML文件。
+    缓存文件总大小超过上限时，按最近访问时间淘汰最久未使用的文件。
+    """
+    
+    @staticmethod
+    def build_cache_key(content_hash: str, layer_type: str, config: Optional[Dict[str, Any]] = None,
+                        output_format: str = "kml", base_url: str = "",
+                        spatial_filter: Optional[Dict[str, Any]] = None) -> str:
+        """生成缓存键，base_url为分块KML中链接使用的访问地址，spatial_filter为范围过滤条件"""
+        normalized_config = json.dumps(config or {}, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        normalized_filter = json.dumps(spatial_filter or {}, sort_keys=True, separators=(",", ":"))
+        raw_key = "\n".join([content_hash, layer_type, output_format, normalized_config, base_url, normalized_filter])
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    async def lookup(db: AsyncSession, cache_key: str) -> Optional[str]:
+        """查找缓存，命中时返回KML文件名并刷新访问时间"""
+        result = await db.execute(select(KMLCacheEntry).where(KMLCacheEntry.cache_key == cache_key))
+        entry = result.scalar_one_or_none()
+        if not entry:
+            return None
+        
+        # 文件已被删除时清理失效的缓存记录
+        if not await asyncio.to_thread(FileService().kml_exists, entry.kml_filename):
+            await db.delete(entry)
+            await db.commit()
+            return None
+        
+        entry.hit_count += 1
+        entry.last_accessed_at = func.now()
+        await db.commit()
+        return entry.kml_filename
+    
+    @staticmethod
+    async def touch(db: AsyncSession, *kml_filenames: str) -> None:
+        """下载生成结果或签发预签名下载地址时刷新访问时间"""
+        await db.execute(
+            update(KMLCacheEntry)
+            .where(KMLCacheEntry.kml_filename.in_(kml_filenames))
+            .values(last_accessed_at=func.now())
+        )
+        await db.commit()
+    
+    @staticmethod
+    async def store(db: AsyncSession, cache_key: str, kml_filename: str) -> str:
+        """登记新生成的KML文件，并按总大小上限淘汰旧文件
+        
+        返回缓存中的文件名：相同请求并发生成时只保留先登记的结果，后生成的文件删除。
+        """
+        file_service = FileService()
+        if not await asyncio.to_thread(file_service.kml_exists, kml_filename):
+            raise FileNotFoundError(f"生成结果不存在: {kml_filename}")
+        
+        db.add(KMLCacheEntry(
+            cache_key=cache_key,
+            kml_filename=kml_filename,
+            file_size=await asyncio.to_thread(file_service.get_kml_size, kml_filename)
+        ))
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            existing = await db.scalar(
+                select(KMLCacheEntry.kml_filename).where(KMLCacheEntry.cache_key == cache_key)
+            )
+            if not existing:
+                raise
+            if existing != kml_filename:
+                await asyncio.to_thread(file_service.delete_kml, kml_filename)
+            return existing
+        
+        await CacheService.evict(db, exclude=kml_filename)
+        return kml_filename
+    
+    @staticmethod
+    async def evict(db: AsyncSession, exclude: Optional[str] = None) -> int:
+        """淘汰最久未访问的缓存文件，直到总大小不超过上限，返回淘汰数量"""
+        total_size = await db.scalar(select(func.coalesce(func.sum(KMLCacheEntry.file_size), 0)))
+        if total_size <= settings.KML_CACHE_MAX_BYTES:
+            return 0
+        
+        evicted = []
+        result = await db.execute(
+            select(KMLCacheEntry).order_by(KMLCacheEntry.last_accessed_at, KMLCacheEntry.id)
+        )
+        for entry in result.scalars().all():
+            if total_size <= settings.KML_CACHE_MAX_BYTES:
+                break
+            if entry.kml_filename == exclude:
+                continue
+            evicted.append(entry)
+            total_size -= entry.file_size
+        
+        await LifecycleService.evict_kml(db, evicted)
+        return len(evicted)
@@ -1,8 +1,72 @@
+import asyncio
+import hashlib
+import json
 import os
+import re
+import shutil
 import uuid
-from typing import Optional
-from fastapi import UploadFile, HTTPException
+import zipfile
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional, Iterator, Tuple, BinaryIO, List, Dict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from fastapi import HTTPException, Request
+from multipart.multipart import MultipartParser, parse_options_header
 from app.core.config import settings
+from app.core.storage import get_storage, LocalStorage
+from app.utils.spatial_index import build_grid_index
+
+
+# 输出格式对应的媒体类型
+KML_MEDIA_TYPES = {
+    "kml": "application/vnd.google-earth.kml+xml",
+    "kmz": "application/vnd.google-earth.kmz"
+}
+
+# 分块输出：目录内为各层级的分块KML与入口文件
+TILED_FORMAT = "tiles"
+TILE_ROOT_NAME = "doc.kml"
+# 分块KML包内的文件名：{图层类型}_{uuid}/{入口文件或 层级_x_y.kml}
+TILE_FILE_PATTERN = re.compile(
+    r"[a-z]+_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+    rf"/(?:{re.escape(TILE_ROOT_NAME)}|\d+_\d+_\d+\.kml)"
+)
+
+# 支持的输出格式
+OUTPUT_FORMATS = tuple(KML_MEDIA_TYPES) + (TILED_FORMAT,)
+
+# 下载分块大小与gzip压缩级别
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+GZIP_LEVEL = 6
+
+# 支持上传的文件类型与multipart表单中的文件字段名
+UPLOAD_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+UPLOAD_FIELD_NAME = "file"
+
+# multipart边界与表单头允许的额外字节数（用于按Content-Length提前拒绝）
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+# 接收中的上传文件后缀，完成后才改为正式文件名
+UPLOAD_PARTIAL_SUFFIX = ".part"
+
+# 分片上传：任务信息与已接收分片标记（每个分片一个字节）的文件后缀
+CHUNKED_UPLOAD_SUFFIX = ".upload.json"
+CHUNKED_RECEIVED_SUFFIX = ".chunks"
+
+# 内容哈希的旁路文件后缀与内容长度（SHA-256十六进制）
+HASH_SUFFIX = ".sha256"
+HASH_HEX_LENGTH = 64
+
+# 解析结果列式缓存（Arrow IPC，不压缩以便内存映射）的文件后缀
+COLUMNAR_SUFFIX = ".arrow"
+
+# 经纬度空间索引的目录后缀，每个数组保存为一个.npy文件，查询时按内存映射读取
+SPATIAL_INDEX_SUFFIX = ".sidx"
+SPATIAL_INDEX_COLUMNS = "columns.npy"
 
 
 class FileService:
@@ -12,42 +76,316 @@ class FileService:
         """初始化文件服务"""
         # 确保上传目录存在
         os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-        os.makedirs(settings.KML_DIR, exist_ok=True)
+        
+        # 生成结果存储（本地磁盘或对象存储）
+        self.storage = get_storage()
     
-    async def upload_file(self, file: UploadFile) -> dict:
-        """上传文件"""
-        # 验证文件类型
-        if not file.filename.endswith(('.xlsx', '.xls', '.csv')):
-            raise HTTPException(status_code=400, detail="只支持Excel和CSV文件")
+    async def upload_file(self, request: Request) -> dict:
+        """流式接收multipart上传的文件
         
-        # 验证文件大小
-        file.file.seek(0, 2)  # 移动到文件末尾
-        file_size = file.file.tell()  # 获取文件大小
-        file.file.seek(0)  # 重置文件指针
+        请求体边接收边解析，文件内容分块写入磁盘并同步计算SHA-256，
+        超过大小限制时立即中止；文件读写在线程中执行，不阻塞事件循环。
+        """
+        # 按Content-Length提前拒绝明显超限的请求
+        content_length = request.headers.get("Content-Length", "")
+        if content_length.isdigit() and int(content_length) > settings.MAX_FILE_SIZE + UPLOAD_FORM_OVERHEAD:
+            raise self._file_size_error()
         
-        if file_size > settings.MAX_FILE_SIZE:
-            raise HTTPException(status_code=400, detail=f"文件大小超过限制（最大{settings.MAX_FILE_SIZE // 1024 // 1024}MB）")
+        content_type, params = parse_options_header(request.headers.get("Content-Type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise HTTPException(status_code=400, detail="请以multipart/form-data格式上传文件")
+        
+        # 解析器以回调方式产出事件，每收到一块数据后统一处理
+        events = []
+        parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": lambda: events.append(("part_begin", b"")),
+            "on_header_field": lambda data, start, end: events.append(("header_field", data[start:end])),
+            "on_header_value": lambda data, start, end: events.append(("header_value", data[start:end])),
+            "on_header_end": lambda: events.append(("header_end", b"")),
+            "on_headers_finished": lambda: events.append(("headers_finished", b"")),
+            "on_part_data": lambda data, start, end: events.append(("part_data", data[start:end])),
+            "on_part_end": lambda: events.append(("part_end", b""))
+        })
+        
+        upload = None
+        receiving = False
+        part_headers = {}
+        header_field = header_value = b""
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                data = []
+                for event, value in events:
+                    if event == "part_begin":
+                        part_headers = {}
+                    elif event == "header_field":
+                        header_field += value
+                    elif event == "header_value":
+                        header_value += value
+                    elif event == "header_end":
+                        part_headers[header_field.lower()] = header_value
+                        header_field = header_value = b""
+                    elif event == "headers_finished":
+                        _, options = parse_options_header(part_headers.get(b"content-disposition", b""))
+                        filename = options.get(b"filename")
+                        receiving = (
+                            upload is None and filename is not None
+                            and options.get(b"name") == UPLOAD_FIELD_NAME.encode()
+                        )
+                        if receiving:
+                            upload = await self._open_upload(filename.decode("utf-8", errors="replace"))
+                    elif event == "part_data" and receiving:
+                        data.append(value)
+                    elif event == "part_end":
+                        receiving = False
+                events.clear()
+                
+                if data:
+                    data = b"".join(data)
+                    upload["size"] += len(data)
+                    if upload["size"] > settings.MAX_FILE_SIZE:
+                        raise self._file_size_error()
+                    await asyncio.to_thread(self._write_upload_chunk, upload, data)
+            parser.finalize()
+            
+            if upload is None:
+                raise HTTPException(status_code=400, detail="未找到上传文件")
+            await asyncio.to_thread(self._finish_upload, upload)
+        except Exception:
+            if upload is not None:
+                await asyncio.to_thread(self._discard_upload, upload)
+            raise
+        
+        return {
+            "file_id": upload["file_id"],
+            "file_name": upload["file_name"],
+            "stored_path": upload["stored_path"],
+            "file_size": upload["size"],
+            "content_hash": upload["content_hash"]
+        }
+    
+    async def _open_upload(self, file_name: str) -> dict:
+        """校验文件类型并创建接收中的临时文件"""
+        if not file_name.endswith(UPLOAD_EXTENSIONS):
+            raise HTTPException(status_code=400, detail="只支持Excel和CSV文件")
         
         # 生成唯一文件名
         file_id = str(uuid.uuid4())
-        file_ext = os.path.splitext(file.filename)[1]
-        stored_filename = f"{file_id}{file_ext}"
-        stored_path = os.path.join(settings.UPLOAD_DIR, stored_filename)
-        
-        # 保存文件
+        file_ext = os.path.splitext(file_name)[1]
+        stored_path = os.path.join(settings.UPLOAD_DIR, f"{file_id}{file_ext}")
+        partial_path = stored_path + UPLOAD_PARTIAL_SUFFIX
         try:
-            with open(stored_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
-        except Exception as e:
+            fp = await asyncio.to_thread(open, partial_path, "wb")
+        except OSError as e:
             raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
         
         return {
             "file_id": file_id,
-            "file_name": file.filename,
-            "stored_path": stored_path
+            "file_name": file_name,
+            "stored_path": stored_path,
+            "partial_path": partial_path,
+            "fp": fp,
+            "digest": hashlib.sha256(),
+            "size": 0,
+            "content_hash": None
         }
     
+    def _write_upload_chunk(self, upload: dict, data: bytes) -> None:
+        """写入一块上传数据并更新哈希"""
+        upload["fp"].write(data)
+        upload["digest"].update(data)
+    
+    def _finish_upload(self, upload: dict) -> None:
+        """接收完成后改为正式文件名并记录内容哈希"""
+        upload["fp"].close()
+        os.replace(upload["partial_path"], upload["stored_path"])
+        upload["content_hash"] = upload["digest"].hexdigest()
+        self._write_hash(upload["file_id"], upload["content_hash"])
+    
+    def _discard_upload(self, upload: dict) -> None:
+        """上传中止时删除不完整的文件"""
+        upload["fp"].close()
+        self.delete_file(upload["partial_path"])
+        self.delete_file(upload["stored_path"])
+    
+    @staticmethod
+    def _file_size_error() -> HTTPException:
+        """文件超过大小限制的错误"""
+        return HTTPException(
+            status_code=400, detail=f"文件大小超过限制（最大{settings.MAX_FILE_SIZE // 1024 // 1024}MB）"
+        )
+    
+    def init_chunked_upload(self, user_id: int, file_name: str, file_size: int) -> dict:
+        """创建分片上传任务
+        
+        按文件大小预先创建接收文件，各分片直接写入其最终位置；
+        任务ID即完成后的文件ID。
+        """
+        if not file_name.endswith(UPLOAD_EXTENSIONS):
+            raise HTTPException(status_code=400, detail="只支持Excel和CSV文件")
+        if file_size <= 0:
+            raise HTTPException(status_code=400, detail="文件大小无效")
+        if file_size > settings.MAX_FILE_SIZE:
+            raise self._file_size_error()
+        
+        upload_id = str(uuid.uuid4())
+        file_ext = os.path.splitext(file_name)[1]
+        upload = {
+            "upload_id": upload_id,
+            "user_id": user_id,
+            "file_name": file_name,
+            "file_ext": file_ext,
+            "file_size": file_size,
+            "chunk_size": settings.UPLOAD_CHUNK_SIZE,
+            "created_at": datetime.now().isoformat(timespec="seconds")
+        }
+        
+        partial_path = os.path.join(settings.UPLOAD_DIR, f"{upload_id}{file_ext}{UPLOAD_PARTIAL_SUFFIX}")
+        with open(partial_path, "wb") as f:
+            f.truncate(file_size)
+        with open(self._chunked_path(upload_id, CHUNKED_RECEIVED_SUFFIX), "wb") as f:
+            f.write(bytes(self._chunk_count(upload)))
+        with open(self._chunked_path(upload_id, CHUNKED_UPLOAD_SUFFIX), "w", encoding="utf-8") as f:
+            json.dump(upload, f, ensure_ascii=False)
+        
+        return self.get_chunked_upload(upload_id, user_id)
+    
+    def get_chunked_upload(self, upload_id: str, user_id: int) -> dict:
+        """获取分片上传任务及已接收的分片偏移量"""
+        upload = self._load_chunked_upload(upload_id, user_id)
+        with open(self._chunked_path(upload_id, CHUNKED_RECEIVED_SUFFIX), "rb") as f:
+            received = f.read()
+        
+        chunk_size = upload["chunk_size"]
+        received_offsets = [index * chunk_size for index, flag in enumerate(received) if flag]
+        received_bytes = sum(min(chunk_size, upload["file_size"] - offset) for offset in received_offsets)
+        return {
+            "upload_id": upload_id,
+            "file_name": upload["file_name"],
+            "file_size": upload["file_size"],
+            "chunk_size": chunk_size,
+            "received_offsets": received_offsets,
+            "received_bytes": received_bytes,
+            "complete": len(received_offsets) == len(received)
+        }
+    
+    async def write_chunk(self, upload_id: str, user_id: int, offset: int, request: Request) -> dict:
+        """流式接收一个分片并写入接收文件的对应位置
+        
+        偏移量须为分片大小的整数倍，除最后一个分片外长度须等于分片大小；
+        重复上传同一分片时覆盖原内容。
+        """
+        upload = await asyncio.to_thread(self._load_chunked_upload, upload_id, user_id)
+        chunk_size, file_size = upload["chunk_size"], upload["file_size"]
+        if offset < 0 or offset >= file_size or offset % chunk_size:
+            raise HTTPException(status_code=400, detail=f"分片偏移量无效，应为{chunk_size}的整数倍")
+        expected = min(chunk_size, file_size - offset)
+        
+        # 写入前先取消标记，中途失败时该分片需重新上传
+        index = offset // chunk_size
+        await asyncio.to_thread(self._mark_chunk, upload_id, index, False)
+        
+        partial_path = os.path.join(settings.UPLOAD_DIR, f"{upload_id}{upload['file_ext']}{UPLOAD_PARTIAL_SUFFIX}")
+        fp = await asyncio.to_thread(open, partial_path, "r+b")
+        try:
+            await asyncio.to_thread(fp.seek, offset)
+            received = 0
+            async for data in request.stream():
+                received += len(data)
+                if received > expected:
+                    break
+                if data:
+                    await asyncio.to_thread(fp.write, data)
+        finally:
+            await asyncio.to_thread(fp.close)
+        if received != expected:
+            raise HTTPException(status_code=400, detail=f"分片大小不正确，应为{expected}字节")
+        
+        await asyncio.to_thread(self._mark_chunk, upload_id, index, True)
+        return await asyncio.to_thread(self.get_chunked_upload, upload_id, user_id)
+    
+    async def complete_chunked_upload(self, upload_id: str, user_id: int) -> dict:
+        """所有分片接收完成后生成正式文件，返回与普通上传相同的结果"""
+        status = await asyncio.to_thread(self.get_chunked_upload, upload_id, user_id)
+        if not status["complete"]:
+            missing = self._chunk_count(status) - len(status["received_offsets"])
+            raise HTTPException(status_code=400, detail=f"分片未全部上传（缺少{missing}个）")
+        
+        upload = await asyncio.to_thread(self._load_chunked_upload, upload_id, user_id)
+        stored_path = os.path.join(settings.UPLOAD_DIR, f"{upload_id}{upload['file_ext']}")
+        content_hash = await asyncio.to_thread(self._finish_chunked_upload, upload, stored_path)
+        return {
+            "file_id": upload_id,
+            "file_name": upload["file_name"],
+            "stored_path": stored_path,
+            "file_size": upload["file_size"],
+            "content_hash": content_hash
+        }
+    
+    def _finish_chunked_upload(self, upload: dict, stored_path: str) -> str:
+        """计算内容哈希、改为正式文件名并清理任务文件"""
+        upload_id = upload["upload_id"]
+        partial_path = stored_path + UPLOAD_PARTIAL_SUFFIX
+        content_hash = self._hash_file(partial_path)
+        
+        os.replace(partial_path, stored_path)
+        self._write_hash(upload_id, content_hash)
+        self.delete_file(self._chunked_path(upload_id, CHUNKED_UPLOAD_SUFFIX))
+        self.delete_file(self._chunked_path(upload_id, CHUNKED_RECEIVED_SUFFIX))
+        return content_hash
+    
+    def _load_chunked_upload(self, upload_id: str, user_id: int) -> dict:
+        """读取分片上传任务，不存在或不属于该用户时报404"""
+        try:
+            uuid.UUID(upload_id)
+            with open(self._chunked_path(upload_id, CHUNKED_UPLOAD_SUFFIX), "r", encoding="utf-8") as f:
+                upload = json.load(f)
+        except (ValueError, OSError):
+            upload = None
+        if upload is None or upload["user_id"] != user_id:
+            raise HTTPException(status_code=404, detail="上传任务不存在")
+        return upload
+    
+    def _mark_chunk(self, upload_id: str, index: int, received: bool) -> None:
+        """标记分片是否已接收（按位置写入单个字节，并发上传不同分片互不影响）"""
+        fd = os.open(self._chunked_path(upload_id, CHUNKED_RECEIVED_SUFFIX), os.O_WRONLY)
+        try:
+            os.pwrite(fd, b"\x01" if received else b"\x00", index)
+        finally:
+            os.close(fd)
+    
+    def sweep_chunked_uploads(self, max_age_seconds: int) -> int:
+        """删除超过指定时间没有新分片的分片上传任务，返回删除数量"""
+        expire_before = datetime.now().timestamp() - max_age_seconds
+        swept = 0
+        for entry in os.scandir(settings.UPLOAD_DIR):
+            if not entry.name.endswith(CHUNKED_UPLOAD_SUFFIX):
+                continue
+            upload_id = entry.name[:-len(CHUNKED_UPLOAD_SUFFIX)]
+            received_path = self._chunked_path(upload_id, CHUNKED_RECEIVED_SUFFIX)
+            try:
+                if os.path.getmtime(received_path) >= expire_before:
+                    continue
+                with open(entry.path, "r", encoding="utf-8") as f:
+                    file_ext = json.load(f)["file_ext"]
+            except (OSError, ValueError, KeyError):
+                continue
+            self.delete_file(os.path.join(settings.UPLOAD_DIR, f"{upload_id}{file_ext}{UPLOAD_PARTIAL_SUFFIX}"))
+            self.delete_file(received_path)
+            self.delete_file(entry.path)
+            swept += 1
+        return swept
+    
+    @staticmethod
+    def _chunked_path(upload_id: str, suffix: str) -> str:
+        """分片上传任务文件的路径"""
+        return os.path.join(settings.UPLOAD_DIR, f"{upload_id}{suffix}")
+    
+    @staticmethod
+    def _chunk_count(upload: dict) -> int:
+        """分片数量"""
+        return -(-upload["file_size"] // upload["chunk_size"])
+    
     def get_file_path(self, file_id: str) -> Optional[str]:
         """获取文件路径"""
         # 查找文件
@@ -57,28 +395,389 @@ class FileService:
                 return file_path
         return None
     
+    def read_table(self, file_path: str) -> pd.DataFrame:
+        """读取上传文件为DataFrame
+        
+        首次读取时解析原始文件，并把结果转换为Arrow列式文件缓存在原文件旁；
+        之后直接以内存映射方式加载列式文件，不再重复解析Excel/CSV。
+        """
+        columnar_path = os.path.splitext(file_path)[0] + COLUMNAR_SUFFIX
+        df = self._read_columnar(file_path, columnar_path)
+        if df is not None:
+            return df
+        
+        df = self.parse_file(file_path)
+        self._write_columnar(df, columnar_path)
+        return df
+    
+    def read_rows(self, file_path: str, rows: np.ndarray) -> pd.DataFrame:
+        """只读取指定行号的数据
+        
+        有列式缓存时通过内存映射只取出这些行，不加载整表。
+        """
+        columnar_path = os.path.splitext(file_path)[0] + COLUMNAR_SUFFIX
+        df = self._read_columnar(file_path, columnar_path, rows=rows)
+        if df is not None:
+            return df
+        return self.read_table(file_path).iloc[rows].reset_index(drop=True)
+    
+    def read_columns(self, file_path: str, columns: List[str]) -> pd.DataFrame:
+        """只读取指定列的数据，缺少的列不报错"""
+        columnar_path = os.path.splitext(file_path)[0] + COLUMNAR_SUFFIX
+        df = self._read_columnar(file_path, columnar_path, columns=columns)
+        if df is not None:
+            return df
+        
+        # 首次读取时解析原始文件并写入列式缓存
+        df = self.read_table(file_path)
+        return df[[col for col in columns if col in df.columns]]
+    
+    def _read_columnar(self, file_path: str, columnar_path: str, columns: Optional[List[str]] = None,
+                       rows: Optional[np.ndarray] = None) -> Optional[pd.DataFrame]:
+        """以内存映射方式读取列式缓存，缓存不存在或已过期时返回None"""
+        if not os.path.exists(columnar_path) or os.path.getmtime(columnar_path) < os.path.getmtime(file_path):
+            return None
+        try:
+            table = feather.read_table(columnar_path, memory_map=True)
+            if columns is not None:
+                table = table.select([col for col in columns if col in table.column_names])
+            if rows is not None:
+                table = table.take(pa.array(rows, type=pa.int64()))
+            df = table.to_pandas()
+        except (pa.ArrowException, OSError):
+            # 缓存文件损坏时重新解析
+            self.delete_file(columnar_path)
+            return None
+        
+        # Arrow的空值在文本列中还原为None，与pandas解析结果保持一致改回NaN
+        text_cols = df.columns[df.dtypes == object]
+        df[text_cols] = df[text_cols].where(df[text_cols].notna(), np.nan)
+        return df
+    
+    def read_schema(self, file_path: str) -> dict:
+        """读取上传文件的列名与数据行数
+        
+        CSV只解析首列分块计数，内存占用与文件大小无关；
+        Excel整表解析并写入列式缓存，之后的生成直接加载缓存。
+        """
+        if file_path.endswith('.csv'):
+            columns = pd.read_csv(file_path, encoding='utf-8', nrows=0).columns
+            row_count = 0
+            with pd.read_csv(file_path, encoding='utf-8', on_bad_lines='skip', usecols=[0],
+                             chunksize=settings.CSV_CHUNK_ROWS) as reader:
+                for chunk in reader:
+                    row_count += len(chunk)
+        else:
+            df = self.read_table(file_path)
+            columns, row_count = df.columns, len(df)
+        return {"columns": [str(col) for col in columns], "row_count": row_count}
+    
+    def parse_file(self, file_path: str) -> pd.DataFrame:
+        """解析原始的Excel/CSV文件"""
+        if file_path.endswith('.csv'):
+            return pd.read_csv(file_path, encoding='utf-8', on_bad_lines='skip')
+        return pd.read_excel(file_path)
+    
+    def _write_columnar(self, df: pd.DataFrame, columnar_path: str) -> bool:
+        """将解析结果写入列式缓存文件
+        
+        混合类型的列无法无损转换为Arrow，此时不缓存，下次仍解析原始文件。
+        """
+        temp_path = f"{columnar_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            feather.write_feather(table, temp_path, compression="uncompressed")
+            os.replace(temp_path, columnar_path)
+            return True
+        except (pa.ArrowException, OSError):
+            self.delete_file(temp_path)
+            return False
+    
+    def get_spatial_index(self, file_path: str, lon_col: str, lat_col: str) -> Dict[str, np.ndarray]:
+        """获取上传文件的经纬度空间索引
+        
+        索引在首次按范围过滤时构建，保存在原文件旁，之后的区域提取以内存映射方式加载，
+        查询只读取与范围相交的格子；经纬度字段变化或原文件更新时重新构建。
+        """
+        index_dir = os.path.splitext(file_path)[0] + SPATIAL_INDEX_SUFFIX
+        index = self._load_spatial_index(index_dir, file_path, [lon_col, lat_col])
+        if index is not None:
+            return index
+        
+        df = self.read_columns(file_path, [lon_col, lat_col])
+        for col in [lon_col, lat_col]:
+            if col not in df.columns:
+                raise ValueError(f"缺少必要字段: {col}")
+        index = build_grid_index(
+            pd.to_numeric(df[lon_col], errors="coerce").to_numpy(dtype=np.float64),
+            pd.to_numeric(df[lat_col], errors="coerce").to_numpy(dtype=np.float64)
+        )
+        
+        self._write_spatial_index(index_dir, [lon_col, lat_col], index)
+        return index
+    
+    @staticmethod
+    def _load_spatial_index(index_dir: str, file_path: str, columns: List[str]) -> Optional[Dict[str, np.ndarray]]:
+        """以内存映射方式加载空间索引，索引不存在、已过期或经纬度字段不同时返回None"""
+        columns_path = os.path.join(index_dir, SPATIAL_INDEX_COLUMNS)
+        try:
+            if os.path.getmtime(columns_path) < os.path.getmtime(file_path):
+                return None
+            if np.load(columns_path).tolist() != columns:
+                return None
+            return {
+                entry.name[:-len(".npy")]: np.load(entry.path, mmap_mode="r")
+                for entry in os.scandir(index_dir)
+                if entry.name.endswith(".npy") and entry.name != SPATIAL_INDEX_COLUMNS
+            }
+        except (OSError, ValueError):
+            return None
+    
+    @staticmethod
+    def _write_spatial_index(index_dir: str, columns: List[str], index: Dict[str, np.ndarray]) -> None:
+        """在临时目录写入空间索引后整体替换原索引，写入失败时不保留索引"""
+        temp_dir = f"{index_dir}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(temp_dir)
+            for name, array in index.items():
+                np.save(os.path.join(temp_dir, f"{name}.npy"), array)
+            np.save(os.path.join(temp_dir, SPATIAL_INDEX_COLUMNS), np.array(columns))
+            shutil.rmtree(index_dir, ignore_errors=True)
+            os.rename(temp_dir, index_dir)
+        except OSError:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    
+    def get_file_hash(self, file_id: str) -> Optional[str]:
+        """获取上传文件的内容哈希（SHA-256）
+        
+        优先读取上传时记录的哈希，缺失时（如旧文件）重新计算并补记。
+        """
+        hash_path = os.path.join(settings.UPLOAD_DIR, f"{file_id}{HASH_SUFFIX}")
+        if os.path.exists(hash_path):
+            with open(hash_path, "r") as f:
+                return f.read().strip()
+        
+        file_path = self.get_file_path(file_id)
+        if not file_path:
+            return None
+        
+        content_hash = self._hash_file(file_path)
+        self._write_hash(file_id, content_hash)
+        return content_hash
+    
+    @staticmethod
+    def _hash_file(file_path: str) -> str:
+        """分块计算文件的SHA-256"""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            while True:
+                chunk = f.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def _write_hash(self, file_id: str, content_hash: str) -> None:
+        """记录上传文件的内容哈希"""
+        hash_path = os.path.join(settings.UPLOAD_DIR, f"{file_id}{HASH_SUFFIX}")
+        with open(hash_path, "w") as f:
+            f.write(content_hash)
+    
     def save_kml_file(self, kml_content: bytes, layer_type: str) -> str:
         """保存KML文件"""
         # 生成唯一文件名
         file_id = str(uuid.uuid4())
         stored_filename = f"{layer_type}_{file_id}.kml"
-        stored_path = os.path.join(settings.KML_DIR, stored_filename)
         
         # 保存文件
         try:
-            with open(stored_path, "wb") as f:
+            with self.storage.open_writer(stored_filename, KML_MEDIA_TYPES["kml"]) as f:
                 f.write(kml_content)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"KML文件保存失败: {str(e)}")
         
         return stored_filename
     
+    @contextmanager
+    def open_kml_file(self, layer_type: str, output_format: str = "kml") -> Iterator[Tuple[str, BinaryIO]]:
+        """打开新的KML/KMZ文件用于流式写入，返回(文件名, 文件对象)
+        
+        KMZ格式下返回的是压缩包内doc.kml条目的写入流，边写边压缩。
+        写入过程中出错时删除不完整的文件。
+        """
+        if output_format not in KML_MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail="不支持的输出格式")
+        
+        # 生成唯一文件名
+        file_id = str(uuid.uuid4())
+        stored_filename = f"{layer_type}_{file_id}.{output_format}"
+        
+        with self.storage.open_writer(stored_filename, KML_MEDIA_TYPES[output_format]) as f:
+            if output_format == "kmz":
+                with zipfile.ZipFile(f, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+                    with archive.open("doc.kml", "w", force_zip64=True) as entry:
+                        yield stored_filename, entry
+            else:
+                yield stored_filename, f
+    
+    @contextmanager
+    def open_tile_package(self, layer_type: str) -> Iterator[Tuple[str, str]]:
+        """创建分块KML的输出目录，返回(包名, 目录路径)，出错时删除整个目录
+        
+        对象存储后端下目录为本地临时目录，全部写完后再上传。
+        """
+        package_name = f"{layer_type}_{uuid.uuid4()}"
+        with self.storage.open_directory(package_name) as package_dir:
+            yield package_name, package_dir
+    
+    def iter_gzip_file(self, file_path: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+        """分块读取文件并以gzip格式压缩输出"""
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        with open(file_path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+        yield compressor.flush()
+    
+    def iter_file_range(self, file_path: str, start: int, end: int,
+                        chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+        """分块读取文件中 [start, end] 范围（含两端）的字节"""
+        remaining = end - start + 1
+        with open(file_path, "rb") as f:
+            f.seek(start)
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    
+    def get_kml_hash(self, kml_path: str) -> str:
+        """获取生成结果文件的内容哈希（SHA-256）
+        
+        生成结果写入后不再变化，首次下载时计算并记录在文件旁，之后直接读取。
+        """
+        hash_path = kml_path + HASH_SUFFIX
+        if os.path.exists(hash_path):
+            with open(hash_path, "r") as f:
+                return f.read().strip()
+        
+        content_hash = self._hash_file(kml_path)
+        with open(hash_path, "w") as f:
+            f.write(content_hash)
+        return content_hash
+    
     def get_kml_path(self, kml_filename: str) -> Optional[str]:
-        """获取KML文件路径"""
-        kml_path = os.path.join(settings.KML_DIR, kml_filename)
-        if os.path.exists(kml_path):
-            return kml_path
-        return None
+        """获取本地存储的KML文件路径（分块KML为 包名/文件名），不允许访问KML目录之外的文件"""
+        if not isinstance(self.storage, LocalStorage) or not self.storage.exists(kml_filename):
+            return None
+        return self.storage.path(kml_filename)
+    
+    def get_kml_download_url(self, kml_filename: str) -> Optional[str]:
+        """对象存储后端下客户端直接下载的预签名地址，本地存储时返回None"""
+        return self.storage.download_url(kml_filename, os.path.basename(kml_filename))
+    
+    def kml_exists(self, kml_filename: str) -> bool:
+        """生成结果是否存在"""
+        return self.storage.exists(kml_filename)
+    
+    def is_tile_file(self, kml_filename: str) -> bool:
+        """是否为分块KML包内的文件
+        
+        分块文件下载时不验证身份，只接受严格符合包名/分块名格式的文件名，
+        其他带路径的文件名（如 x/../普通文件.kml）一律按普通文件处理。
+        """
+        return TILE_FILE_PATTERN.fullmatch(kml_filename) is not None
+    
+    def get_kml_size(self, kml_filename: str) -> int:
+        """获取生成结果占用的空间，分块KML统计整个目录
+        
+        本地存储时每个文件首次下载时会在旁边记录内容哈希，按哈希长度预先计入。
+        """
+        if self.is_tile_file(kml_filename):
+            directory = os.path.dirname(kml_filename)
+            size = self.storage.directory_size(directory)
+            local_directory = self.storage.path(directory) if isinstance(self.storage, LocalStorage) else None
+            file_count = len(os.listdir(local_directory)) if local_directory and os.path.isdir(local_directory) else 0
+        else:
+            size = self.storage.size(kml_filename)
+            file_count = 1 if isinstance(self.storage, LocalStorage) else 0
+        return size + file_count * HASH_HEX_LENGTH
+    
+    def delete_kml(self, kml_filename: str) -> bool:
+        """删除生成结果，分块KML删除整个目录"""
+        try:
+            if self.is_tile_file(kml_filename):
+                self.storage.delete_directory(os.path.dirname(kml_filename))
+                return True
+            self.storage.delete(kml_filename + HASH_SUFFIX)
+            self.storage.delete(kml_filename)
+            return True
+        except Exception:
+            return False
+    
+    def delete_upload(self, file_path: str) -> None:
+        """删除上传文件及其哈希、列式缓存与空间索引"""
+        self.delete_file(file_path)
+        for derived_path in self._upload_derived_paths(file_path):
+            if os.path.isdir(derived_path):
+                shutil.rmtree(derived_path, ignore_errors=True)
+            else:
+                self.delete_file(derived_path)
+    
+    def get_upload_disk_sizes(self, file_paths: List[str]) -> List[int]:
+        """上传文件连同其哈希、列式缓存与空间索引实际占用的空间，与file_paths一一对应"""
+        return [
+            sum(self._file_size(path) for path in [file_path, *self._upload_derived_paths(file_path)])
+            for file_path in file_paths
+        ]
+    
+    def get_chunked_upload_sizes(self) -> Dict[int, int]:
+        """各用户未完成的分片上传占用的空间，按用户ID
+        
+        接收文件创建时已按文件大小预分配，与任务文件、分片标记一起计入。
+        """
+        sizes: Dict[int, int] = {}
+        for entry in os.scandir(settings.UPLOAD_DIR):
+            if not entry.name.endswith(CHUNKED_UPLOAD_SUFFIX):
+                continue
+            upload_id = entry.name[:-len(CHUNKED_UPLOAD_SUFFIX)]
+            try:
+                with open(entry.path, "r", encoding="utf-8") as f:
+                    upload = json.load(f)
+                user_id, file_ext = upload["user_id"], upload["file_ext"]
+                size = entry.stat().st_size
+            except (OSError, ValueError, KeyError):
+                continue
+            size += self._file_size(self._chunked_path(upload_id, CHUNKED_RECEIVED_SUFFIX))
+            size += self._file_size(os.path.join(settings.UPLOAD_DIR, f"{upload_id}{file_ext}{UPLOAD_PARTIAL_SUFFIX}"))
+            sizes[user_id] = sizes.get(user_id, 0) + size
+        return sizes
+    
+    @staticmethod
+    def _upload_derived_paths(file_path: str) -> List[str]:
+        """上传文件的派生文件：内容哈希、列式缓存与空间索引"""
+        file_id = os.path.splitext(os.path.basename(file_path))[0]
+        base_path = os.path.splitext(file_path)[0]
+        return [
+            os.path.join(settings.UPLOAD_DIR, f"{file_id}{HASH_SUFFIX}"),
+            base_path + COLUMNAR_SUFFIX,
+            base_path + SPATIAL_INDEX_SUFFIX
+        ]
+    
+    @staticmethod
+    def _file_size(file_path: str) -> int:
+        """文件大小，目录统计其中的文件，不存在时为0"""
+        try:
+            if os.path.isdir(file_path):
+                return sum(entry.stat().st_size for entry in os.scandir(file_path) if entry.is_file())
+            return os.path.getsize(file_path)
+        except OSError:
+            return 0
     
     def delete_file(self, file_path: str) -> bool:
         """删除文件"""
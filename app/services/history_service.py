@@ -0,0 +1,229 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional, Dict, List, Set, Tuple
+from sqlalchemy import select, update, insert, func
+from sqlalchemy.exc import IntegrityError, DataError
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.user import GenerateHistory, UploadedFile, IdBlock
+
+
+# 生成历史在ID分配表中的名称
+HISTORY_ID_BLOCK = "generate_history"
+
+
+class HistoryService:
+    """生成历史写入服务
+    
+    生成历史先放入内存队列，由后台任务批量写入：达到批量条数或距上次写入超过刷新间隔时写入一次，
+    提交生成任务时不再等待数据库事务。记录ID按hi/lo方式分配，每次从id_blocks表预留一段，
+    段内的ID在内存中依次分配，写入后不需要再读回。应用关闭时写入队列中剩余的记录。
+    查询生成历史首页前先写入该用户排队中的记录，刚提交的任务立即可见。
+    """
+    
+    _task: Optional[asyncio.Task] = None
+    _wakeup: Optional[asyncio.Event] = None
+    _lock: Optional[asyncio.Lock] = None
+    _id_lock: Optional[asyncio.Lock] = None
+    # 尚未写入数据库的记录（包括正在写入的），按ID
+    _pending: Dict[int, dict] = {}
+    # 写入失败被丢弃的记录ID，之后的状态更新不能改到占用该ID的其他记录
+    _dropped: Set[int] = set()
+    # 当前预留的ID段 [_next_id, _max_id)
+    _next_id = 0
+    _max_id = 0
+    
+    @classmethod
+    def start(cls) -> None:
+        """启动后台写入任务"""
+        if cls._task is None:
+            cls._wakeup = asyncio.Event()
+            cls._lock = asyncio.Lock()
+            cls._id_lock = asyncio.Lock()
+            cls._task = asyncio.create_task(cls._flush_loop())
+    
+    @classmethod
+    async def stop(cls) -> None:
+        """停止后台写入任务并写入剩余记录"""
+        if cls._task is None:
+            return
+        cls._task.cancel()
+        try:
+            await cls._task
+        except asyncio.CancelledError:
+            pass
+        await cls.flush()
+        cls._task = None
+    
+    @classmethod
+    async def add(cls, user_id: int, file_id: str, layer_type: str, file_name: str,
+                  kml_url: str, status: str) -> int:
+        """登记一条生成历史并返回记录ID，记录在后台批量写入，同时刷新上传文件的访问时间"""
+        cls.start()
+        history_id = await cls._allocate_id()
+        cls._pending[history_id] = {
+            "id": history_id,
+            "user_id": user_id,
+            "layer_type": layer_type,
+            "file_name": file_name,
+            "kml_url": kml_url,
+            "status": status,
+            "created_at": datetime.now(timezone.utc),
+            "file_id": file_id
+        }
+        if len(cls._pending) >= settings.HISTORY_FLUSH_BATCH_SIZE:
+            cls._wakeup.set()
+        return history_id
+    
+    @classmethod
+    async def update(cls, history_id: int, status: str, kml_url: str) -> None:
+        """更新生成历史的状态，记录尚未写入时直接修改队列中的记录"""
+        cls.start()
+        # 与写入互斥：正在写入的记录等写入提交后再更新
+        async with cls._lock:
+            record = cls._pending.get(history_id)
+            if record is not None:
+                record.update(status=status, kml_url=kml_url)
+                return
+            if history_id in cls._dropped:
+                cls._dropped.discard(history_id)
+                return
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(GenerateHistory)
+                    .where(GenerateHistory.id == history_id)
+                    .values(status=status, kml_url=kml_url)
+                )
+                await db.commit()
+    
+    @classmethod
+    async def expire(cls, kml_urls: Set[str]) -> None:
+        """生成结果被删除时，把队列中引用它的记录标记为expired
+        
+        与写入互斥：之前已写入的记录由调用方在数据库中更新，之后写入的记录使用修改后的状态。
+        """
+        if not cls._pending:
+            return
+        async with cls._lock:
+            for record in cls._pending.values():
+                if record["kml_url"] in kml_urls:
+                    record.update(status="expired", kml_url="")
+    
+    @classmethod
+    async def _flush_loop(cls) -> None:
+        """按刷新间隔或批量条数写入，单次失败的记录保留到下次写入"""
+        while True:
+            try:
+                await asyncio.wait_for(cls._wakeup.wait(), timeout=settings.HISTORY_FLUSH_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            cls._wakeup.clear()
+            try:
+                await cls.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"生成历史写入失败: {str(e)}")
+    
+    @classmethod
+    def has_pending(cls, user_id: int) -> bool:
+        """该用户是否有尚未写入的记录"""
+        return any(record["user_id"] == user_id for record in list(cls._pending.values()))
+    
+    @classmethod
+    async def flush(cls) -> int:
+        """写入队列中的全部记录，返回写入条数
+        
+        整批写入失败时逐条重试：ID冲突时如果已存在的就是该记录（之前的写入已提交但未确认），
+        把状态更新到已存在的记录；其他数据有误的记录记录日志后丢弃，不阻塞后续记录。
+        数据库不可用等其他错误停止重试，只有未写入的记录留在队列中，下次再写入。
+        """
+        if not cls._pending:
+            return 0
+        async with cls._lock:
+            records = list(cls._pending.values())
+            if not records:
+                return 0
+            
+            written = []
+            try:
+                try:
+                    await cls._insert(records)
+                    written = records
+                except Exception as e:
+                    print(f"生成历史批量写入失败，逐条重试: {str(e)}")
+                    for record in records:
+                        try:
+                            await cls._insert([record])
+                        except (IntegrityError, DataError) as e:
+                            if not await cls._update_existing(record):
+                                print(f"生成历史写入失败，已丢弃记录 {record['id']}: {str(e)}")
+                                cls._pending.pop(record["id"], None)
+                                cls._dropped.add(record["id"])
+                                continue
+                        written.append(record)
+            finally:
+                for record in written:
+                    cls._pending.pop(record["id"], None)
+            return len(written)
+    
+    @staticmethod
+    async def _update_existing(record: dict) -> bool:
+        """ID冲突时，已存在的记录与该记录一致则更新其状态，返回是否更新"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(GenerateHistory)
+                .where(
+                    GenerateHistory.id == record["id"],
+                    GenerateHistory.user_id == record["user_id"],
+                    GenerateHistory.layer_type == record["layer_type"],
+                    GenerateHistory.file_name == record["file_name"]
+                )
+                .values(status=record["status"], kml_url=record["kml_url"])
+            )
+            await db.commit()
+            return result.rowcount > 0
+    
+    @staticmethod
+    async def _insert(records: List[dict]) -> None:
+        """在一个事务中写入记录，并刷新对应上传文件的访问时间"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                insert(GenerateHistory),
+                [{key: value for key, value in record.items() if key != "file_id"} for record in records]
+            )
+            await db.execute(
+                update(UploadedFile)
+                .where(UploadedFile.file_id.in_({record["file_id"] for record in records}))
+                .values(last_accessed_at=func.now())
+            )
+            await db.commit()
+    
+    @classmethod
+    async def _allocate_id(cls) -> int:
+        """从当前ID段分配一个ID，用完时预留下一段"""
+        async with cls._id_lock:
+            if cls._next_id >= cls._max_id:
+                cls._next_id, cls._max_id = await cls._reserve_ids(settings.HISTORY_ID_BLOCK_SIZE)
+            history_id = cls._next_id
+            cls._next_id += 1
+            return history_id
+    
+    @staticmethod
+    async def _reserve_ids(count: int) -> Tuple[int, int]:
+        """在数据库中预留一段ID，多个实例各自预留的ID段互不重叠"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(IdBlock)
+                .where(IdBlock.name == HISTORY_ID_BLOCK)
+                .values(next_id=IdBlock.next_id + count)
+                .returning(IdBlock.next_id)
+            )
+            end = result.scalar_one_or_none()
+            if end is None:
+                # 分配表中还没有记录时，接在已有的生成历史之后
+                result = await db.execute(select(func.coalesce(func.max(GenerateHistory.id), 0)))
+                end = result.scalar_one() + 1 + count
+                db.add(IdBlock(name=HISTORY_ID_BLOCK, next_id=end))
+            await db.commit()
+        return end - count, end
@@ -0,0 +1,255 @@
+import asyncio
+import multiprocessing
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, Any, Set
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.services.cache_service import CacheService
+from app.services.file_service import FileService, OUTPUT_FORMATS, TILED_FORMAT
+from app.services.history_service import HistoryService
+from app.services.kml_service import KMLService
+from app.services.upload_service import UploadService
+
+
+# 支持的图层类型
+LAYER_TYPES = ("sector", "rsrp", "facility")
+
+# 生成任务状态（单进程内存存储，实际多实例部署应使用Redis）
+generation_jobs: Dict[str, dict] = {}
+
+
+class JobProgress:
+    """任务进度回调，在工作进程中把进度写回共享字典"""
+    
+    def __init__(self, shared: Any, job_id: str):
+        self.shared = shared
+        self.job_id = job_id
+    
+    def __call__(self, stage: str, rows_processed: int, total_rows: Optional[int] = None) -> None:
+        progress = {"stage": stage, "rows_processed": rows_processed}
+        if total_rows is not None:
+            progress["total_rows"] = total_rows
+        else:
+            progress["total_rows"] = self.shared.get(self.job_id, {}).get("total_rows")
+        self.shared[self.job_id] = progress
+
+
+def run_generation_job(file_path: str, layer_type: str, config: Optional[Dict[str, Any]],
+                       output_format: str, progress: JobProgress, base_url: str = "",
+                       spatial_filter: Optional[Dict[str, Any]] = None) -> dict:
+    """在工作进程中执行KML生成"""
+    return KMLService().build_kml_file(
+        file_path, layer_type, config, output_format, progress, base_url=base_url, spatial_filter=spatial_filter
+    )
+
+
+def run_schema_job(file_path: str) -> dict:
+    """在工作进程中解析上传文件的列名与行数"""
+    return FileService().read_schema(file_path)
+
+
+class JobService:
+    """KML生成任务服务
+    
+    生成任务在独立的进程池中执行，不阻塞事件循环；
+    生成历史先以pending状态登记（由HistoryService批量写入），任务结束后再更新为success或failed。
+    相同文件与配置的重复生成直接命中结果缓存，不再提交任务。
+    """
+    
+    _executor: Optional[ProcessPoolExecutor] = None
+    _manager = None
+    _progress = None
+    _tasks = set()
+    
+    @classmethod
+    def start(cls) -> None:
+        """启动工作进程池"""
+        if cls._executor is not None:
+            return
+        context = multiprocessing.get_context("spawn")
+        cls._manager = context.Manager()
+        cls._progress = cls._manager.dict()
+        cls._executor = ProcessPoolExecutor(max_workers=settings.GENERATION_WORKERS, mp_context=context)
+    
+    @classmethod
+    async def shutdown(cls) -> None:
+        """关闭工作进程池，未结束的任务取消并记为失败"""
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
+        for task in list(cls._tasks):
+            task.cancel()
+        await asyncio.gather(*cls._tasks, return_exceptions=True)
+        if cls._manager is not None:
+            cls._manager.shutdown()
+            cls._manager = None
+            cls._progress = None
+    
+    @classmethod
+    async def submit_generation(cls, db: AsyncSession, user_id: int, file_id: str, layer_type: str,
+                                config: Optional[Dict[str, Any]] = None, output_format: str = "kml",
+                                base_url: str = "", spatial_filter: Optional[Dict[str, Any]] = None) -> dict:
+        """提交KML生成任务，立即返回任务ID
+        
+        base_url为分块KML中链接使用的访问地址，spatial_filter为范围过滤条件（bbox或polygon）。
+        """
+        # 参数校验
+        if layer_type not in LAYER_TYPES:
+            raise HTTPException(status_code=400, detail="不支持的图层类型")
+        if output_format not in OUTPUT_FORMATS:
+            raise HTTPException(status_code=400, detail="不支持的输出格式")
+        if output_format != TILED_FORMAT:
+            base_url = ""
+        
+        # 获取上传文件并按已解析的列名校验必要字段
+        uploaded_file = await UploadService.get(db, file_id, user_id)
+        UploadService.validate_columns(uploaded_file, KMLService.required_columns(layer_type, config))
+        file_path = UploadService.get_path(uploaded_file)
+        
+        # 查找结果缓存
+        cache_key = CacheService.build_cache_key(
+            uploaded_file.content_hash, layer_type, config, output_format, base_url, spatial_filter
+        )
+        cached_filename = await CacheService.lookup(db, cache_key)
+        kml_url = f"/api/kml/download?filename={cached_filename}" if cached_filename else None
+        
+        # 登记生成历史（命中缓存时直接记为成功），写入时一并刷新上传文件的访问时间
+        history_id = await HistoryService.add(
+            user_id=user_id,
+            file_id=file_id,
+            layer_type=layer_type,
+            file_name=uploaded_file.file_name,
+            kml_url=kml_url or "",
+            status="success" if cached_filename else "pending"
+        )
+        
+        # 登记任务
+        cls._prune_jobs()
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "user_id": user_id,
+            "file_id": file_id,
+            "history_id": history_id,
+            "layer_type": layer_type,
+            "status": "pending",
+            "stage": "queued",
+            "rows_processed": 0,
+            "total_rows": None,
+            "dropped_points": None,
+            "kml_url": None,
+            "error": None,
+            "finished_at": None
+        }
+        generation_jobs[job_id] = job
+        
+        if cached_filename:
+            job.update(status="success", stage="cached", kml_url=kml_url, finished_at=time.time())
+            return job
+        
+        # 在进程池中执行
+        cls.start()
+        task = asyncio.create_task(
+            cls._run_job(job, file_path, config, output_format, base_url, spatial_filter, cache_key)
+        )
+        cls._tasks.add(task)
+        task.add_done_callback(cls._tasks.discard)
+        
+        return job
+    
+    @classmethod
+    def submit_analysis(cls, file_id: str, file_path: str) -> None:
+        """在进程池中后台解析上传文件的列名与行数，完成后补记到上传记录"""
+        cls.start()
+        task = asyncio.create_task(cls._run_analysis(file_id, file_path))
+        cls._tasks.add(task)
+        task.add_done_callback(cls._tasks.discard)
+    
+    @classmethod
+    async def _run_analysis(cls, file_id: str, file_path: str) -> None:
+        """执行解析任务，解析失败时不补记，生成时再报告具体错误"""
+        loop = asyncio.get_running_loop()
+        try:
+            schema = await loop.run_in_executor(cls._executor, run_schema_job, file_path)
+        except Exception:
+            return
+        await UploadService.record_schema(file_id, schema)
+    
+    @staticmethod
+    def active_file_ids() -> Set[str]:
+        """未结束的生成任务所使用的上传文件ID"""
+        return {job["file_id"] for job in generation_jobs.values() if job["finished_at"] is None}
+    
+    @classmethod
+    def get_job(cls, job_id: str, user_id: int) -> dict:
+        """获取任务状态（合并工作进程上报的进度）"""
+        job = generation_jobs.get(job_id)
+        if not job or job["user_id"] != user_id:
+            raise HTTPException(status_code=404, detail="任务不存在")
+        
+        if job["status"] == "running" and cls._progress is not None:
+            job.update(cls._progress.get(job_id, {}))
+        return job
+    
+    @classmethod
+    async def _run_job(cls, job: dict, file_path: str, config: Optional[Dict[str, Any]], output_format: str,
+                       base_url: str, spatial_filter: Optional[Dict[str, Any]], cache_key: str) -> None:
+        """执行任务并在结束后更新生成历史"""
+        job_id = job["job_id"]
+        job["status"] = "running"
+        loop = asyncio.get_running_loop()
+        
+        try:
+            result = await loop.run_in_executor(
+                cls._executor, run_generation_job,
+                file_path, job["layer_type"], config, output_format, JobProgress(cls._progress, job_id),
+                base_url, spatial_filter
+            )
+            kml_filename = await cls._store_result(cache_key, result["kml_filename"])
+            job.update(
+                status="success",
+                stage="done",
+                rows_processed=result["total_rows"],
+                total_rows=result["total_rows"],
+                dropped_points=result["dropped_points"],
+                kml_url=f"/api/kml/download?filename={kml_filename}"
+            )
+        except asyncio.CancelledError:
+            # 服务关闭时取消，仍然更新生成历史，不再向上抛出
+            job.update(status="failed", stage="failed", error="服务关闭，任务已取消")
+        except Exception as e:
+            job.update(status="failed", stage="failed", error=str(e))
+        finally:
+            job["finished_at"] = time.time()
+            if cls._progress is not None:
+                cls._progress.pop(job_id, None)
+        
+        # 更新生成历史
+        await HistoryService.update(job["history_id"], job["status"], job["kml_url"] or "")
+    
+    @staticmethod
+    async def _store_result(cache_key: str, kml_filename: str) -> str:
+        """登记生成结果，返回实际使用的文件名（相同请求并发生成时为先登记的文件）
+        
+        未登记的文件不受存储生命周期管理，登记失败时删除生成结果。
+        """
+        try:
+            async with AsyncSessionLocal() as db:
+                return await CacheService.store(db, cache_key, kml_filename)
+        except (Exception, asyncio.CancelledError):
+            await asyncio.to_thread(FileService().delete_kml, kml_filename)
+            raise
+    
+    @staticmethod
+    def _prune_jobs() -> None:
+        """清理超过保留时间的已结束任务"""
+        expire_before = time.time() - settings.JOB_RETENTION_SECONDS
+        for job_id in [
+            job_id for job_id, job in generation_jobs.items()
+            if job["finished_at"] is not None and job["finished_at"] < expire_before
+        ]:
+            generation_jobs.pop(job_id, None)
@@ -1,13 +1,121 @@
+import io
+import itertools
+import math
+import multiprocessing
 import os
 import pandas as pd
+import numpy as np
 import simplekml
-import math
-from typing import Optional, Dict, Any
+from xml.sax.saxutils import escape
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, Any, BinaryIO, Callable, Iterable, Iterator, List, Tuple, Union
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, and_, or_
+from app.core.config import settings
 from app.models.user import GenerateHistory
-from app.services.file_service import FileService
-from fastapi import HTTPException
+from app.services.file_service import FileService, TILED_FORMAT, TILE_ROOT_NAME
+from app.services.history_service import HistoryService
+from app.utils.geometry import (
+    compute_sector_rings, sector_radius, grid_cells, grid_rings, hex_cells, hex_rings, track_distances
+)
+from app.utils.kml_writer import (
+    KMLStreamWriter, icon_style, polygon_style, balloon_style, schema, schema_data_template, format_coords,
+    point_placemark, polygon_placemark, region, network_link
+)
+from app.utils.spatial_index import query_bbox, query_polygon
+
+
+# 进度回调：(阶段, 已处理行数[, 总行数])
+ProgressCallback = Callable[..., None]
+
+# 批渲染函数：(数据批次, 配置) -> {文件夹: Placemark片段列表}
+BatchRenderer = Callable[[pd.DataFrame, Dict[str, Any]], Dict[Optional[str], List[str]]]
+
+# 每批渲染的行数，限制几何数组与片段缓冲的内存占用
+RENDER_BATCH_SIZE = 10000
+
+# 并行渲染时每个工作进程平均分到的分片数
+SHARDS_PER_WORKER = 4
+
+# 图层名称
+LAYER_NAMES = {
+    "sector": "基站扇区图层",
+    "rsrp": "RSRP点图层",
+    "facility": "光交/机房图层"
+}
+
+# 各图层的必要字段：配置项及其默认列名
+LAYER_REQUIRED_COLUMNS = {
+    "sector": {
+        "lon_col": "经度", "lat_col": "纬度", "azimuth_col": "方向角",
+        "pci_col": "PCI", "tac_col": "TAC", "cell_name_col": "小区名称"
+    },
+    "rsrp": {"lon_col": "经度", "lat_col": "纬度", "rsrp_col": "RSRP"},
+    "facility": {"lon_col": "经度", "lat_col": "纬度", "name_col": "名称"}
+}
+
+# 分块输出：每个分块直接包含的最大行数、最大层级、分块激活所需的最小屏幕像素
+TILE_MAX_ROWS = 1000
+TILE_MAX_LEVEL = 16
+TILE_MIN_LOD_PIXELS = 128
+
+# 分块范围外扩（度），容纳扇区等有一定大小的要素
+TILE_PADDING = 0.001
+
+# PCI模3颜色映射
+PCI_COLORS = {
+    0: simplekml.Color.red,
+    1: simplekml.Color.yellow,
+    2: simplekml.Color.blue
+}
+
+# RSRP分级：(下限阈值, 颜色, 评级, 图标大小)，低于最后一个阈值为"极弱"
+RSRP_LEVELS = [
+    (-85, simplekml.Color.green, "极佳", 1.2),
+    (-95, simplekml.Color.yellow, "良好", 1.0),
+    (-105, simplekml.Color.orange, "中等", 0.9),
+    (-120, simplekml.Color.red, "较弱", 0.8),
+]
+RSRP_WEAKEST_LEVEL = (None, simplekml.Color.black, "极弱", 0.7)
+
+# RSRP聚合方式：(格子编号函数, 格子边界函数)
+RSRP_CELL_GRIDS = {
+    "grid": (grid_cells, grid_rings),
+    "hex": (hex_cells, hex_rings),
+}
+
+# RSRP聚合格子的填充透明度
+RSRP_CELL_FILL_ALPHA = 160
+
+# 坐标去重时重复点RSRP的保留方式：最差、最好、平均
+RSRP_DEDUP_AGGREGATES = {"worst": "min", "best": "max", "mean": "mean"}
+
+# 设施类型图标
+FACILITY_ICONS = {
+    "光交": 'http://maps.google.com/mapfiles/kml/pushpin/blue-pushpin.png',
+    "机房": 'http://maps.google.com/mapfiles/kml/pushpin/red-pushpin.png',
+}
+FACILITY_DEFAULT_ICON = 'http://maps.google.com/mapfiles/kml/pushpin/ylw-pushpin.png'
+
+BASE_STATION_ICON = 'http://maps.google.com/mapfiles/kml/pushpin/pink-pushpin.png'
+RSRP_ICON = 'http://maps.google.com/mapfiles/kml/shapes/dot.png'
+
+# 各图层要素的ExtendedData字段：(Schema ID, [(字段名, 类型, 显示名), ...])
+# 逐行只写字段值，气泡的HTML版式在样式的BalloonStyle中通过 $[Schema ID/字段名] 引用
+STATION_SCHEMA = ("station", [
+    ("cell_count", "int", "小区数量"), ("cells", "string", "小区列表"),
+    ("lon", "double", "经度"), ("lat", "double", "纬度")
+])
+RSRP_POINT_SCHEMA = ("rsrp_point", [
+    ("rsrp", "float", "RSRP"), ("lon", "double", "经度"), ("lat", "double", "纬度")
+])
+RSRP_CELL_SCHEMA = ("rsrp_cell", [
+    ("mean", "float", "平均RSRP"), ("min", "float", "最小RSRP"), ("count", "int", "采样点数")
+])
+FACILITY_SCHEMA = ("facility", [
+    ("type", "string", "类型"), ("lon", "double", "经度"), ("lat", "double", "纬度")
+])
 
 
 class KMLService:
@@ -17,59 +125,263 @@ class KMLService:
         """初始化KML服务"""
         self.file_service = FileService()
     
-    async def generate_kml(self, db: AsyncSession, user_id: int, file_id: str, layer_type: str, config: Optional[Dict[str, Any]] = None) -> dict:
-        """生成KML文件"""
-        # 获取文件路径
-        file_path = self.file_service.get_file_path(file_id)
-        if not file_path:
-            raise HTTPException(status_code=404, detail="文件不存在")
+    def build_kml_file(self, file_path: str, layer_type: str, config: Optional[Dict[str, Any]] = None,
+                       output_format: str = "kml", progress: Optional[ProgressCallback] = None,
+                       workers: Optional[int] = None, base_url: str = "",
+                       spatial_filter: Optional[Dict[str, Any]] = None) -> dict:
+        """读取上传文件并生成KML文件（CPU密集，应在工作进程中执行）
+        
+        分块输出时返回的kml_filename为入口文件，base_url为分块链接使用的访问地址。
+        spatial_filter为 {"bbox": [西, 南, 东, 北]} 或 {"polygon": [[经度, 纬度], ...]}，
+        只生成范围内的数据。
+        """
+        # 根据图层类型选择写入方法
+        layer_writers = self._layer_writers()
+        if layer_type not in layer_writers:
+            raise ValueError("不支持的图层类型")
+        
+        # 读取文件（CSV边读边渲染，总行数未知）
+        if progress:
+            progress("reading", 0)
+        chunks = self.read_chunks(file_path, config, spatial_filter)
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            first_chunk = pd.DataFrame()
+        
+        total_rows = 0
+        
+        def counted_chunks() -> Iterator[pd.DataFrame]:
+            nonlocal total_rows
+            for chunk in itertools.chain([first_chunk], chunks):
+                total_rows += len(chunk)
+                yield chunk
+        
+        # 大文件按行分片并行渲染
+        if workers is None:
+            workers = settings.GENERATION_SHARD_WORKERS
         
-        # 读取文件
         try:
-            if file_path.endswith('.csv'):
-                df = pd.read_csv(file_path, encoding='utf-8', on_bad_lines='skip')
+            # RSRP逐点图层可先对采样点去重抽稀
+            data, dropped_points = counted_chunks(), 0
+            if layer_type == "rsrp":
+                data, dropped_points = self.thin_rsrp_points(data, config, progress)
+            
+            # 生成KML并直接写入文件（CSV边读边渲染时总行数未知）
+            if progress:
+                if isinstance(data, pd.DataFrame):
+                    render_rows = len(data)
+                elif file_path.endswith('.csv') and not spatial_filter:
+                    render_rows = None
+                else:
+                    render_rows = len(first_chunk)
+                progress("rendering", 0, render_rows)
+            
+            if output_format == TILED_FORMAT:
+                with self.file_service.open_tile_package(layer_type) as (package_name, package_dir):
+                    kml_filename = f"{package_name}/{TILE_ROOT_NAME}"
+                    placemark_count = self.write_tiled_layer(
+                        layer_type, data, package_name, package_dir, config, progress, base_url
+                    )
             else:
-                df = pd.read_excel(file_path)
+                with self.file_service.open_kml_file(layer_type, output_format) as (kml_filename, kml_file):
+                    placemark_count = layer_writers[layer_type](data, kml_file, config, progress, workers)
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"文件读取失败: {str(e)}")
+            raise ValueError(f"KML生成失败: {str(e)}")
         
-        # 根据图层类型生成KML
+        return {
+            "kml_filename": kml_filename,
+            "total_rows": total_rows,
+            "dropped_points": dropped_points,
+            "placemark_count": placemark_count
+        }
+    
+    def read_chunks(self, file_path: str, config: Optional[Dict[str, Any]] = None,
+                    spatial_filter: Optional[Dict[str, Any]] = None) -> Iterator[pd.DataFrame]:
+        """按块读取上传文件
+        
+        CSV按固定行数流式分块读取，内存占用与文件大小无关；
+        Excel整表读取（优先加载列式缓存），作为单个数据块返回。
+        按范围过滤时通过空间索引定位范围内的行，只读取这些行。
+        """
         try:
-            if layer_type == "sector":
-                kml_content = self.generate_sector_layer(df, config)
-            elif layer_type == "rsrp":
-                kml_content = self.generate_rsrp_layer(df, config)
-            elif layer_type == "facility":
-                kml_content = self.generate_facility_layer(df, config)
+            if spatial_filter:
+                yield self.file_service.read_rows(file_path, self.filter_rows(file_path, config, spatial_filter))
+            elif file_path.endswith('.csv'):
+                with pd.read_csv(file_path, encoding='utf-8', on_bad_lines='skip',
+                                 chunksize=settings.CSV_CHUNK_ROWS) as reader:
+                    yield from reader
             else:
-                raise HTTPException(status_code=400, detail="不支持的图层类型")
+                yield self.file_service.read_table(file_path)
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"KML生成失败: {str(e)}")
-        
-        # 保存KML文件
-        kml_filename = self.file_service.save_kml_file(kml_content, layer_type)
-        kml_url = f"/api/kml/download?filename={kml_filename}"
-        
-        # 记录生成历史
-        history = GenerateHistory(
-            user_id=user_id,
-            layer_type=layer_type,
-            file_name=os.path.basename(file_path),
-            kml_url=kml_url,
-            status="success"
+            raise ValueError(f"文件读取失败: {str(e)}")
+    
+    def filter_rows(self, file_path: str, config: Optional[Dict[str, Any]],
+                    spatial_filter: Dict[str, Any]) -> np.ndarray:
+        """通过上传文件的空间索引查询范围内的行号"""
+        config = config or {}
+        index = self.file_service.get_spatial_index(
+            file_path, config.get("lon_col", "经度"), config.get("lat_col", "纬度")
         )
-        db.add(history)
-        await db.commit()
-        await db.refresh(history)
-        
+        if "polygon" in spatial_filter:
+            return query_polygon(index, spatial_filter["polygon"])
+        return query_bbox(index, *spatial_filter["bbox"])
+    
+    @staticmethod
+    def required_columns(layer_type: str, config: Optional[Dict[str, Any]] = None) -> List[str]:
+        """按配置得到图层的必要字段"""
+        defaults = LAYER_REQUIRED_COLUMNS.get(layer_type, {})
+        return [(config or {}).get(key, default) for key, default in defaults.items()]
+    
+    def _layer_writers(self) -> Dict[str, Callable[..., int]]:
+        """图层类型对应的写入方法"""
         return {
-            "kml_url": kml_url,
-            "history_id": history.id,
-            "kml_filename": kml_filename
+            "sector": self.write_sector_layer,
+            "rsrp": self.write_rsrp_layer,
+            "facility": self.write_facility_layer
         }
     
+    def write_tiled_layer(self, layer_type: str, df: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+                          package_name: str, package_dir: str, config: Optional[Dict[str, Any]] = None,
+                          progress: Optional[ProgressCallback] = None, base_url: str = "") -> int:
+        """按四叉树分块写出图层，返回Placemark总数
+        
+        每个分块是独立的KML文档：文档级Region使其要素在放大到一定程度后才显示，
+        并通过带Region的NetworkLink引用子分块，Google Earth只加载视野内的分块。
+        入口文件只包含指向第0层分块的NetworkLink。
+        """
+        config = config or {}
+        if layer_type == "rsrp" and config.get("aggregate"):
+            raise ValueError("聚合图层不支持分块输出")
+        write_layer = self._layer_writers()[layer_type]
+        
+        # 分块需要全局的空间划分，读取全部数据
+        frames = list(split_columns(df)[1])
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        lon_col = config.get("lon_col", "经度")
+        lat_col = config.get("lat_col", "纬度")
+        for col in [lon_col, lat_col]:
+            if col not in df.columns:
+                raise ValueError(f"缺少必要字段: {col}")
+        lon = pd.to_numeric(df[lon_col], errors="coerce").to_numpy(dtype=np.float64)
+        lat = pd.to_numeric(df[lat_col], errors="coerce").to_numpy(dtype=np.float64)
+        groups = None
+        cell_name_col = config.get("cell_name_col", "小区名称")
+        if layer_type == "sector" and cell_name_col in df.columns:
+            # 同一基站（名称与坐标相同）的小区划入同一分块，基站点只在一个分块中输出
+            sites = pd.DataFrame({
+                "site": self._base_station_names(df[cell_name_col].astype(str)), "lon": lon, "lat": lat
+            })
+            groups = sites.groupby(["site", "lon", "lat"], sort=False, dropna=False).ngroup().to_numpy()
+        tiles = build_quadtree(lon, lat, np.flatnonzero(np.isfinite(lon) & np.isfinite(lat)), groups=groups)
+        
+        def tile_url(tile: dict) -> str:
+            return f"{base_url}/api/kml/download?filename={package_name}/{tile['name']}"
+        
+        def tile_region(tile: dict) -> str:
+            west, south, east, north = tile["bounds"]
+            return region(
+                west - TILE_PADDING, max(south - TILE_PADDING, -90), east + TILE_PADDING,
+                min(north + TILE_PADDING, 90), 0 if tile["level"] == 0 else TILE_MIN_LOD_PIXELS
+            )
+        
+        placemark_count = 0
+        rows_processed = 0
+        for tile in tiles.values():
+            children = [tiles[child] for child in tile["children"]]
+            links = "".join(
+                network_link(tile_url(child), name=child["name"], region_fragment=tile_region(child))
+                for child in children
+            )
+            with open(os.path.join(package_dir, tile["name"]), "wb") as f:
+                placemark_count += write_layer(
+                    df.iloc[tile["rows"]], f, config, prefix=tile_region(tile), suffix=links
+                )
+            rows_processed += len(tile["rows"])
+            if progress:
+                progress("rendering", rows_processed)
+        
+        # 入口文件
+        root_tile = tiles[(0, 0, 0)]
+        root_link = network_link(
+            tile_url(root_tile), name=LAYER_NAMES[layer_type], region_fragment=tile_region(root_tile)
+        )
+        with open(os.path.join(package_dir, TILE_ROOT_NAME), "wb") as f:
+            KMLStreamWriter(f, name=LAYER_NAMES[layer_type], suffix=root_link).close()
+        
+        return placemark_count
+    
     def generate_sector_layer(self, df: pd.DataFrame, config: Optional[Dict[str, Any]] = None) -> bytes:
         """生成基站扇区图层"""
+        buffer = io.BytesIO()
+        self.write_sector_layer(df, buffer, config)
+        return buffer.getvalue()
+    
+    def generate_rsrp_layer(self, df: pd.DataFrame, config: Optional[Dict[str, Any]] = None) -> bytes:
+        """生成RSRP点图层"""
+        buffer = io.BytesIO()
+        df, _ = self.thin_rsrp_points(df, config)
+        self.write_rsrp_layer(df, buffer, config)
+        return buffer.getvalue()
+    
+    def generate_facility_layer(self, df: pd.DataFrame, config: Optional[Dict[str, Any]] = None) -> bytes:
+        """生成光交/机房图层"""
+        buffer = io.BytesIO()
+        self.write_facility_layer(df, buffer, config)
+        return buffer.getvalue()
+    
+    @staticmethod
+    def _render_layer(writer: KMLStreamWriter, chunks: Iterable[pd.DataFrame], render: BatchRenderer,
+                      config: Dict[str, Any], progress: Optional[ProgressCallback] = None, workers: int = 1) -> None:
+        """逐块分批渲染数据并写入
+        
+        workers大于1且累计行数达到GENERATION_SHARD_MIN_ROWS后，按行分片在进程池中
+        并行渲染各分片的Placemark片段，再按分片顺序写入，保证输出与单进程渲染一致。
+        """
+        pool = None
+        # 限制同时在途的分片数量，避免结果堆积占用内存
+        pending = deque()
+        offset = 0
+        try:
+            for chunk in chunks:
+                total = len(chunk)
+                if pool is None and workers > 1 and offset + total >= settings.GENERATION_SHARD_MIN_ROWS:
+                    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+                
+                if pool is None:
+                    for start in range(0, total, RENDER_BATCH_SIZE):
+                        fragments = render(chunk.iloc[start:start + RENDER_BATCH_SIZE], config)
+                        for folder, placemarks in fragments.items():
+                            writer.write_placemarks(placemarks, folder)
+                        if progress:
+                            progress("rendering", offset + min(start + RENDER_BATCH_SIZE, total))
+                else:
+                    shard_size = max(RENDER_BATCH_SIZE, math.ceil(total / (workers * SHARDS_PER_WORKER)))
+                    for start in range(0, total, shard_size):
+                        end = min(start + shard_size, total)
+                        pending.append((offset + end, pool.submit(render_shard, render, chunk.iloc[start:end], config)))
+                        if len(pending) >= workers * 2:
+                            KMLService._write_shard(writer, pending.popleft(), progress)
+                offset += total
+            
+            while pending:
+                KMLService._write_shard(writer, pending.popleft(), progress)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+    
+    @staticmethod
+    def _write_shard(writer: KMLStreamWriter, shard: tuple, progress: Optional[ProgressCallback] = None) -> None:
+        """等待分片渲染完成并写入"""
+        end, future = shard
+        for folder, (data, count) in future.result().items():
+            writer.write_encoded(data, count, folder)
+        if progress:
+            progress("rendering", end)
+    
+    def write_sector_layer(self, df: Union[pd.DataFrame, Iterable[pd.DataFrame]], fp: BinaryIO,
+                           config: Optional[Dict[str, Any]] = None, progress: Optional[ProgressCallback] = None,
+                           workers: int = 1, prefix: str = "", suffix: str = "") -> int:
+        """流式写入基站扇区图层，返回Placemark数量"""
         # 默认配置
         default_config = {
             "lon_col": "经度",
@@ -87,99 +399,164 @@ class KMLService:
         config = default_config
         
         # 验证必要字段
-        required_cols = [config["lon_col"], config["lat_col"], config["azimuth_col"], 
-                        config["pci_col"], config["tac_col"], config["cell_name_col"]]
+        required_cols = [config[key] for key in LAYER_REQUIRED_COLUMNS["sector"]]
         
+        columns, chunks = split_columns(df)
         for col in required_cols:
-            if col not in df.columns:
+            if col not in columns:
                 raise ValueError(f"缺少必要字段: {col}")
         
-        # 创建KML对象
-        kml = simplekml.Kml(name="基站扇区图层")
+        # 每种PCI颜色只在文档级声明一次样式
+        styles = {}
+        for index, color in PCI_COLORS.items():
+            styles[f"station_pci{index}"] = icon_style(BASE_STATION_ICON, color=color) + balloon_style(
+                self._station_balloon()
+            )
+            styles[f"sector_pci{index}"] = polygon_style(color, simplekml.Color.changealphaint(80, color))
         
-        # 创建文件夹
-        base_station_folder = kml.newfolder(name="基站")
-        cell_sector_folder = kml.newfolder(name="小区扇区")
+        # 同一基站的多个小区只输出一个基站点，扇区渲染完成后按站汇总写出
+        station_cells = []
         
-        # PCI颜色映射
-        pci_colors = {
-            0: simplekml.Color.red,
-            1: simplekml.Color.yellow,
-            2: simplekml.Color.blue
-        }
+        def prepared_cells() -> Iterator[pd.DataFrame]:
+            for chunk in chunks:
+                cells = self._prepare_sector_cells(chunk, config)
+                station_cells.append(self._station_cell_lines(cells))
+                yield cells
         
-        # 处理数据
-        for _, row in df.iterrows():
-            try:
-                # 获取数据
-                cell_name = str(row[config["cell_name_col"]])
-                base_station_name = cell_name.split('-')[0] if '-' in cell_name else "未知基站"
-                pci = int(row[config["pci_col"]])
-                color_index = pci % 3
-                azimuth = float(row[config["azimuth_col"]])
-                tac = str(row[config["tac_col"]])
-                center_lon = float(row[config["lon_col"]])
-                center_lat = float(row[config["lat_col"]])
-                
-                # 覆盖类型
-                coverage_type = "室外"
-                if config["coverage_col"] in df.columns:
-                    coverage_type = str(row[config["coverage_col"]])
-                
-                # 生成扇形
-                radius = 0.0005 if "室内" in coverage_type else 0.001
-                points = [(center_lon, center_lat)]
-                
-                # 计算扇形边界点
-                for angle in range(int(azimuth) - 60, int(azimuth) + 61, 5):
-                    rad_angle = math.radians(angle)
-                    delta_lon = radius * math.sin(rad_angle)
-                    delta_lat = radius * math.cos(rad_angle)
-                    points.append((center_lon + delta_lon, center_lat + delta_lat))
-                
-                # 创建多边形
-                pol = cell_sector_folder.newpolygon(name=cell_name)
-                pol.outerboundaryis = points
-                pol.style.polystyle.color = simplekml.Color.changealphaint(80, pci_colors[color_index])
-                pol.style.polystyle.outline = 1
-                pol.style.linestyle.color = pci_colors[color_index]
-                pol.style.linestyle.width = 2
-                
-                # 创建基站点
-                point = base_station_folder.newpoint(
-                    name=base_station_name,
-                    coords=[(center_lon, center_lat)]
-                )
-                point.style.iconstyle.color = pci_colors[color_index]
-                point.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/pushpin/pink-pushpin.png'
-                
-                # 添加描述
-                point.description = f"<div style='font-family:Arial, sans-serif; font-size:13px;'>"
-                point.description += f"<b>基站信息</b><br/>"
-                point.description += f"• 基站名称: <font color='blue'>{base_station_name}</font><br/>"
-                point.description += f"• 小区名称: <font color='blue'>{cell_name}</font><br/>"
-                point.description += f"• PCI: <font color='red'>{pci}</font><br/>"
-                point.description += f"• TAC: {tac}<br/>"
-                point.description += f"• 方向角: {azimuth}°<br/>"
-                point.description += f"• 覆盖类别: <b>{coverage_type}</b><br/>"
-                point.description += f"<br/><b>位置信息</b><br/>"
-                point.description += f"• 经度: {center_lon}<br/>"
-                point.description += f"• 纬度: {center_lat}"
-                point.description += f"</div>"
-                
-            except Exception:
-                continue
+        with KMLStreamWriter(fp, name=LAYER_NAMES["sector"], folders=["基站", "小区扇区"], styles=styles,
+                             prefix=prefix, suffix=suffix, schemas=[schema(*STATION_SCHEMA)]) as writer:
+            self._render_layer(writer, prepared_cells(), self._render_sector_batch, config, progress, workers)
+            stations = self._group_stations(station_cells)
+            for start in range(0, len(stations), RENDER_BATCH_SIZE):
+                batch = stations.iloc[start:start + RENDER_BATCH_SIZE]
+                writer.write_placemarks(self._render_station_batch(batch), "基站")
         
-        # 保存为字节
-        return kml.kml().encode('utf-8')
+        return writer.placemark_count
     
-    def generate_rsrp_layer(self, df: pd.DataFrame, config: Optional[Dict[str, Any]] = None) -> bytes:
-        """生成RSRP点图层"""
+    @staticmethod
+    def _render_sector_batch(cells: pd.DataFrame, config: Dict[str, Any]) -> Dict[Optional[str], List[str]]:
+        """渲染一批已清洗的小区数据，返回 {文件夹: 扇区Placemark片段列表}"""
+        # 批量计算扇区几何
+        radius = sector_radius(cells["coverage_type"].to_numpy())
+        lon_rings, lat_rings = compute_sector_rings(
+            cells["lon"].to_numpy(), cells["lat"].to_numpy(),
+            cells["azimuth"].to_numpy(), radius
+        )
+        
+        # 小区扇区多边形
+        sectors = [
+            polygon_placemark(
+                format_coords(ring_lon, ring_lat), name=cell_name, style_url=f"sector_pci{pci % 3}"
+            )
+            for cell_name, pci, ring_lon, ring_lat in zip(
+                cells["cell_name"].tolist(), cells["pci"].tolist(), lon_rings.tolist(), lat_rings.tolist()
+            )
+        ]
+        
+        return {"小区扇区": sectors}
+    
+    @staticmethod
+    def _station_cell_lines(cells: pd.DataFrame) -> pd.DataFrame:
+        """批量生成各小区在基站描述中的一行，只保留汇总基站所需的字段"""
+        lines = (
+            "• <font color='blue'>" + cells["cell_name"] + "</font>: PCI <font color='red'>"
+            + cells["pci"].astype(str) + "</font>, TAC " + cells["tac"]
+            + ", 方向角 " + cells["azimuth"].astype(str) + "°, <b>" + cells["coverage_type"] + "</b><br/>"
+        )
+        return pd.DataFrame({
+            "base_station_name": cells["base_station_name"],
+            "lon": cells["lon"],
+            "lat": cells["lat"],
+            "pci": cells["pci"],
+            "cell_line": lines
+        })
+    
+    @staticmethod
+    def _group_stations(station_cells: List[pd.DataFrame]) -> pd.DataFrame:
+        """按基站名称与坐标分组汇总小区，保持基站首次出现的顺序"""
+        if not station_cells:
+            return pd.DataFrame(columns=["base_station_name", "lon", "lat", "pci", "cell_count", "cell_lines"])
+        return pd.concat(station_cells, ignore_index=True).groupby(
+            ["base_station_name", "lon", "lat"], sort=False
+        ).agg(
+            pci=("pci", "first"), cell_count=("cell_line", "size"), cell_lines=("cell_line", "".join)
+        ).reset_index()
+    
+    @staticmethod
+    def _render_station_batch(stations: pd.DataFrame) -> List[str]:
+        """渲染一批基站点，样式取该站第一个小区的PCI颜色"""
+        extended_data = schema_data_template(STATION_SCHEMA[0], [name for name, _, _ in STATION_SCHEMA[1]])
+        return [
+            point_placemark(
+                lon, lat, name=base_station_name, style_url=f"station_pci{pci % 3}",
+                extended_data=extended_data.format(cell_count, escape(cell_lines), lon, lat)
+            )
+            for base_station_name, lon, lat, pci, cell_count, cell_lines in zip(
+                stations["base_station_name"].tolist(),
+                stations["lon"].astype(str).tolist(), stations["lat"].astype(str).tolist(),
+                stations["pci"].tolist(), stations["cell_count"].tolist(), stations["cell_lines"].tolist()
+            )
+        ]
+    
+    @staticmethod
+    def _base_station_names(cell_name: pd.Series) -> pd.Series:
+        """由小区名称得到基站名称（“-”之前的部分）"""
+        return cell_name.str.split('-').str[0].where(cell_name.str.contains('-', regex=False), "未知基站")
+    
+    @staticmethod
+    def _prepare_sector_cells(df: pd.DataFrame, config: Dict[str, Any]) -> pd.DataFrame:
+        """批量提取并校验扇区字段，丢弃无法解析的行"""
+        cell_name = df[config["cell_name_col"]].astype(str)
+        cells = pd.DataFrame({
+            "cell_name": cell_name,
+            "base_station_name": KMLService._base_station_names(cell_name),
+            "pci": pd.to_numeric(df[config["pci_col"]], errors="coerce"),
+            "azimuth": pd.to_numeric(df[config["azimuth_col"]], errors="coerce"),
+            "tac": df[config["tac_col"]].astype(str),
+            "lon": pd.to_numeric(df[config["lon_col"]], errors="coerce"),
+            "lat": pd.to_numeric(df[config["lat_col"]], errors="coerce"),
+        })
+        
+        # 覆盖类型
+        if config["coverage_col"] in df.columns:
+            cells["coverage_type"] = df[config["coverage_col"]].astype(str)
+        else:
+            cells["coverage_type"] = "室外"
+        
+        # 与逐行处理一致：数值字段无法解析的行直接跳过
+        cells = cells.dropna(subset=["pci", "azimuth", "lon", "lat"])
+        cells = cells[np.isfinite(cells["pci"]) & np.isfinite(cells["azimuth"])]
+        cells["pci"] = cells["pci"].astype(np.int64)
+        return cells.astype({"azimuth": np.float64, "lon": np.float64, "lat": np.float64})
+    
+    @staticmethod
+    def _station_balloon() -> str:
+        """基站点的气泡模板，列出该站的全部小区"""
+        return (
+            "<h3>$[name]</h3>"
+            "<div style='font-family:Arial, sans-serif; font-size:13px;'>"
+            "<b>基站信息</b><br/>"
+            "• 基站名称: <font color='blue'>$[name]</font><br/>"
+            "• 小区数量: $[station/cell_count]<br/>"
+            "<br/><b>小区列表</b><br/>"
+            "$[station/cells]"
+            "<br/><b>位置信息</b><br/>"
+            "• 经度: $[station/lon]<br/>"
+            "• 纬度: $[station/lat]"
+            "</div>$[geDirections]"
+        )
+    
+    def write_rsrp_layer(self, df: Union[pd.DataFrame, Iterable[pd.DataFrame]], fp: BinaryIO,
+                         config: Optional[Dict[str, Any]] = None, progress: Optional[ProgressCallback] = None,
+                         workers: int = 1, prefix: str = "", suffix: str = "") -> int:
+        """流式写入RSRP点图层，返回Placemark数量"""
         # 默认配置
         default_config = {
             "lon_col": "经度",
             "lat_col": "纬度",
-            "rsrp_col": "RSRP"
+            "rsrp_col": "RSRP",
+            "aggregate": None,  # 聚合方式：grid（正方形栅格）或hex（六边形），为空时逐点输出
+            "cell_size": 50  # 聚合格子大小（米）：栅格边长或六边形外接圆半径
         }
         
         # 合并配置
@@ -188,77 +565,230 @@ class KMLService:
         config = default_config
         
         # 验证必要字段
-        required_cols = [config["lon_col"], config["lat_col"], config["rsrp_col"]]
+        required_cols = [config[key] for key in LAYER_REQUIRED_COLUMNS["rsrp"]]
         
+        columns, chunks = split_columns(df)
         for col in required_cols:
-            if col not in df.columns:
+            if col not in columns:
                 raise ValueError(f"缺少必要字段: {col}")
         
-        # 创建KML对象
-        kml = simplekml.Kml(name="RSRP点图层")
+        if config["aggregate"]:
+            return self._write_rsrp_cells(chunks, fp, config, progress)
         
-        # 处理数据
-        for _, row in df.iterrows():
-            try:
-                # 获取数据
-                rsrp_value = float(row[config["rsrp_col"]])
-                lon = float(row[config["lon_col"]])
-                lat = float(row[config["lat_col"]])
-                
-                # 根据RSRP值确定颜色
-                if rsrp_value > -85:
-                    color = simplekml.Color.green
-                    strength = "极佳"
-                elif rsrp_value > -95:
-                    color = simplekml.Color.yellow
-                    strength = "良好"
-                elif rsrp_value > -105:
-                    color = simplekml.Color.orange
-                    strength = "中等"
-                elif rsrp_value > -120:
-                    color = simplekml.Color.red
-                    strength = "较弱"
-                else:
-                    color = simplekml.Color.black
-                    strength = "极弱"
-                
-                # 创建点
-                point = kml.newpoint(
-                    coords=[(lon, lat)]
+        # 每个信号等级只在文档级声明一次样式
+        levels = RSRP_LEVELS + [RSRP_WEAKEST_LEVEL]
+        styles = {
+            f"rsrp_level{index}": icon_style(RSRP_ICON, color=color, scale=scale)
+            + balloon_style(self._rsrp_balloon(strength))
+            for index, (_, color, strength, scale) in enumerate(levels)
+        }
+        
+        with KMLStreamWriter(fp, name=LAYER_NAMES["rsrp"], styles=styles, prefix=prefix, suffix=suffix,
+                             schemas=[schema(*RSRP_POINT_SCHEMA)]) as writer:
+            self._render_layer(writer, chunks, self._render_rsrp_batch, config, progress, workers)
+        
+        return writer.placemark_count
+    
+    def thin_rsrp_points(self, df: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+                         config: Optional[Dict[str, Any]] = None, progress: Optional[ProgressCallback] = None
+                         ) -> Tuple[Union[pd.DataFrame, Iterable[pd.DataFrame]], int]:
+        """RSRP采样点去重抽稀，返回 (抽稀后的数据, 丢弃的点数)
+        
+        先把坐标吸附到snap_tolerance米的栅格上，同一位置的重复点合并为一个，
+        RSRP按dedup_keep取最差、最好或平均值；再按轨迹累计距离每min_distance米保留一个点。
+        未配置抽稀或输出聚合图层时原样返回。
+        """
+        # 默认配置
+        default_config = {
+            "lon_col": "经度",
+            "lat_col": "纬度",
+            "rsrp_col": "RSRP",
+            "aggregate": None,
+            "snap_tolerance": None,  # 坐标去重容差（米），为空时不去重
+            "dedup_keep": "worst",  # 重复点RSRP的保留方式：worst、best或mean
+            "min_distance": None  # 沿轨迹抽稀的最小间距（米），为空时不抽稀
+        }
+        
+        # 合并配置
+        if config:
+            default_config.update(config)
+        config = default_config
+        
+        if config["aggregate"] or not (config["snap_tolerance"] or config["min_distance"]):
+            return df, 0
+        if config["dedup_keep"] not in RSRP_DEDUP_AGGREGATES:
+            raise ValueError(f"不支持的去重方式: {config['dedup_keep']}")
+        
+        columns, chunks = split_columns(df)
+        for col in [config["lon_col"], config["lat_col"], config["rsrp_col"]]:
+            if col not in columns:
+                raise ValueError(f"缺少必要字段: {col}")
+        
+        # 抽稀需要完整轨迹，只保留经纬度与RSRP三列
+        frames = []
+        rows = 0
+        for chunk in chunks:
+            rows += len(chunk)
+            frames.append(self._prepare_rsrp_points(chunk, config)[["lon", "lat", "rsrp"]])
+            if progress:
+                progress("thinning", rows)
+        points = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["lon", "lat", "rsrp"])
+        point_count = len(points)
+        ref_lat = round(float(points["lat"].iloc[0]), 2) if point_count else 0.0
+        
+        if config["snap_tolerance"] and point_count:
+            snap_tolerance = float(config["snap_tolerance"])
+            if not snap_tolerance > 0:
+                raise ValueError("去重容差必须大于0")
+            points["x"], points["y"] = grid_cells(
+                points["lon"].to_numpy(), points["lat"].to_numpy(), snap_tolerance, ref_lat
+            )
+            # 合并后的点沿用该位置第一个采样点的坐标，并保持首次出现的顺序
+            points = points.groupby(["x", "y"], sort=False).agg(
+                lon=("lon", "first"), lat=("lat", "first"), rsrp=("rsrp", RSRP_DEDUP_AGGREGATES[config["dedup_keep"]])
+            ).reset_index(drop=True)
+            if config["dedup_keep"] == "mean":
+                points["rsrp"] = points["rsrp"].round(1)
+        
+        if config["min_distance"] and len(points):
+            min_distance = float(config["min_distance"])
+            if not min_distance > 0:
+                raise ValueError("抽稀间距必须大于0")
+            # 累计距离每跨过一个间距保留一个点
+            distances = track_distances(points["lon"].to_numpy(), points["lat"].to_numpy(), ref_lat)
+            segments = np.floor(distances / min_distance)
+            points = points[np.concatenate([[True], segments[1:] != segments[:-1]])]
+        
+        thinned = pd.DataFrame({
+            config["lon_col"]: points["lon"].to_numpy(),
+            config["lat_col"]: points["lat"].to_numpy(),
+            config["rsrp_col"]: points["rsrp"].to_numpy()
+        })
+        return thinned, point_count - len(thinned)
+    
+    def _write_rsrp_cells(self, chunks: Iterable[pd.DataFrame], fp: BinaryIO, config: Dict[str, Any],
+                          progress: Optional[ProgressCallback] = None) -> int:
+        """按栅格或六边形聚合RSRP采样点，每个格子输出一个按平均值着色的多边形"""
+        if config["aggregate"] not in RSRP_CELL_GRIDS:
+            raise ValueError(f"不支持的聚合方式: {config['aggregate']}")
+        locate_cells, cell_rings = RSRP_CELL_GRIDS[config["aggregate"]]
+        cell_size = float(config["cell_size"])
+        if not cell_size > 0:
+            raise ValueError("聚合格子大小必须大于0")
+        
+        # 逐块分组统计，再与已有结果合并，内存占用只与格子数量有关
+        cells = None
+        ref_lat = None
+        rows = 0
+        for chunk in chunks:
+            rows += len(chunk)
+            points = self._prepare_rsrp_points(chunk, config)
+            if len(points):
+                # 以第一个采样点的纬度作为投影参考纬度，与分块方式无关
+                if ref_lat is None:
+                    ref_lat = round(float(points["lat"].iloc[0]), 2)
+                cell_x, cell_y = locate_cells(points["lon"].to_numpy(), points["lat"].to_numpy(), cell_size, ref_lat)
+                partial = pd.DataFrame({"x": cell_x, "y": cell_y, "rsrp": points["rsrp"].to_numpy()}) \
+                    .groupby(["x", "y"])["rsrp"].agg(["sum", "min", "count"])
+                if cells is not None:
+                    partial = pd.concat([cells, partial]).groupby(level=["x", "y"]) \
+                        .agg({"sum": "sum", "min": "min", "count": "sum"})
+                cells = partial
+            if progress:
+                progress("aggregating", rows)
+        
+        # 每个信号等级只在文档级声明一次样式
+        levels = RSRP_LEVELS + [RSRP_WEAKEST_LEVEL]
+        styles = {
+            f"rsrp_cell{index}": polygon_style(
+                color, simplekml.Color.changealphaint(RSRP_CELL_FILL_ALPHA, color), line_width=1
+            ) + balloon_style(self._rsrp_cell_balloon(strength))
+            for index, (_, color, strength, _) in enumerate(levels)
+        }
+        extended_data = schema_data_template(RSRP_CELL_SCHEMA[0], [name for name, _, _ in RSRP_CELL_SCHEMA[1]])
+        
+        with KMLStreamWriter(fp, name="RSRP栅格图层", styles=styles,
+                             schemas=[schema(*RSRP_CELL_SCHEMA)]) as writer:
+            for start in range(0, 0 if cells is None else len(cells), RENDER_BATCH_SIZE):
+                batch = cells.iloc[start:start + RENDER_BATCH_SIZE]
+                lon_rings, lat_rings = cell_rings(
+                    batch.index.get_level_values("x").to_numpy(),
+                    batch.index.get_level_values("y").to_numpy(),
+                    cell_size, ref_lat
                 )
-                point.style.iconstyle.color = color
-                point.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/shapes/dot.png'
-                
-                # 根据信号强度调整图标大小
-                if rsrp_value > -85:
-                    point.style.iconstyle.scale = 1.2
-                elif rsrp_value > -95:
-                    point.style.iconstyle.scale = 1.0
-                elif rsrp_value > -105:
-                    point.style.iconstyle.scale = 0.9
-                elif rsrp_value > -120:
-                    point.style.iconstyle.scale = 0.8
-                else:
-                    point.style.iconstyle.scale = 0.7
-                
-                # 添加描述
-                point.description = f"<div style='font-family:Arial, sans-serif; font-size:13px;'>"
-                point.description += f"<b>信号强度信息</b><br/>"
-                point.description += f"• RSRP值: <font color='blue'><b>{rsrp_value} dBm</b></font><br/>"
-                point.description += f"• 信号评级: <font color='green'><b>{strength}</b></font><br/>"
-                point.description += f"<br/><b>位置信息</b><br/>"
-                point.description += f"• 经度: {lon}<br/>"
-                point.description += f"• 纬度: {lat}"
-                point.description += f"</div>"
-                
-            except Exception:
-                continue
+                mean = (batch["sum"] / batch["count"]).to_numpy()
+                writer.write_placemarks([
+                    polygon_placemark(
+                        format_coords(ring_lon, ring_lat), style_url=f"rsrp_cell{level}",
+                        extended_data=extended_data.format(round(mean_value, 1), min_value, count)
+                    )
+                    for ring_lon, ring_lat, mean_value, min_value, count, level in zip(
+                        lon_rings.tolist(), lat_rings.tolist(), mean.tolist(),
+                        batch["min"].tolist(), batch["count"].tolist(), rsrp_levels(mean).tolist()
+                    )
+                ])
         
-        # 保存为字节
-        return kml.kml().encode('utf-8')
+        return writer.placemark_count
     
-    def generate_facility_layer(self, df: pd.DataFrame, config: Optional[Dict[str, Any]] = None) -> bytes:
-        """生成光交/机房图层"""
+    @staticmethod
+    def _rsrp_cell_balloon(strength: str) -> str:
+        """RSRP聚合格子的气泡模板，信号评级由所在样式确定"""
+        return (
+            f"<div style='font-family:Arial, sans-serif; font-size:13px;'>"
+            f"<b>栅格信号统计</b><br/>"
+            f"• 平均RSRP: <font color='blue'><b>$[rsrp_cell/mean] dBm</b></font><br/>"
+            f"• 最小RSRP: $[rsrp_cell/min] dBm<br/>"
+            f"• 采样点数: $[rsrp_cell/count]<br/>"
+            f"• 信号评级: <font color='green'><b>{strength}</b></font>"
+            f"</div>$[geDirections]"
+        )
+    
+    @staticmethod
+    def _render_rsrp_batch(df: pd.DataFrame, config: Dict[str, Any]) -> Dict[Optional[str], List[str]]:
+        """渲染一批RSRP数据"""
+        extended_data = schema_data_template(RSRP_POINT_SCHEMA[0], [name for name, _, _ in RSRP_POINT_SCHEMA[1]])
+        points = KMLService._prepare_rsrp_points(df, config)
+        # 经纬度只格式化一次，坐标与ExtendedData共用
+        return {None: [
+            point_placemark(
+                lon, lat, style_url=f"rsrp_level{level}",
+                extended_data=extended_data.format(rsrp_value, lon, lat)
+            )
+            for rsrp_value, lon, lat, level in zip(
+                points["rsrp"].tolist(), points["lon"].astype(str).tolist(),
+                points["lat"].astype(str).tolist(), points["level"].tolist()
+            )
+        ]}
+    
+    @staticmethod
+    def _prepare_rsrp_points(df: pd.DataFrame, config: Dict[str, Any]) -> pd.DataFrame:
+        """批量提取RSRP字段并计算信号等级，丢弃无法解析的行"""
+        points = pd.DataFrame({
+            "rsrp": pd.to_numeric(df[config["rsrp_col"]], errors="coerce"),
+            "lon": pd.to_numeric(df[config["lon_col"]], errors="coerce"),
+            "lat": pd.to_numeric(df[config["lat_col"]], errors="coerce"),
+        }).dropna().astype(np.float64)
+        points["level"] = rsrp_levels(points["rsrp"].to_numpy())
+        return points
+    
+    @staticmethod
+    def _rsrp_balloon(strength: str) -> str:
+        """RSRP点的气泡模板，信号评级由所在样式确定"""
+        return (
+            f"<div style='font-family:Arial, sans-serif; font-size:13px;'>"
+            f"<b>信号强度信息</b><br/>"
+            f"• RSRP值: <font color='blue'><b>$[rsrp_point/rsrp] dBm</b></font><br/>"
+            f"• 信号评级: <font color='green'><b>{strength}</b></font><br/>"
+            f"<br/><b>位置信息</b><br/>"
+            f"• 经度: $[rsrp_point/lon]<br/>"
+            f"• 纬度: $[rsrp_point/lat]"
+            f"</div>$[geDirections]"
+        )
+    
+    def write_facility_layer(self, df: Union[pd.DataFrame, Iterable[pd.DataFrame]], fp: BinaryIO,
+                             config: Optional[Dict[str, Any]] = None, progress: Optional[ProgressCallback] = None,
+                             workers: int = 1, prefix: str = "", suffix: str = "") -> int:
+        """流式写入光交/机房图层，返回Placemark数量"""
         # 默认配置
         default_config = {
             "lon_col": "经度",
@@ -273,66 +803,210 @@ class KMLService:
         config = default_config
         
         # 验证必要字段
-        required_cols = [config["lon_col"], config["lat_col"], config["name_col"]]
+        required_cols = [config[key] for key in LAYER_REQUIRED_COLUMNS["facility"]]
         
+        columns, chunks = split_columns(df)
         for col in required_cols:
-            if col not in df.columns:
+            if col not in columns:
                 raise ValueError(f"缺少必要字段: {col}")
         
-        # 创建KML对象
-        kml = simplekml.Kml(name="光交/机房图层")
+        # 每种设施图标只在文档级声明一次样式
+        icons = list(FACILITY_ICONS.values()) + [FACILITY_DEFAULT_ICON]
+        styles = {
+            f"facility_icon{index}": icon_style(href, scale=1.1) + balloon_style(self._facility_balloon())
+            for index, href in enumerate(icons)
+        }
         
-        # 处理数据
-        for _, row in df.iterrows():
-            try:
-                # 获取数据
-                name = str(row[config["name_col"]])
-                lon = float(row[config["lon_col"]])
-                lat = float(row[config["lat_col"]])
-                
-                # 设施类型
-                facility_type = "光交"
-                if config["type_col"] in df.columns:
-                    facility_type = str(row[config["type_col"]])
-                
-                # 创建点
-                point = kml.newpoint(
-                    name=name,
-                    coords=[(lon, lat)]
-                )
-                
-                # 根据类型设置图标
-                if "光交" in facility_type:
-                    point.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/pushpin/blue-pushpin.png'
-                elif "机房" in facility_type:
-                    point.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/pushpin/red-pushpin.png'
-                else:
-                    point.style.iconstyle.icon.href = 'http://maps.google.com/mapfiles/kml/pushpin/ylw-pushpin.png'
-                
-                point.style.iconstyle.scale = 1.1
-                
-                # 添加描述
-                point.description = f"<div style='font-family:Arial, sans-serif; font-size:13px;'>"
-                point.description += f"<b>设施信息</b><br/>"
-                point.description += f"• 名称: <font color='blue'><b>{name}</b></font><br/>"
-                point.description += f"• 类型: <font color='green'><b>{facility_type}</b></font><br/>"
-                point.description += f"<br/><b>位置信息</b><br/>"
-                point.description += f"• 经度: {lon}<br/>"
-                point.description += f"• 纬度: {lat}"
-                point.description += f"</div>"
-                
-            except Exception:
-                continue
+        with KMLStreamWriter(fp, name=LAYER_NAMES["facility"], styles=styles,
+                             prefix=prefix, suffix=suffix, schemas=[schema(*FACILITY_SCHEMA)]) as writer:
+            self._render_layer(writer, chunks, self._render_facility_batch, config, progress, workers)
+        
+        return writer.placemark_count
+    
+    @staticmethod
+    def _render_facility_batch(df: pd.DataFrame, config: Dict[str, Any]) -> Dict[Optional[str], List[str]]:
+        """渲染一批设施数据"""
+        extended_data = schema_data_template(FACILITY_SCHEMA[0], [name for name, _, _ in FACILITY_SCHEMA[1]])
+        facilities = KMLService._prepare_facilities(df, config)
+        return {None: [
+            point_placemark(
+                lon, lat, name=name, style_url=f"facility_icon{icon}",
+                extended_data=extended_data.format(escape(facility_type), lon, lat)
+            )
+            for name, facility_type, lon, lat, icon in zip(
+                facilities["name"].tolist(), facilities["facility_type"].tolist(),
+                facilities["lon"].astype(str).tolist(), facilities["lat"].astype(str).tolist(),
+                facilities["icon"].tolist()
+            )
+        ]}
+    
+    @staticmethod
+    def _prepare_facilities(df: pd.DataFrame, config: Dict[str, Any]) -> pd.DataFrame:
+        """批量提取设施字段并匹配图标，丢弃无法解析的行"""
+        facilities = pd.DataFrame({
+            "name": df[config["name_col"]].astype(str),
+            "lon": pd.to_numeric(df[config["lon_col"]], errors="coerce"),
+            "lat": pd.to_numeric(df[config["lat_col"]], errors="coerce"),
+        })
+        
+        # 设施类型
+        if config["type_col"] in df.columns:
+            facilities["facility_type"] = df[config["type_col"]].astype(str)
+        else:
+            facilities["facility_type"] = "光交"
         
-        # 保存为字节
-        return kml.kml().encode('utf-8')
+        facilities = facilities.dropna(subset=["lon", "lat"]).astype({"lon": np.float64, "lat": np.float64})
+        
+        # 按类型关键字依次匹配图标，均不匹配时使用默认图标
+        types = facilities["facility_type"].to_numpy(dtype=str)
+        conditions = [np.char.find(types, keyword) >= 0 for keyword in FACILITY_ICONS]
+        facilities["icon"] = np.select(conditions, range(len(conditions)), default=len(conditions))
+        return facilities
     
-    async def get_generate_history(self, db: AsyncSession, user_id: int) -> list:
-        """获取生成历史"""
+    @staticmethod
+    def _facility_balloon() -> str:
+        """设施点的气泡模板"""
+        return (
+            "<h3>$[name]</h3>"
+            "<div style='font-family:Arial, sans-serif; font-size:13px;'>"
+            "<b>设施信息</b><br/>"
+            "• 名称: <font color='blue'><b>$[name]</b></font><br/>"
+            "• 类型: <font color='green'><b>$[facility/type]</b></font><br/>"
+            "<br/><b>位置信息</b><br/>"
+            "• 经度: $[facility/lon]<br/>"
+            "• 纬度: $[facility/lat]"
+            "</div>$[geDirections]"
+        )
+    
+    async def get_generate_history(self, db: AsyncSession, user_id: int, limit: int = 20,
+                                   cursor: Optional[int] = None, layer_type: Optional[str] = None,
+                                   status: Optional[str] = None) -> Tuple[list, Optional[int]]:
+        """按时间倒序分页获取生成历史，返回 (当前页, 下一页游标)
+        
+        以上一页最后一条记录的ID作为游标，按 (created_at, id) 定位后续记录，
+        走 (user_id, created_at, id) 索引，翻页耗时与页码无关；只查询历史列表需要的列。
+        读取首页前先写入该用户排队中的生成历史。
+        """
+        if cursor is None and HistoryService.has_pending(user_id):
+            await HistoryService.flush()
+        
+        query = select(
+            GenerateHistory.id,
+            GenerateHistory.layer_type,
+            GenerateHistory.file_name,
+            GenerateHistory.kml_url,
+            GenerateHistory.status,
+            GenerateHistory.created_at
+        ).where(GenerateHistory.user_id == user_id)
+        
+        if layer_type:
+            query = query.where(GenerateHistory.layer_type == layer_type)
+        if status:
+            query = query.where(GenerateHistory.status == status)
+        if cursor is not None:
+            cursor_created_at = (
+                select(GenerateHistory.created_at)
+                .where(GenerateHistory.id == cursor, GenerateHistory.user_id == user_id)
+                .scalar_subquery()
+            )
+            query = query.where(or_(
+                GenerateHistory.created_at < cursor_created_at,
+                and_(GenerateHistory.created_at == cursor_created_at, GenerateHistory.id < cursor)
+            ))
+        
         result = await db.execute(
-            select(GenerateHistory)
-            .where(GenerateHistory.user_id == user_id)
-            .order_by(GenerateHistory.created_at.desc())
+            query.order_by(GenerateHistory.created_at.desc(), GenerateHistory.id.desc()).limit(limit + 1)
         )
-        history_list = result.scalars().all()
-        return history_list
+        history_list = result.all()
+        next_cursor = history_list[limit - 1].id if len(history_list) > limit else None
+        return history_list[:limit], next_cursor
+
+
+def rsrp_levels(rsrp: np.ndarray) -> np.ndarray:
+    """按阈值批量计算RSRP等级序号（0为最好）"""
+    conditions = [rsrp > threshold for threshold, _, _, _ in RSRP_LEVELS]
+    return np.select(conditions, range(len(conditions)), default=len(conditions))
+
+
+def build_quadtree(lon: np.ndarray, lat: np.ndarray, rows: np.ndarray, max_rows: int = TILE_MAX_ROWS,
+                   max_level: int = TILE_MAX_LEVEL,
+                   groups: Optional[np.ndarray] = None) -> Dict[Tuple[int, int, int], dict]:
+    """按经纬度四叉树划分行号，返回 {(层级, x, y): 分块}
+    
+    每个分块直接包含最多max_rows行（按行序均匀抽取），其余行按象限划入子分块，
+    放大时逐级补充显示；达到最大层级的分块包含剩余的全部行。
+    groups为各行的分组号（同组的行坐标相同），指定时按组整体抽取，同组的行总在同一分块。
+    """
+    if len(rows):
+        bounds = (lon[rows].min(), lat[rows].min(), lon[rows].max(), lat[rows].max())
+    else:
+        bounds = (0.0, 0.0, 0.0, 0.0)
+    
+    tiles = {}
+    pending = [(0, 0, 0, bounds, rows)]
+    while pending:
+        level, x, y, (west, south, east, north), tile_rows = pending.pop()
+        tile = {
+            "name": f"{level}_{x}_{y}.kml",
+            "level": level,
+            "bounds": (float(west), float(south), float(east), float(north)),
+            "rows": tile_rows,
+            "children": []
+        }
+        tiles[(level, x, y)] = tile
+        if len(tile_rows) <= max_rows or level >= max_level:
+            continue
+        
+        if groups is None:
+            keep = np.zeros(len(tile_rows), dtype=bool)
+            keep[np.linspace(0, len(tile_rows) - 1, max_rows).astype(np.int64)] = True
+        else:
+            tile_groups = groups[tile_rows]
+            unique_groups = pd.unique(tile_groups)
+            group_count = max(1, len(unique_groups) * max_rows // len(tile_rows))
+            sampled = unique_groups[np.linspace(0, len(unique_groups) - 1, group_count).astype(np.int64)]
+            keep = np.isin(tile_groups, sampled)
+        tile["rows"] = tile_rows[keep]
+        rest = tile_rows[~keep]
+        
+        mid_lon = (west + east) / 2
+        mid_lat = (south + north) / 2
+        east_half = lon[rest] >= mid_lon
+        north_half = lat[rest] >= mid_lat
+        for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            mask = (east_half == bool(dx)) & (north_half == bool(dy))
+            if not mask.any():
+                continue
+            child_bounds = (
+                mid_lon if dx else west, mid_lat if dy else south,
+                east if dx else mid_lon, north if dy else mid_lat
+            )
+            child = (level + 1, x * 2 + dx, y * 2 + dy)
+            tile["children"].append(child)
+            pending.append(child + (child_bounds, rest[mask]))
+    
+    return tiles
+
+
+def split_columns(data: Union[pd.DataFrame, Iterable[pd.DataFrame]]) -> Tuple[pd.Index, Iterator[pd.DataFrame]]:
+    """统一整表与分块输入，返回 (列名, 数据块迭代器)"""
+    if isinstance(data, pd.DataFrame):
+        return data.columns, iter([data])
+    chunks = iter(data)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        return pd.Index([]), iter([])
+    return first_chunk.columns, itertools.chain([first_chunk], chunks)
+
+
+def render_shard(render: BatchRenderer, df: pd.DataFrame,
+                 config: Dict[str, Any]) -> Dict[Optional[str], Tuple[bytes, int]]:
+    """在工作进程中渲染一个分片，返回 {文件夹: (编码后的片段, Placemark数量)}"""
+    fragments = {}
+    for start in range(0, len(df), RENDER_BATCH_SIZE):
+        for folder, placemarks in render(df.iloc[start:start + RENDER_BATCH_SIZE], config).items():
+            fragments.setdefault(folder, []).append(("".join(placemarks).encode("utf-8"), len(placemarks)))
+    return {
+        folder: (b"".join(data for data, _ in parts), sum(count for _, count in parts))
+        for folder, parts in fragments.items()
+    }
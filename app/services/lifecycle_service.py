@@ -0,0 +1,203 @@
+import asyncio
+import heapq
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Callable, Iterable, List, Set
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.user import UploadedFile, KMLCacheEntry, GenerateHistory
+from app.services.file_service import FileService
+from app.services.history_service import HistoryService
+from app.services.upload_service import UploadService
+
+
+# 正在生成中的上传文件ID，这些文件不会被删除
+ActiveFilesProvider = Callable[[], Set[str]]
+
+
+class LifecycleService:
+    """存储生命周期服务
+    
+    上传文件与生成结果按最近访问时间管理：超过保留时间未访问的文件删除，
+    每个用户的上传文件与全部文件的总大小超过配额时，从最久未访问的开始删除。
+    上传文件的大小按磁盘实际占用统计，包括哈希、列式缓存、空间索引与未完成的分片上传。
+    生成结果被删除后，引用它的生成历史标记为expired。
+    后台清理任务随应用启动，定期执行一次清理。
+    """
+    
+    _task: Optional[asyncio.Task] = None
+    
+    @classmethod
+    def start(cls, active_files: ActiveFilesProvider) -> None:
+        """启动后台清理任务"""
+        if cls._task is None:
+            cls._task = asyncio.create_task(cls._sweep_loop(active_files))
+    
+    @classmethod
+    async def stop(cls) -> None:
+        """停止后台清理任务"""
+        if cls._task is not None:
+            cls._task.cancel()
+            try:
+                await cls._task
+            except asyncio.CancelledError:
+                pass
+            cls._task = None
+    
+    @classmethod
+    async def _sweep_loop(cls, active_files: ActiveFilesProvider) -> None:
+        """定期执行清理，单次失败不影响后续清理"""
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    await cls.sweep(db, active_files())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"存储清理失败: {str(e)}")
+            await asyncio.sleep(settings.STORAGE_SWEEP_INTERVAL_SECONDS)
+    
+    @classmethod
+    async def sweep(cls, db: AsyncSession, active_files: Iterable[str] = ()) -> dict:
+        """执行一次清理：过期文件、超出用户配额与总配额的文件，返回各类删除数量"""
+        active_files = set(active_files)
+        now = datetime.now(timezone.utc)
+        
+        # 超过保留时间未访问的文件
+        result = await db.execute(
+            select(UploadedFile)
+            .where(UploadedFile.last_accessed_at < now - timedelta(seconds=settings.UPLOAD_TTL_SECONDS))
+        )
+        expired_uploads = [item for item in result.scalars().all() if item.file_id not in active_files]
+        await cls.evict_uploads(db, expired_uploads)
+        
+        result = await db.execute(
+            select(KMLCacheEntry)
+            .where(KMLCacheEntry.last_accessed_at < now - timedelta(seconds=settings.KML_TTL_SECONDS))
+        )
+        expired_kml = result.scalars().all()
+        await cls.evict_kml(db, expired_kml)
+        
+        # 超出配额的文件
+        result = await db.execute(select(UploadedFile))
+        uploads = result.scalars().all()
+        user_sizes = await asyncio.to_thread(FileService().get_chunked_upload_sizes)
+        for item, size in zip(uploads, await cls._upload_sizes(uploads)):
+            user_sizes[item.user_id] = user_sizes.get(item.user_id, 0) + size
+        over_quota_users = [
+            user_id for user_id, size in user_sizes.items() if size > settings.USER_STORAGE_QUOTA_BYTES
+        ]
+        quota_evicted = 0
+        for user_id in over_quota_users:
+            quota_evicted += await cls.enforce_user_quota(db, user_id, active_files)
+        quota_evicted += await cls.enforce_global_quota(db, active_files)
+        
+        # 长时间未完成的分片上传
+        stale_uploads = await asyncio.to_thread(FileService().sweep_chunked_uploads, settings.UPLOAD_TTL_SECONDS)
+        
+        return {
+            "expired_uploads": len(expired_uploads),
+            "expired_kml": len(expired_kml),
+            "quota_evicted": quota_evicted,
+            "stale_chunked_uploads": stale_uploads
+        }
+    
+    @classmethod
+    async def enforce_user_quota(cls, db: AsyncSession, user_id: int, keep: Iterable[str] = ()) -> int:
+        """用户上传文件总大小超过配额时删除最久未使用的文件，keep中的文件ID不删除，返回删除数量
+        
+        未完成的分片上传计入总大小，但不会被删除。
+        """
+        keep = set(keep)
+        result = await db.execute(
+            select(UploadedFile)
+            .where(UploadedFile.user_id == user_id)
+            .order_by(UploadedFile.last_accessed_at, UploadedFile.id)
+        )
+        uploads = result.scalars().all()
+        sizes = await cls._upload_sizes(uploads)
+        chunked_sizes = await asyncio.to_thread(FileService().get_chunked_upload_sizes)
+        total_size = sum(sizes) + chunked_sizes.get(user_id, 0)
+        
+        evicted = []
+        for item, size in zip(uploads, sizes):
+            if total_size <= settings.USER_STORAGE_QUOTA_BYTES:
+                break
+            if item.file_id in keep:
+                continue
+            evicted.append(item)
+            total_size -= size
+        await cls.evict_uploads(db, evicted)
+        return len(evicted)
+    
+    @classmethod
+    async def enforce_global_quota(cls, db: AsyncSession, keep: Iterable[str] = ()) -> int:
+        """上传文件与生成结果总大小超过配额时，按最近访问时间统一淘汰，返回删除数量"""
+        keep = set(keep)
+        result = await db.execute(select(UploadedFile).order_by(UploadedFile.last_accessed_at, UploadedFile.id))
+        uploads = result.scalars().all()
+        upload_sizes = await cls._upload_sizes(uploads)
+        chunked_sizes = await asyncio.to_thread(FileService().get_chunked_upload_sizes)
+        kml_size = await db.scalar(select(func.coalesce(func.sum(KMLCacheEntry.file_size), 0)))
+        total_size = sum(upload_sizes) + sum(chunked_sizes.values()) + kml_size
+        if total_size <= settings.STORAGE_MAX_BYTES:
+            return 0
+        
+        entries = await db.scalars(select(KMLCacheEntry).order_by(KMLCacheEntry.last_accessed_at, KMLCacheEntry.id))
+        evicted_uploads, evicted_kml = [], []
+        for item, size in heapq.merge(
+            zip(uploads, upload_sizes),
+            ((entry, entry.file_size) for entry in entries.all()),
+            key=lambda pair: pair[0].last_accessed_at
+        ):
+            if total_size <= settings.STORAGE_MAX_BYTES:
+                break
+            if isinstance(item, UploadedFile):
+                if item.file_id in keep:
+                    continue
+                evicted_uploads.append(item)
+            else:
+                evicted_kml.append(item)
+            total_size -= size
+        
+        await cls.evict_uploads(db, evicted_uploads)
+        await cls.evict_kml(db, evicted_kml)
+        return len(evicted_uploads) + len(evicted_kml)
+    
+    @staticmethod
+    async def _upload_sizes(uploads: List[UploadedFile]) -> List[int]:
+        """上传文件连同派生文件在磁盘上实际占用的空间"""
+        if not uploads:
+            return []
+        paths = [UploadService.get_path(item) for item in uploads]
+        return await asyncio.to_thread(FileService().get_upload_disk_sizes, paths)
+    
+    @staticmethod
+    async def evict_uploads(db: AsyncSession, uploads: List[UploadedFile]) -> None:
+        """删除上传文件及其记录"""
+        if not uploads:
+            return
+        file_service = FileService()
+        for item in uploads:
+            await asyncio.to_thread(file_service.delete_upload, UploadService.get_path(item))
+            await db.delete(item)
+        await db.commit()
+    
+    @staticmethod
+    async def evict_kml(db: AsyncSession, entries: List[KMLCacheEntry]) -> None:
+        """删除生成结果及其缓存记录，引用它的生成历史（包括尚未写入的）标记为expired"""
+        if not entries:
+            return
+        file_service = FileService()
+        for entry in entries:
+            await asyncio.to_thread(file_service.delete_kml, entry.kml_filename)
+            await db.delete(entry)
+        kml_urls = {f"/api/kml/download?filename={entry.kml_filename}" for entry in entries}
+        await HistoryService.expire(kml_urls)
+        await db.execute(
+            update(GenerateHistory)
+            .where(GenerateHistory.kml_url.in_(kml_urls))
+            .values(status="expired", kml_url="")
+        )
+        await db.commit()
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import uuid
+from typing import Optional, Dict, Any, List
+from fastapi import HTTPException
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.user import UploadedFile
+from app.services.file_service import FileService
+
+
+class UploadService:
+    """上传文件记录服务
+    
+    上传完成时登记文件的大小、内容哈希与所属用户，按文件ID查找和校验归属时不再探测文件系统。
+    同一用户重复上传相同内容的文件时复用已有记录，删除新上传的副本。
+    列名与行数由后台解析后补记，生成前据此校验配置的字段。
+    """
+    
+    @staticmethod
+    async def record(db: AsyncSession, user_id: int, upload: dict) -> UploadedFile:
+        """登记上传完成的文件，内容重复时返回已有记录并刷新其访问时间"""
+        result = await db.execute(
+            select(UploadedFile)
+            .where(UploadedFile.user_id == user_id, UploadedFile.content_hash == upload["content_hash"])
+            .order_by(UploadedFile.id)
+            .limit(1)
+        )
+        existing = result.scalar_one_or_none()
+        if existing:
+            await asyncio.to_thread(FileService().delete_upload, upload["stored_path"])
+            # 重新上传视为使用，避免返回的文件ID随即被过期清理删除
+            existing.last_accessed_at = func.now()
+            await db.commit()
+            await db.refresh(existing)
+            return existing
+        
+        uploaded_file = UploadedFile(
+            file_id=upload["file_id"],
+            user_id=user_id,
+            file_name=upload["file_name"],
+            stored_name=os.path.basename(upload["stored_path"]),
+            file_size=upload["file_size"],
+            content_hash=upload["content_hash"]
+        )
+        db.add(uploaded_file)
+        await db.commit()
+        await db.refresh(uploaded_file)
+        return uploaded_file
+    
+    @staticmethod
+    async def get(db: AsyncSession, file_id: str, user_id: int) -> UploadedFile:
+        """获取用户的上传文件记录，不存在或不属于该用户时报404"""
+        result = await db.execute(select(UploadedFile).where(UploadedFile.file_id == file_id))
+        uploaded_file = result.scalar_one_or_none()
+        if uploaded_file is None:
+            uploaded_file = await UploadService._register_legacy(db, file_id, user_id)
+        if uploaded_file is None or uploaded_file.user_id != user_id:
+            raise HTTPException(status_code=404, detail="文件不存在")
+        return uploaded_file
+    
+    @staticmethod
+    async def _register_legacy(db: AsyncSession, file_id: str, user_id: int) -> Optional[UploadedFile]:
+        """为早于上传记录的旧文件补记记录（旧文件未记录归属，归首个使用者）"""
+        try:
+            uuid.UUID(file_id)
+        except ValueError:
+            return None
+        
+        file_service = FileService()
+        file_path = await asyncio.to_thread(file_service.get_file_path, file_id)
+        if not file_path:
+            return None
+        
+        content_hash = await asyncio.to_thread(file_service.get_file_hash, file_id)
+        uploaded_file = UploadedFile(
+            file_id=file_id,
+            user_id=user_id,
+            file_name=os.path.basename(file_path),
+            stored_name=os.path.basename(file_path),
+            file_size=await asyncio.to_thread(os.path.getsize, file_path),
+            content_hash=content_hash
+        )
+        db.add(uploaded_file)
+        await db.commit()
+        await db.refresh(uploaded_file)
+        return uploaded_file
+    
+    @staticmethod
+    def get_path(uploaded_file: UploadedFile) -> str:
+        """上传文件在磁盘上的路径"""
+        return os.path.join(settings.UPLOAD_DIR, uploaded_file.stored_name)
+    
+    @staticmethod
+    async def record_schema(file_id: str, schema: Dict[str, Any]) -> None:
+        """补记后台解析得到的列名与行数"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(UploadedFile).where(UploadedFile.file_id == file_id))
+            uploaded_file = result.scalar_one_or_none()
+            if uploaded_file:
+                uploaded_file.columns = schema["columns"]
+                uploaded_file.row_count = schema["row_count"]
+                await db.commit()
+    
+    @staticmethod
+    def validate_columns(uploaded_file: UploadedFile, required_columns: List[str]) -> None:
+        """按已记录的列名校验必要字段，列名尚未解析完成时跳过"""
+        if uploaded_file.columns is None:
+            return
+        for col in required_columns:
+            if col not in uploaded_file.columns:
+                raise HTTPException(status_code=400, detail=f"缺少必要字段: {col}")
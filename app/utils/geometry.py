@@ -0,0 +1,106 @@
+import numpy as np
+
+
+# 扇区默认半径（度）
+OUTDOOR_SECTOR_RADIUS = 0.001
+INDOOR_SECTOR_RADIUS = 0.0005
+
+# 扇区张角与弧线采样步长（度）
+SECTOR_HALF_WIDTH = 60
+SECTOR_STEP = 5
+
+# 每度纬度对应的米数（局部等距投影近似）
+METERS_PER_DEGREE = 111320.0
+
+# 六边形顶点方向（尖顶朝上，度）
+HEX_CORNER_ANGLES = np.radians(np.arange(6) * 60 - 30)
+
+
+def sector_radius(coverage_types: np.ndarray) -> np.ndarray:
+    """根据覆盖类别批量选择扇区半径（室内扇区半径减半）"""
+    coverage_types = np.asarray(coverage_types, dtype=str)
+    indoor = np.char.find(coverage_types, "室内") >= 0
+    return np.where(indoor, INDOOR_SECTOR_RADIUS, OUTDOOR_SECTOR_RADIUS)
+
+
+def compute_sector_rings(center_lon: np.ndarray, center_lat: np.ndarray, azimuth: np.ndarray,
+                         radius: np.ndarray, half_width: int = SECTOR_HALF_WIDTH,
+                         step: int = SECTOR_STEP) -> tuple:
+    """批量计算扇区多边形顶点
+    
+    返回 (lon_rings, lat_rings)，形状均为 (n, m)：第0列为扇区中心点，
+    其余为方向角 ±half_width 范围内每 step 度的弧线点。
+    """
+    center_lon = np.asarray(center_lon, dtype=np.float64)
+    center_lat = np.asarray(center_lat, dtype=np.float64)
+    radius = np.asarray(radius, dtype=np.float64)
+    
+    # 与逐行计算保持一致：方向角先取整，再按步长展开
+    start = np.trunc(np.asarray(azimuth, dtype=np.float64)) - half_width
+    offsets = np.arange(0, 2 * half_width + 1, step, dtype=np.float64)
+    angles = np.radians(start[:, None] + offsets[None, :])
+    
+    arc_lon = center_lon[:, None] + radius[:, None] * np.sin(angles)
+    arc_lat = center_lat[:, None] + radius[:, None] * np.cos(angles)
+    
+    lon_rings = np.concatenate([center_lon[:, None], arc_lon], axis=1)
+    lat_rings = np.concatenate([center_lat[:, None], arc_lat], axis=1)
+    return lon_rings, lat_rings
+
+
+def _meters_per_lon_degree(ref_lat: float) -> float:
+    """参考纬度处每度经度对应的米数"""
+    return METERS_PER_DEGREE * np.cos(np.radians(ref_lat))
+
+
+def grid_cells(lon: np.ndarray, lat: np.ndarray, size: float, ref_lat: float) -> tuple:
+    """按边长size米的正方形栅格批量计算点所在的格子编号 (ix, iy)"""
+    x = np.asarray(lon, dtype=np.float64) * _meters_per_lon_degree(ref_lat)
+    y = np.asarray(lat, dtype=np.float64) * METERS_PER_DEGREE
+    return np.floor(x / size).astype(np.int64), np.floor(y / size).astype(np.int64)
+
+
+def track_distances(lon: np.ndarray, lat: np.ndarray, ref_lat: float) -> np.ndarray:
+    """按轨迹顺序批量计算每个点距起点的累计距离（米）"""
+    dx = np.diff(np.asarray(lon, dtype=np.float64)) * _meters_per_lon_degree(ref_lat)
+    dy = np.diff(np.asarray(lat, dtype=np.float64)) * METERS_PER_DEGREE
+    return np.concatenate([[0.0], np.cumsum(np.hypot(dx, dy))])
+
+
+def grid_rings(ix: np.ndarray, iy: np.ndarray, size: float, ref_lat: float) -> tuple:
+    """批量计算栅格的闭合边界，返回 (lon_rings, lat_rings)，形状均为 (n, 5)"""
+    corner_x = np.array([0, 1, 1, 0, 0], dtype=np.float64)
+    corner_y = np.array([0, 0, 1, 1, 0], dtype=np.float64)
+    x = (np.asarray(ix, dtype=np.float64)[:, None] + corner_x[None, :]) * size
+    y = (np.asarray(iy, dtype=np.float64)[:, None] + corner_y[None, :]) * size
+    return x / _meters_per_lon_degree(ref_lat), y / METERS_PER_DEGREE
+
+
+def hex_cells(lon: np.ndarray, lat: np.ndarray, size: float, ref_lat: float) -> tuple:
+    """按外接圆半径size米的六边形网格（尖顶朝上）批量计算点所在的轴坐标 (q, r)"""
+    x = np.asarray(lon, dtype=np.float64) * _meters_per_lon_degree(ref_lat)
+    y = np.asarray(lat, dtype=np.float64) * METERS_PER_DEGREE
+    q = (np.sqrt(3) / 3 * x - y / 3) / size
+    r = (2 / 3 * y) / size
+    
+    # 立方坐标取整：误差最大的分量由另外两个分量推出
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+def hex_rings(q: np.ndarray, r: np.ndarray, size: float, ref_lat: float) -> tuple:
+    """批量计算六边形的闭合边界，返回 (lon_rings, lat_rings)，形状均为 (n, 7)"""
+    q = np.asarray(q, dtype=np.float64)
+    r = np.asarray(r, dtype=np.float64)
+    center_x = size * np.sqrt(3) * (q + r / 2)
+    center_y = size * 1.5 * r
+    angles = np.append(HEX_CORNER_ANGLES, HEX_CORNER_ANGLES[0])
+    x = center_x[:, None] + size * np.cos(angles)[None, :]
+    y = center_y[:, None] + size * np.sin(angles)[None, :]
+    return x / _meters_per_lon_degree(ref_lat), y / METERS_PER_DEGREE
@@ -0,0 +1,261 @@
+import shutil
+import tempfile
+from typing import BinaryIO, Dict, Iterable, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+
+KML_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<kml xmlns="http://www.opengis.net/kml/2.2" xmlns:gx="http://www.google.com/kml/ext/2.2">\n'
+)
+
+# 写入缓冲区大小（字节），超过后批量写出
+DEFAULT_BUFFER_SIZE = 256 * 1024
+
+
+def icon_style(href: str, color: Optional[str] = None, scale: Optional[float] = None) -> str:
+    """生成IconStyle片段"""
+    parts = ["<IconStyle>"]
+    if color is not None:
+        parts.append(f"<color>{color}</color>")
+    if scale is not None:
+        parts.append(f"<scale>{scale}</scale>")
+    parts.append(f"<Icon><href>{escape(href)}</href></Icon></IconStyle>")
+    return "".join(parts)
+
+
+def polygon_style(line_color: str, fill_color: str, line_width: int = 2, outline: int = 1) -> str:
+    """生成多边形的LineStyle与PolyStyle片段"""
+    return (
+        f"<LineStyle><color>{line_color}</color><width>{line_width}</width></LineStyle>"
+        f"<PolyStyle><color>{fill_color}</color><fill>1</fill><outline>{outline}</outline></PolyStyle>"
+    )
+
+
+def balloon_style(text: str) -> str:
+    """生成BalloonStyle片段，text为气泡HTML模板，可用$[字段]引用要素的数据"""
+    return f"<BalloonStyle><text>{escape(text)}</text></BalloonStyle>"
+
+
+def schema(schema_id: str, fields: Sequence[Tuple[str, str, str]]) -> str:
+    """生成文档级Schema声明，fields为 [(字段名, 类型, 显示名), ...]"""
+    parts = [f'<Schema name="{schema_id}" id="{schema_id}">']
+    for name, field_type, display_name in fields:
+        parts.append(
+            f'<SimpleField type="{field_type}" name="{name}">'
+            f'<displayName>{escape(display_name)}</displayName></SimpleField>'
+        )
+    parts.append("</Schema>\n")
+    return "".join(parts)
+
+
+def schema_data_template(schema_id: str, names: Sequence[str]) -> str:
+    """生成按Schema组织的ExtendedData片段模板
+    
+    逐行只需按字段顺序以str.format填入字段值，文本值需先经escape转义。
+    """
+    fields = "".join(f'<SimpleData name="{name}">{{}}</SimpleData>' for name in names)
+    return f'<ExtendedData><SchemaData schemaUrl="#{schema_id}">{fields}</SchemaData></ExtendedData>'
+
+
+def format_coords(lons: Sequence[float], lats: Sequence[float]) -> str:
+    """将经纬度序列格式化为coordinates文本"""
+    return " ".join([f"{lon},{lat},0.0" for lon, lat in zip(lons, lats)])
+
+
+def point_placemark(lon: float, lat: float, name: Optional[str] = None,
+                    description: Optional[str] = None, style_url: Optional[str] = None,
+                    extended_data: Optional[str] = None) -> str:
+    """生成点Placemark片段，style_url为文档级共享样式的ID，extended_data为填好的ExtendedData片段"""
+    parts = ["<Placemark>"]
+    if name is not None:
+        parts.append(f"<name>{escape(name)}</name>")
+    if description is not None:
+        parts.append(f"<description>{escape(description)}</description>")
+    if style_url is not None:
+        parts.append(f"<styleUrl>#{style_url}</styleUrl>")
+    if extended_data is not None:
+        parts.append(extended_data)
+    parts.append(f"<Point><coordinates>{lon},{lat},0.0</coordinates></Point></Placemark>\n")
+    return "".join(parts)
+
+
+def polygon_placemark(coordinates: str, name: Optional[str] = None,
+                      description: Optional[str] = None, style_url: Optional[str] = None,
+                      extended_data: Optional[str] = None) -> str:
+    """生成多边形Placemark片段，coordinates为format_coords的结果"""
+    parts = ["<Placemark>"]
+    if name is not None:
+        parts.append(f"<name>{escape(name)}</name>")
+    if description is not None:
+        parts.append(f"<description>{escape(description)}</description>")
+    if style_url is not None:
+        parts.append(f"<styleUrl>#{style_url}</styleUrl>")
+    if extended_data is not None:
+        parts.append(extended_data)
+    parts.append(
+        "<Polygon><outerBoundaryIs><LinearRing>"
+        f"<coordinates>{coordinates}</coordinates>"
+        "</LinearRing></outerBoundaryIs></Polygon></Placemark>\n"
+    )
+    return "".join(parts)
+
+
+def region(west: float, south: float, east: float, north: float, min_lod_pixels: int = 0,
+           max_lod_pixels: int = -1) -> str:
+    """生成Region片段，范围在屏幕上达到min_lod_pixels像素后才激活"""
+    return (
+        "<Region><LatLonAltBox>"
+        f"<north>{north}</north><south>{south}</south><east>{east}</east><west>{west}</west>"
+        "</LatLonAltBox><Lod>"
+        f"<minLodPixels>{min_lod_pixels}</minLodPixels><maxLodPixels>{max_lod_pixels}</maxLodPixels>"
+        "</Lod></Region>"
+    )
+
+
+def network_link(href: str, name: Optional[str] = None, region_fragment: str = "") -> str:
+    """生成NetworkLink片段，带Region时在区域可见后才加载"""
+    parts = ["<NetworkLink>"]
+    if name is not None:
+        parts.append(f"<name>{escape(name)}</name>")
+    parts.append(region_fragment)
+    parts.append(f"<Link><href>{escape(href)}</href><viewRefreshMode>onRegion</viewRefreshMode></Link></NetworkLink>\n")
+    return "".join(parts)
+
+
+class KMLStreamWriter:
+    """流式KML写入器
+    
+    直接把Placemark片段分批写入目标文件对象，不构建完整的对象树。
+    样式在文档级声明一次，Placemark通过styleUrl引用。
+    第一个文件夹（或无文件夹时的文档本身）直接写出；其余文件夹的内容
+    先写入临时文件，关闭时按声明顺序拼接，内存占用与行数无关。
+    """
+    
+    def __init__(self, fp: BinaryIO, name: str, folders: Sequence[str] = (),
+                 styles: Optional[Dict[str, str]] = None, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 prefix: str = "", suffix: str = "", schemas: Sequence[str] = ()):
+        """初始化写入器
+        
+        styles为 {样式ID: 样式内容} 的共享样式表；prefix、suffix为文档级的附加片段
+        （如Region、NetworkLink），分别写在文件夹之前和之后；schemas为schema()生成的Schema声明。
+        """
+        self.fp = fp
+        self.name = name
+        self.folders = list(folders)
+        self.styles = dict(styles or {})
+        self.prefix = prefix
+        self.suffix = suffix
+        self.schemas = list(schemas)
+        self.buffer_size = buffer_size
+        self.placemark_count = 0
+        self._spools = {}
+        self._buffers = {}
+        self._buffer_sizes = {}
+        self._started = False
+        self._closed = False
+    
+    def __enter__(self) -> "KMLStreamWriter":
+        self.start()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard_spools()
+    
+    def start(self) -> None:
+        """写出文档头"""
+        if self._started:
+            return
+        self._started = True
+        header = KML_HEADER + f"<Document>\n<name>{escape(self.name)}</name>\n"
+        for style_id, style in self.styles.items():
+            header += f'<Style id="{style_id}">{style}</Style>\n'
+        header += self.prefix
+        header += "".join(self.schemas)
+        if self.folders:
+            header += f"<Folder>\n<name>{escape(self.folders[0])}</name>\n"
+        self.fp.write(header.encode("utf-8"))
+    
+    def write_placemarks(self, placemarks: Iterable[str], folder: Optional[str] = None) -> None:
+        """写入一批Placemark片段"""
+        key = self._folder_key(folder)
+        buffer = self._buffers.setdefault(key, [])
+        size = self._buffer_sizes.get(key, 0)
+        for placemark in placemarks:
+            buffer.append(placemark)
+            size += len(placemark)
+            self.placemark_count += 1
+            if size >= self.buffer_size:
+                self._flush(key)
+                size = 0
+        self._buffer_sizes[key] = size
+    
+    def write_encoded(self, data: bytes, placemark_count: int, folder: Optional[str] = None) -> None:
+        """写入已编码的Placemark片段（如并行渲染的分片结果）"""
+        key = self._folder_key(folder)
+        self._flush(key)
+        self._write(key, data)
+        self.placemark_count += placemark_count
+    
+    def close(self) -> None:
+        """写出剩余内容并补全文档结尾"""
+        if self._closed:
+            return
+        self.start()
+        for key in list(self._buffers):
+            self._flush(key)
+        
+        if self.folders:
+            self.fp.write(b"</Folder>\n")
+            for index, folder in enumerate(self.folders[1:], start=1):
+                self.fp.write(f"<Folder>\n<name>{escape(folder)}</name>\n".encode("utf-8"))
+                spool = self._spools.pop(index, None)
+                if spool is not None:
+                    spool.seek(0)
+                    shutil.copyfileobj(spool, self.fp)
+                    spool.close()
+                self.fp.write(b"</Folder>\n")
+        
+        self.fp.write(f"{self.suffix}</Document>\n</kml>\n".encode("utf-8"))
+        self._closed = True
+    
+    def _folder_key(self, folder: Optional[str]) -> int:
+        """将文件夹名称映射为序号"""
+        if folder is None:
+            if self.folders:
+                raise ValueError("存在文件夹时必须指定写入的文件夹")
+            return 0
+        if folder not in self.folders:
+            raise ValueError(f"未声明的文件夹: {folder}")
+        return self.folders.index(folder)
+    
+    def _flush(self, key: int) -> None:
+        """将缓冲区内容写出到目标或临时文件"""
+        buffer = self._buffers.get(key)
+        if not buffer:
+            return
+        data = "".join(buffer).encode("utf-8")
+        buffer.clear()
+        self._buffer_sizes[key] = 0
+        self._write(key, data)
+    
+    def _write(self, key: int, data: bytes) -> None:
+        """写出到目标（第一个文件夹）或对应的临时文件"""
+        if key == 0:
+            self.start()
+            self.fp.write(data)
+        else:
+            spool = self._spools.get(key)
+            if spool is None:
+                spool = tempfile.TemporaryFile()
+                self._spools[key] = spool
+            spool.write(data)
+    
+    def _discard_spools(self) -> None:
+        """异常时清理临时文件"""
+        for spool in self._spools.values():
+            spool.close()
+        self._spools.clear()
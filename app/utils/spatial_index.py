@@ -0,0 +1,97 @@
+from typing import Dict, Sequence
+import numpy as np
+
+
+# 网格索引每个格子的平均点数
+GRID_INDEX_BUCKET_ROWS = 64
+
+
+def build_grid_index(lon: np.ndarray, lat: np.ndarray) -> Dict[str, np.ndarray]:
+    """按经纬度构建均匀网格空间索引
+    
+    坐标无效的行不进入索引。各行按所在格子排序存储，同一格子的行连续存放，
+    starts[k]:starts[k + 1] 为第k个格子（行优先）在 rows/lon/lat 中的范围。
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    rows = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+    lon, lat = lon[rows], lat[rows]
+    
+    if len(rows):
+        bounds = np.array([lon.min(), lat.min(), lon.max(), lat.max()])
+    else:
+        bounds = np.zeros(4)
+    size = max(1, int(np.ceil(np.sqrt(len(rows) / GRID_INDEX_BUCKET_ROWS))))
+    shape = np.array([size, size])
+    
+    cell_x, cell_y = _cell_coords(lon, lat, bounds, shape)
+    cells = cell_y * shape[0] + cell_x
+    order = np.argsort(cells, kind="stable")
+    return {
+        "bounds": bounds,
+        "shape": shape,
+        "starts": np.searchsorted(cells[order], np.arange(shape[0] * shape[1] + 1)),
+        "rows": rows[order],
+        "lon": lon[order],
+        "lat": lat[order]
+    }
+
+
+def query_bbox(index: Dict[str, np.ndarray], west: float, south: float, east: float, north: float) -> np.ndarray:
+    """查询经纬度范围内（含边界）的行号，按原始顺序返回"""
+    positions = _candidates(index, west, south, east, north)
+    lon, lat = index["lon"][positions], index["lat"][positions]
+    inside = (lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)
+    return np.sort(index["rows"][positions[inside]])
+
+
+def query_polygon(index: Dict[str, np.ndarray], polygon: Sequence[Sequence[float]]) -> np.ndarray:
+    """查询多边形内的行号，按原始顺序返回"""
+    vertices = np.asarray(polygon, dtype=np.float64)
+    west, south = vertices.min(axis=0)
+    east, north = vertices.max(axis=0)
+    positions = _candidates(index, west, south, east, north)
+    inside = points_in_polygon(index["lon"][positions], index["lat"][positions], vertices)
+    return np.sort(index["rows"][positions[inside]])
+
+
+def points_in_polygon(lon: np.ndarray, lat: np.ndarray, polygon: Sequence[Sequence[float]]) -> np.ndarray:
+    """射线法批量判断点是否在多边形内（逐条边向量化计算）"""
+    vertices = np.asarray(polygon, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    inside = np.zeros(len(lon), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        if y1 == y2:
+            continue
+        crosses = (y1 > lat) != (y2 > lat)
+        inside ^= crosses & (lon < (x2 - x1) * (lat - y1) / (y2 - y1) + x1)
+    return inside
+
+
+def _cell_coords(lon: np.ndarray, lat: np.ndarray, bounds: np.ndarray, shape: np.ndarray) -> tuple:
+    """计算点所在的格子坐标，超出索引范围的点归入边缘格子"""
+    west, south, east, north = bounds
+    cell_x = np.floor((lon - west) / max(east - west, 1e-12) * shape[0])
+    cell_y = np.floor((lat - south) / max(north - south, 1e-12) * shape[1])
+    return (
+        np.clip(cell_x, 0, shape[0] - 1).astype(np.int64),
+        np.clip(cell_y, 0, shape[1] - 1).astype(np.int64)
+    )
+
+
+def _candidates(index: Dict[str, np.ndarray], west: float, south: float, east: float, north: float) -> np.ndarray:
+    """返回与查询范围相交的格子内所有点在索引数组中的位置"""
+    bounds, shape, starts = index["bounds"], index["shape"], index["starts"]
+    if len(index["rows"]) == 0 or west > bounds[2] or east < bounds[0] or south > bounds[3] or north < bounds[1]:
+        return np.array([], dtype=np.int64)
+    
+    (x0, x1), (y0, y1) = _cell_coords(np.array([west, east]), np.array([south, north]), bounds, shape)
+    
+    # 每行格子在存储中连续，逐行取出 [x0, x1] 对应的一段
+    row_cells = np.arange(y0, y1 + 1) * shape[0]
+    begin = starts[row_cells + x0]
+    end = starts[row_cells + x1 + 1]
+    lengths = end - begin
+    offsets = np.repeat(begin - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.arange(lengths.sum()) + offsets
@@ -0,0 +1,281 @@
+"""三种图层生成的基准测试
+
+生成基站工参、RSRP路测、光交/机房三类合成数据（CSV与XLSX），
+分阶段统计解析、预处理、渲染、序列化、写出耗时，以及峰值内存与输出大小，
+结果以JSON格式输出，便于不同版本之间对比。
+
+用法：
+    python benchmarks/bench_layers.py --rows 1000 100000 --output bench.json
+    python benchmarks/bench_layers.py --rows 1000 --compare bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from app.core.config import settings  # noqa: E402
+from app.services.kml_service import KMLService  # noqa: E402
+
+
+LAYER_TYPES = ("sector", "rsrp", "facility")
+FORMATS = ("csv", "xlsx")
+DEFAULT_ROWS = (1000, 100000, 1000000)
+
+# 合成数据的中心坐标（度）
+CENTER_LON = 113.3
+CENTER_LAT = 23.1
+
+
+def make_sector_sheet(rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    """基站工参：每个基站3个小区，方向角相差120度"""
+    sites = np.arange(rows) // 3
+    site_count = sites[-1] + 1 if rows else 0
+    site_lon = CENTER_LON + rng.uniform(-0.5, 0.5, site_count)
+    site_lat = CENTER_LAT + rng.uniform(-0.5, 0.5, site_count)
+    return pd.DataFrame({
+        "小区名称": [f"站点{site}-{index % 3 + 1}" for index, site in enumerate(sites)],
+        "经度": site_lon[sites].round(6),
+        "纬度": site_lat[sites].round(6),
+        "方向角": (rng.integers(0, 120, site_count)[sites] + (np.arange(rows) % 3) * 120) % 360,
+        "PCI": rng.integers(0, 504, rows),
+        "TAC": rng.integers(10000, 10100, rows),
+        "覆盖类别": rng.choice(["室外", "室内"], rows, p=[0.8, 0.2]),
+    })
+
+
+def make_rsrp_sheet(rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    """RSRP路测：随机游走的轨迹点"""
+    return pd.DataFrame({
+        "经度": (CENTER_LON + np.cumsum(rng.normal(0, 0.00005, rows))).round(6),
+        "纬度": (CENTER_LAT + np.cumsum(rng.normal(0, 0.00005, rows))).round(6),
+        "RSRP": rng.normal(-95, 12, rows).clip(-140, -44).round(1),
+    })
+
+
+def make_facility_sheet(rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    """光交/机房：随机分布的设施点"""
+    types = rng.choice(["光交", "机房", "其他"], rows, p=[0.6, 0.3, 0.1])
+    return pd.DataFrame({
+        "名称": [f"{facility_type}{index}" for index, facility_type in enumerate(types)],
+        "类型": types,
+        "经度": (CENTER_LON + rng.uniform(-0.5, 0.5, rows)).round(6),
+        "纬度": (CENTER_LAT + rng.uniform(-0.5, 0.5, rows)).round(6),
+    })
+
+
+SHEET_MAKERS = {
+    "sector": make_sector_sheet,
+    "rsrp": make_rsrp_sheet,
+    "facility": make_facility_sheet
+}
+
+
+def prepare_input(data_dir: str, layer_type: str, rows: int, file_format: str) -> str:
+    """生成（或复用已生成的）合成输入文件"""
+    file_path = os.path.join(data_dir, f"{layer_type}_{rows}.{file_format}")
+    if os.path.exists(file_path):
+        return file_path
+    
+    df = SHEET_MAKERS[layer_type](rows, np.random.default_rng(rows))
+    temp_path = os.path.join(data_dir, f"{layer_type}_{rows}.tmp.{file_format}")
+    if file_format == "csv":
+        df.to_csv(temp_path, index=False)
+    else:
+        df.to_excel(temp_path, index=False, engine="openpyxl")
+    os.replace(temp_path, file_path)
+    return file_path
+
+
+class TimedFile:
+    """统计写出耗时的文件包装"""
+    
+    def __init__(self, fp):
+        self.fp = fp
+        self.elapsed = 0.0
+    
+    def write(self, data: bytes) -> int:
+        start = time.perf_counter()
+        written = self.fp.write(data)
+        self.elapsed += time.perf_counter() - start
+        return written
+
+
+class TimedCall:
+    """统计累计耗时的函数包装，多个函数可共用一个计时器"""
+    
+    def __init__(self, func, timer: "Timer"):
+        self.func = func
+        self.timer = timer
+    
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.timer.elapsed += time.perf_counter() - start
+
+
+class Timer:
+    """一个阶段的累计耗时"""
+    
+    def __init__(self):
+        self.elapsed = 0.0
+
+
+# 各图层在渲染之外单独执行的预处理（扇区图层的小区清洗与基站点汇总、渲染）
+PREPARE_METHODS = {
+    "sector": ("_prepare_sector_cells", "_station_cell_lines", "_group_stations", "_render_station_batch"),
+    "rsrp": (),
+    "facility": ()
+}
+
+
+def run_case(layer_type: str, rows: int, file_format: str, input_path: str, work_dir: str) -> dict:
+    """在独立进程中执行一个用例，峰值内存只统计该用例"""
+    settings.UPLOAD_DIR = work_dir
+    settings.KML_DIR = work_dir
+    service = KMLService()
+    stages = {}
+    
+    # 解析原始文件
+    start = time.perf_counter()
+    df = service.file_service.parse_file(input_path)
+    stages["parse"] = time.perf_counter() - start
+    
+    # 列式缓存命中后的加载
+    cached_path = os.path.join(work_dir, os.path.basename(input_path))
+    shutil.copyfile(input_path, cached_path)
+    service.file_service.read_table(cached_path)
+    start = time.perf_counter()
+    service.file_service.read_table(cached_path)
+    stages["parse_cached"] = time.perf_counter() - start
+    
+    # 预处理、渲染、序列化与写出：预处理、渲染与写出单独计时，其余为片段拼接编码与文件夹暂存
+    render_timer = Timer()
+    render_attr = f"_render_{layer_type}_batch"
+    setattr(service, render_attr, TimedCall(getattr(KMLService, render_attr), render_timer))
+    prepare_timer = Timer()
+    for method in PREPARE_METHODS[layer_type]:
+        setattr(service, method, TimedCall(getattr(KMLService, method), prepare_timer))
+    output_path = os.path.join(work_dir, f"{layer_type}.kml")
+    with open(output_path, "wb") as f:
+        timed_file = TimedFile(f)
+        start = time.perf_counter()
+        placemark_count = getattr(service, f"write_{layer_type}_layer")(df, timed_file)
+        close_start = time.perf_counter()
+    end = time.perf_counter()
+    generate_time = end - start
+    stages["write"] = timed_file.elapsed + end - close_start
+    stages["prepare"] = prepare_timer.elapsed
+    stages["render"] = render_timer.elapsed
+    stages["serialize"] = generate_time - stages["prepare"] - stages["render"] - stages["write"]
+    stages["total"] = stages["parse"] + generate_time
+    
+    return {
+        "layer_type": layer_type,
+        "rows": rows,
+        "format": file_format,
+        "input_bytes": os.path.getsize(input_path),
+        "output_bytes": os.path.getsize(output_path),
+        "placemark_count": placemark_count,
+        "stages": {name: round(seconds, 4) for name, seconds in stages.items()},
+        # Linux下ru_maxrss单位为KB
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def git_revision() -> str:
+    """当前代码版本"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(results: list, baseline_path: str) -> None:
+    """与基线结果对比，打印各阶段耗时的变化倍数"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {
+            (item["layer_type"], item["rows"], item["format"]): item
+            for item in json.load(f)["results"]
+        }
+    
+    # 对比表与进度一样输出到标准错误，标准输出只有JSON结果
+    print(f"{'case':<28}{'stage':<14}{'baseline':>10}{'current':>10}{'ratio':>8}", file=sys.stderr)
+    for item in results:
+        key = (item["layer_type"], item["rows"], item["format"])
+        if key not in baseline:
+            continue
+        case = "/".join(str(part) for part in key)
+        for stage, seconds in item["stages"].items():
+            old = baseline[key]["stages"].get(stage)
+            if old is None:
+                continue
+            ratio = f"{seconds / old:.2f}x" if old else "-"
+            print(f"{case:<28}{stage:<14}{old:>10.3f}{seconds:>10.3f}{ratio:>8}", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="图层生成基准测试")
+    parser.add_argument("--rows", type=int, nargs="+", default=list(DEFAULT_ROWS), help="数据行数")
+    parser.add_argument("--layers", nargs="+", choices=LAYER_TYPES, default=list(LAYER_TYPES), help="图层类型")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS), help="输入格式")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "kml_bench_data"),
+                        help="合成数据目录（已生成的文件会被复用）")
+    parser.add_argument("--output", help="结果JSON文件路径，默认输出到标准输出")
+    parser.add_argument("--compare", help="用于对比的基线结果JSON文件")
+    args = parser.parse_args()
+    
+    os.makedirs(args.data_dir, exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for rows in args.rows:
+        for file_format in args.formats:
+            for layer_type in args.layers:
+                input_path = prepare_input(args.data_dir, layer_type, rows, file_format)
+                with tempfile.TemporaryDirectory() as work_dir:
+                    # 每个用例使用新进程，保证峰值内存互不影响
+                    with context.Pool(1) as pool:
+                        result = pool.apply(run_case, (layer_type, rows, file_format, input_path, work_dir))
+                results.append(result)
+                print(f"{layer_type:<9}{rows:>9} {file_format:<5}"
+                      f"total {result['stages']['total']:.3f}s  rss {result['peak_rss_mb']}MB", file=sys.stderr)
+    
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results
+    }
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
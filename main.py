@@ -3,6 +3,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.core.database import init_db
 from app.api import auth, user, upload, kml
+from app.services.history_service import HistoryService
+from app.services.job_service import JobService
+from app.services.lifecycle_service import LifecycleService
 
 
 # 创建FastAPI应用
@@ -34,6 +37,22 @@ async def startup_event():
     # 初始化数据库
     await init_db()
     print("数据库初始化完成")
+    
+    # 启动生成任务进程池与生成历史的后台写入
+    JobService.start()
+    HistoryService.start()
+    
+    # 启动存储清理任务（不删除生成中的上传文件）
+    LifecycleService.start(JobService.active_file_ids)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时执行"""
+    await LifecycleService.stop()
+    await JobService.shutdown()
+    # 写入尚未写入的生成历史
+    await HistoryService.stop()
 
 
 @app.get("/", summary="健康检查")
@@ -0,0 +1,51 @@
+import asyncio
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy.engine import Connection
+from app.core.database import Base, create_engine
+import app.models.user  # noqa: F401  注册模型到Base.metadata
+
+
+config = context.config
+# 应用启动时执行迁移不改动应用的日志配置
+if config.config_file_name is not None and config.attributes.get("connection") is None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def do_run_migrations(connection: Connection) -> None:
+    """在给定连接上执行迁移"""
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # SQLite不支持大部分ALTER TABLE，以重建表的方式修改
+        render_as_batch=connection.dialect.name == "sqlite"
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations() -> None:
+    """命令行执行时按应用配置创建连接"""
+    engine = create_engine()
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await engine.dispose()
+
+
+def run_migrations_offline() -> None:
+    """生成SQL脚本而不连接数据库"""
+    from app.core.config import settings
+    context.configure(url=settings.DATABASE_URL, target_metadata=target_metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+elif config.attributes.get("connection") is not None:
+    # 应用启动时由init_db传入连接
+    do_run_migrations(config.attributes["connection"])
+else:
+    asyncio.run(run_async_migrations())
@@ -0,0 +1,76 @@
+"""结果缓存、上传文件记录与生成历史分页索引
+
+以前由create_all建表的数据库可能已有其中部分表，已存在的表、列与索引跳过。
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+    
+    if "kml_cache" not in tables:
+        op.create_table(
+            "kml_cache",
+            sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column("cache_key", sa.String(), nullable=False),
+            sa.Column("kml_filename", sa.String(), nullable=False),
+            sa.Column("file_size", sa.BigInteger(), nullable=False),
+            sa.Column("hit_count", sa.Integer(), nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column("last_accessed_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.PrimaryKeyConstraint("id")
+        )
+        op.create_index("ix_kml_cache_id", "kml_cache", ["id"])
+        op.create_index("ix_kml_cache_cache_key", "kml_cache", ["cache_key"], unique=True)
+        op.create_index("ix_kml_cache_last_accessed_at", "kml_cache", ["last_accessed_at"])
+    
+    if "uploaded_files" not in tables:
+        op.create_table(
+            "uploaded_files",
+            sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+            sa.Column("file_id", sa.String(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=False),
+            sa.Column("file_name", sa.String(), nullable=False),
+            sa.Column("stored_name", sa.String(), nullable=False),
+            sa.Column("file_size", sa.BigInteger(), nullable=False),
+            sa.Column("content_hash", sa.String(), nullable=False),
+            sa.Column("columns", sa.JSON(), nullable=True),
+            sa.Column("row_count", sa.Integer(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column("last_accessed_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.PrimaryKeyConstraint("id")
+        )
+        op.create_index("ix_uploaded_files_id", "uploaded_files", ["id"])
+        op.create_index("ix_uploaded_files_file_id", "uploaded_files", ["file_id"], unique=True)
+        op.create_index("ix_uploaded_files_user_hash", "uploaded_files", ["user_id", "content_hash"])
+        op.create_index("ix_uploaded_files_last_accessed_at", "uploaded_files", ["last_accessed_at"])
+    elif "last_accessed_at" not in [col["name"] for col in inspector.get_columns("uploaded_files")]:
+        with op.batch_alter_table("uploaded_files", recreate="always") as batch_op:
+            batch_op.add_column(sa.Column(
+                "last_accessed_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True
+            ))
+            batch_op.create_index("ix_uploaded_files_last_accessed_at", ["last_accessed_at"])
+    
+    history_indexes = [index["name"] for index in inspector.get_indexes("generate_history")]
+    if "ix_generate_history_user_created" not in history_indexes:
+        op.create_index(
+            "ix_generate_history_user_created", "generate_history", ["user_id", "created_at", "id"]
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_generate_history_user_created", table_name="generate_history")
+    op.drop_table("uploaded_files")
+    op.drop_table("kml_cache")
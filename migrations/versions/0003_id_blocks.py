@@ -0,0 +1,33 @@
+"""生成历史ID分配表
+
+生成历史改为批量写入，记录ID从该表按段预留，起始值接在已有记录之后。
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if "id_blocks" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    id_blocks = op.create_table(
+        "id_blocks",
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("next_id", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("name")
+    )
+    max_id = op.get_bind().execute(sa.text("SELECT COALESCE(MAX(id), 0) FROM generate_history")).scalar()
+    op.bulk_insert(id_blocks, [{"name": "generate_history", "next_id": max_id + 1}])
+
+
+def downgrade() -> None:
+    op.drop_table("id_blocks")
@@ -5,7 +5,9 @@ const { api } = require('../../utils/api');
 Page({
   data: {
     historyList: [],
-    loading: true
+    nextCursor: null,
+    loading: true,
+    loadingMore: false
   },
 
   onLoad() {
@@ -16,7 +18,12 @@ Page({
     this.loadHistory();
   },
 
-  // 加载历史记录
+  // 滚动到底部时加载下一页
+  onReachBottom() {
+    this.loadMore();
+  },
+
+  // 加载历史记录（第一页）
   loadHistory() {
     this.setData({ loading: true });
     
@@ -24,6 +31,7 @@ Page({
       .then(res => {
         this.setData({
           historyList: res.data,
+          nextCursor: res.next_cursor,
           loading: false
         });
       })
@@ -33,6 +41,25 @@ Page({
       });
   },
 
+  // 加载下一页历史记录
+  loadMore() {
+    if (this.data.nextCursor === null || this.data.loading || this.data.loadingMore) return;
+    this.setData({ loadingMore: true });
+    
+    api.kml.history({ cursor: this.data.nextCursor })
+      .then(res => {
+        this.setData({
+          historyList: this.data.historyList.concat(res.data),
+          nextCursor: res.next_cursor,
+          loadingMore: false
+        });
+      })
+      .catch(err => {
+        this.setData({ loadingMore: false });
+        wx.showToast({ title: '加载失败', icon: 'none' });
+      });
+  },
+
   // 格式化时间
   formatTime(timeStr) {
     if (!timeStr) return '';
@@ -80,6 +107,24 @@ Page({
     });
   },
 
+  // 生成结果已过期清理：重新上传文件生成同类图层
+  regenerateKML(e) {
+    const layerType = e.currentTarget.dataset.layerType;
+    
+    wx.showModal({
+      title: '生成结果已过期',
+      content: '该KML已被清理，请重新上传文件生成',
+      confirmText: '重新生成',
+      success: (res) => {
+        if (res.confirm) {
+          wx.navigateTo({
+            url: '/pages/upload/upload?layer_type=' + layerType
+          });
+        }
+      }
+    });
+  },
+
   // 跳转到上传页面
   navigateToUpload() {
     wx.navigateTo({
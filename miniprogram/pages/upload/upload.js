@@ -9,6 +9,13 @@ Page({
     uploading: false
   },
 
+  // 从生成历史重新生成时预选图层类型
+  onLoad(options) {
+    if (options.layer_type) {
+      this.setData({ layerType: options.layer_type });
+    }
+  },
+
   // 选择文件
   chooseFile() {
     wx.chooseMessageFile({
@@ -85,7 +92,7 @@ Page({
       })
       .then(res => {
         this.setData({ uploading: false });
-        wx.showToast({ title: '生成成功', icon: 'success' });
+        wx.showToast({ title: '已提交生成', icon: 'success' });
         
         // 跳转到历史页面查看
         wx.navigateTo({
@@ -130,7 +130,8 @@ const api = {
       method: 'POST', 
       data: { file_id: fileId, layer_type: layerType, config: JSON.stringify(config) } 
     }),
-    history: () => request({ url: '/api/kml/history' }),
+    job: (jobId) => request({ url: '/api/kml/job?job_id=' + jobId }),
+    history: (params) => request({ url: '/api/kml/history', data: params }),
     download: (filename) => app.globalData.apiBaseUrl + '/api/kml/download?filename=' + filename
   }
 };
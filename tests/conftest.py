@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# 在临时目录中运行：不读取本地.env，上传与输出目录也不创建在仓库中
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="kml-tests-"))
@@ -0,0 +1,80 @@
+"""KML下载的条件请求、范围请求与压缩协商测试"""
+import pytest
+from starlette.requests import Request
+
+from app.api.kml import accepts_gzip, etag_matches, parse_byte_range
+
+
+ETAG = '"abc"'
+
+
+def request_with(accept_encoding: str) -> Request:
+    return Request({"type": "http", "headers": [(b"accept-encoding", accept_encoding.encode())]})
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=10-", (10, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-5000", (990, 999)),
+    ("bytes=5-5", (5, 5)),
+    # 无法满足的范围
+    ("bytes=1000-", ()),
+    ("bytes=1000-2000", ()),
+    ("bytes=-0", ()),
+    # 不支持或无效的范围按完整文件返回
+    ("bytes=5-3", None),
+    ("bytes=0-1,5-9", None),
+    ("items=0-99", None),
+    ("bytes=-", None),
+    ("bytes=a-b", None),
+    ("bytes=10", None),
+])
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, 1000) == expected
+
+
+def test_parse_byte_range_empty_file():
+    assert parse_byte_range("bytes=0-", 0) == ()
+    assert parse_byte_range("bytes=-10", 0) == ()
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("", False),
+    (ETAG, True),
+    (f'W/{ETAG}', True),
+    (f'"other", {ETAG}', True),
+    ("*", True),
+    ('"other"', False),
+])
+def test_etag_matches_weak(header, expected):
+    assert etag_matches(header, ETAG) == expected
+
+
+@pytest.mark.parametrize("header, expected", [
+    (ETAG, True),
+    (f' {ETAG} ', True),
+    (f'W/{ETAG}', False),
+    ("*", False),
+    ('"other"', False),
+    ("Wed, 21 Oct 2015 07:28:00 GMT", False),
+])
+def test_etag_matches_strong(header, expected):
+    assert etag_matches(header, ETAG, strong=True) == expected
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", False),
+    ("gzip", True),
+    ("deflate, GZIP", True),
+    ("gzip;q=0.5", True),
+    ("gzip; q=0", False),
+    ("gzip;q=0.0, deflate", False),
+    ("gzip;q=abc", False),
+    ("*", True),
+    ("br, deflate", False),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(request_with(header)) == expected
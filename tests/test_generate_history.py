@@ -0,0 +1,106 @@
+"""生成历史游标分页测试"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import delete, insert
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, engine, init_db
+from app.models.user import GenerateHistory, IdBlock
+from app.services.history_service import HistoryService
+from app.services.kml_service import KMLService
+
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def history_service(monkeypatch):
+    monkeypatch.setattr(settings, "HISTORY_FLUSH_INTERVAL_MS", 600000)
+    monkeypatch.setattr(HistoryService, "_pending", {})
+    monkeypatch.setattr(HistoryService, "_dropped", set())
+    monkeypatch.setattr(HistoryService, "_next_id", 0)
+    monkeypatch.setattr(HistoryService, "_max_id", 0)
+
+
+def run(test):
+    """在新的事件循环中执行测试：准备数据库与生成历史，结束时停止后台任务"""
+    async def main():
+        await init_db()
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(GenerateHistory))
+            # 新记录的ID接在已有记录之后分配
+            await db.execute(delete(IdBlock))
+            await db.execute(insert(GenerateHistory), [
+                {
+                    "id": history_id,
+                    "user_id": 2 if history_id % 5 == 0 else 1,
+                    "layer_type": "rsrp" if history_id % 2 else "sector",
+                    "file_name": f"{history_id}.csv",
+                    "kml_url": "",
+                    "status": "failed" if history_id % 3 == 0 else "success",
+                    # 每两条记录的创建时间相同，按ID区分先后
+                    "created_at": START + timedelta(minutes=history_id // 2)
+                }
+                for history_id in range(1, 31)
+            ])
+            await db.commit()
+        try:
+            async with AsyncSessionLocal() as db:
+                await test(db)
+        finally:
+            if HistoryService._task is not None:
+                HistoryService._task.cancel()
+                HistoryService._task = None
+            await engine.dispose()
+    asyncio.run(main())
+
+
+async def all_pages(db, limit: int, **filters) -> list:
+    ids, cursor = [], None
+    while True:
+        page, cursor = await KMLService().get_generate_history(db, 1, limit=limit, cursor=cursor, **filters)
+        assert len(page) <= limit
+        ids.extend(item.id for item in page)
+        if cursor is None:
+            return ids
+        assert cursor == page[-1].id
+
+
+def expected_ids(predicate=lambda history_id: True) -> list:
+    return [history_id for history_id in range(30, 0, -1) if history_id % 5 and predicate(history_id)]
+
+
+@pytest.mark.parametrize("limit", [1, 3, 4, 24, 50])
+def test_pages_cover_all_records_in_order(limit):
+    async def test(db):
+        assert await all_pages(db, limit) == expected_ids()
+    run(test)
+
+
+def test_filters():
+    async def test(db):
+        assert await all_pages(db, 4, layer_type="rsrp") == expected_ids(lambda history_id: history_id % 2)
+        assert await all_pages(db, 4, status="failed") == expected_ids(lambda history_id: history_id % 3 == 0)
+        assert await all_pages(db, 2, layer_type="sector", status="failed") == expected_ids(
+            lambda history_id: history_id % 6 == 0
+        )
+    run(test)
+
+
+def test_cursor_of_other_user_returns_nothing():
+    async def test(db):
+        page, cursor = await KMLService().get_generate_history(db, 1, cursor=25)
+        assert page == [] and cursor is None
+    run(test)
+
+
+def test_first_page_includes_pending_records():
+    async def test(db):
+        history_id = await HistoryService.add(
+            user_id=1, file_id="f", layer_type="rsrp", file_name="new.csv", kml_url="", status="pending"
+        )
+        page, _ = await KMLService().get_generate_history(db, 1, limit=1)
+        assert [(item.id, item.status) for item in page] == [(history_id, "pending")]
+        assert not HistoryService._pending
+    run(test)
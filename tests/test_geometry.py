@@ -0,0 +1,69 @@
+"""栅格与六边形汇聚的格子计算测试"""
+import numpy as np
+
+from app.utils.geometry import METERS_PER_DEGREE, grid_cells, grid_rings, hex_cells, hex_rings
+
+
+REF_LAT = 30.0
+SIZE = 100.0
+
+
+def to_degrees(x: np.ndarray, y: np.ndarray) -> tuple:
+    """局部平面坐标（米）转为经纬度，与格子计算使用同一投影"""
+    return x / (METERS_PER_DEGREE * np.cos(np.radians(REF_LAT))), y / METERS_PER_DEGREE
+
+
+def hex_centers(q: np.ndarray, r: np.ndarray) -> tuple:
+    return SIZE * np.sqrt(3) * (q + r / 2), SIZE * 1.5 * r
+
+
+def test_grid_cells():
+    x = np.array([1.0, 99.0, 101.0, 250.0, -1.0, -150.0])
+    y = np.array([1.0, 50.0, 99.0, 301.0, 1.0, -1.0])
+    ix, iy = grid_cells(*to_degrees(x, y), SIZE, REF_LAT)
+    assert ix.tolist() == [0, 0, 1, 2, -1, -2]
+    assert iy.tolist() == [0, 0, 0, 3, 0, -1]
+
+
+def test_grid_cells_inside_rings():
+    rng = np.random.default_rng(1)
+    lon = 120 + rng.random(1000) * 0.05
+    lat = REF_LAT + rng.random(1000) * 0.05
+    ix, iy = grid_cells(lon, lat, SIZE, REF_LAT)
+    lon_rings, lat_rings = grid_rings(ix, iy, SIZE, REF_LAT)
+    tolerance = 1e-9
+    assert (lon_rings.min(axis=1) <= lon + tolerance).all() and (lon <= lon_rings.max(axis=1) + tolerance).all()
+    assert (lat_rings.min(axis=1) <= lat + tolerance).all() and (lat <= lat_rings.max(axis=1) + tolerance).all()
+
+
+def test_hex_cells_centers_map_to_themselves():
+    q, r = np.meshgrid(np.arange(-5, 6), np.arange(-5, 6))
+    q, r = q.ravel(), r.ravel()
+    cq, cr = hex_cells(*to_degrees(*hex_centers(q, r)), SIZE, REF_LAT)
+    assert cq.tolist() == q.tolist()
+    assert cr.tolist() == r.tolist()
+
+
+def test_hex_cells_nearest_center():
+    # 六边形网格中，点所在的六边形就是中心距离最近的六边形
+    rng = np.random.default_rng(2)
+    x = rng.uniform(-2000, 2000, 5000)
+    y = rng.uniform(-2000, 2000, 5000)
+    q, r = hex_cells(*to_degrees(x, y), SIZE, REF_LAT)
+    cx, cy = hex_centers(q, r)
+    distance = np.hypot(x - cx, y - cy)
+    assert (distance <= SIZE + 1e-6).all()
+    
+    for dq, dr in [(1, 0), (-1, 0), (0, 1), (0, -1), (1, -1), (-1, 1)]:
+        nx, ny = hex_centers(q + dq, r + dr)
+        assert (distance <= np.hypot(x - nx, y - ny) + 1e-6).all()
+
+
+def test_hex_rings_surround_center():
+    lon_rings, lat_rings = hex_rings(np.array([0, 3]), np.array([0, -2]), SIZE, REF_LAT)
+    assert lon_rings.shape == lat_rings.shape == (2, 7)
+    assert np.allclose(lon_rings[:, 0], lon_rings[:, -1]) and np.allclose(lat_rings[:, 0], lat_rings[:, -1])
+    
+    center_lon, center_lat = to_degrees(*hex_centers(np.array([0, 3]), np.array([0, -2])))
+    assert np.allclose(lon_rings[:, :6].mean(axis=1), center_lon)
+    assert np.allclose(lat_rings[:, :6].mean(axis=1), center_lat)
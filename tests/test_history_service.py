@@ -0,0 +1,132 @@
+"""生成历史批量写入测试"""
+import asyncio
+import pytest
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import OperationalError
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, engine, init_db
+from app.models.user import GenerateHistory
+from app.services.history_service import HistoryService
+
+
+@pytest.fixture(autouse=True)
+def history_service(monkeypatch):
+    # 只在测试中显式写入
+    monkeypatch.setattr(settings, "HISTORY_FLUSH_INTERVAL_MS", 600000)
+    monkeypatch.setattr(HistoryService, "_pending", {})
+    monkeypatch.setattr(HistoryService, "_dropped", set())
+    monkeypatch.setattr(HistoryService, "_next_id", 0)
+    monkeypatch.setattr(HistoryService, "_max_id", 0)
+    yield HistoryService
+
+
+def run(test):
+    """在新的事件循环中执行测试：准备数据库，结束时停止后台任务"""
+    async def main():
+        await init_db()
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(GenerateHistory))
+            await db.commit()
+        try:
+            await test()
+        finally:
+            HistoryService._task.cancel()
+            HistoryService._task = None
+            await engine.dispose()
+    asyncio.run(main())
+
+
+async def add(user_id: int = 1, layer_type: str = "rsrp") -> int:
+    return await HistoryService.add(
+        user_id=user_id, file_id="f", layer_type=layer_type, file_name="a.csv", kml_url="", status="pending"
+    )
+
+
+async def rows() -> dict:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(GenerateHistory.id, GenerateHistory.user_id, GenerateHistory.status))
+        return {row.id: (row.user_id, row.status) for row in result.all()}
+
+
+def connection_error() -> OperationalError:
+    return OperationalError("INSERT", {}, Exception("connection lost"))
+
+
+def test_flush_batches_records():
+    async def test():
+        first, second = await add(), await add()
+        assert await rows() == {}
+        assert await HistoryService.flush() == 2
+        assert await rows() == {first: (1, "pending"), second: (1, "pending")}
+        
+        await HistoryService.update(first, "success", "/api/kml/download?filename=a.kml")
+        assert (await rows())[first] == (1, "success")
+    run(test)
+
+
+def test_update_before_flush_changes_queued_record():
+    async def test():
+        history_id = await add()
+        await HistoryService.update(history_id, "failed", "")
+        await HistoryService.flush()
+        assert (await rows())[history_id] == (1, "failed")
+    run(test)
+
+
+def test_connection_error_keeps_only_unwritten_records(monkeypatch):
+    async def test():
+        first, second = await add(), await add()
+        insert_records = HistoryService._insert
+        calls = []
+        
+        async def flaky_insert(records):
+            calls.append([record["id"] for record in records])
+            # 整批失败，逐条重试时第一条成功后连接中断
+            if len(calls) != 2:
+                raise connection_error()
+            await insert_records(records)
+        
+        monkeypatch.setattr(HistoryService, "_insert", staticmethod(flaky_insert))
+        with pytest.raises(OperationalError):
+            await HistoryService.flush()
+        assert calls == [[first, second], [first], [second]]
+        assert list(HistoryService._pending) == [second]
+        
+        monkeypatch.setattr(HistoryService, "_insert", staticmethod(insert_records))
+        assert await HistoryService.flush() == 1
+        await HistoryService.update(first, "success", "")
+        await HistoryService.update(second, "failed", "")
+        assert await rows() == {first: (1, "success"), second: (1, "failed")}
+        assert not HistoryService._dropped
+    run(test)
+
+
+def test_conflict_with_own_committed_record_updates_it():
+    async def test():
+        history_id = await add()
+        # 之前的写入已提交但未确认
+        await HistoryService._insert([HistoryService._pending[history_id]])
+        await HistoryService.update(history_id, "success", "")
+        
+        assert await HistoryService.flush() == 1
+        assert await rows() == {history_id: (1, "success")}
+        assert not HistoryService._pending and not HistoryService._dropped
+    run(test)
+
+
+def test_conflict_with_other_record_drops_only_that_record():
+    async def test():
+        first, second = await add(), await add()
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(GenerateHistory).values(
+                id=first, user_id=99, layer_type="sector", file_name="other", kml_url="", status="success"
+            ))
+            await db.commit()
+        
+        assert await HistoryService.flush() == 1
+        assert first in HistoryService._dropped
+        # 被丢弃的记录不能改到占用该ID的其他记录
+        await HistoryService.update(first, "failed", "")
+        assert await rows() == {first: (99, "success"), second: (1, "pending")}
+    run(test)
@@ -0,0 +1,80 @@
+"""分块KML四叉树划分测试"""
+import numpy as np
+import pytest
+
+from app.services.kml_service import build_quadtree
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(4)
+    lon = 120 + rng.random(5000)
+    lat = 30 + rng.random(5000)
+    return lon, lat
+
+
+def tile_of_rows(tiles: dict) -> dict:
+    """每行所在的分块，同一行出现在多个分块时报错"""
+    owner = {}
+    for key, tile in tiles.items():
+        for row in tile["rows"].tolist():
+            assert row not in owner
+            owner[row] = key
+    return owner
+
+
+def test_rows_partitioned_into_bounded_tiles(points):
+    lon, lat = points
+    rows = np.flatnonzero(lon < 120.9)
+    tiles = build_quadtree(lon, lat, rows, max_rows=100)
+    
+    assert sorted(tile_of_rows(tiles)) == rows.tolist()
+    assert (0, 0, 0) in tiles
+    for (level, x, y), tile in tiles.items():
+        assert tile["name"] == f"{level}_{x}_{y}.kml"
+        assert len(tile["rows"]) <= 100
+        west, south, east, north = tile["bounds"]
+        assert (lon[tile["rows"]] >= west).all() and (lon[tile["rows"]] <= east).all()
+        assert (lat[tile["rows"]] >= south).all() and (lat[tile["rows"]] <= north).all()
+        for child in tile["children"]:
+            assert child[0] == level + 1 and child[1] // 2 == x and child[2] // 2 == y
+            child_west, child_south, child_east, child_north = tiles[child]["bounds"]
+            assert west <= child_west <= child_east <= east and south <= child_south <= child_north <= north
+
+
+def test_small_input_single_tile(points):
+    lon, lat = points
+    tiles = build_quadtree(lon, lat, np.arange(50), max_rows=100)
+    assert list(tiles) == [(0, 0, 0)]
+    assert tiles[(0, 0, 0)]["rows"].tolist() == list(range(50))
+    assert tiles[(0, 0, 0)]["children"] == []
+    
+    empty = build_quadtree(lon, lat, np.array([], dtype=np.int64))
+    assert list(empty) == [(0, 0, 0)] and len(empty[(0, 0, 0)]["rows"]) == 0
+
+
+def test_max_level_keeps_remaining_rows():
+    # 坐标完全相同的点无法继续划分，由最大层级的分块包含
+    lon = np.full(500, 120.0)
+    lat = np.full(500, 30.0)
+    tiles = build_quadtree(lon, lat, np.arange(500), max_rows=10, max_level=3)
+    assert max(level for level, _, _ in tiles) == 3
+    assert len(tile_of_rows(tiles)) == 500
+    deepest = [tile for (level, _, _), tile in tiles.items() if level == 3]
+    assert len(deepest) == 1 and len(deepest[0]["rows"]) == 500 - 3 * 10
+
+
+def test_groups_stay_in_one_tile(points):
+    lon, lat = points
+    # 每个站点3行，坐标相同
+    site_lon, site_lat = np.repeat(lon[:1000], 3), np.repeat(lat[:1000], 3)
+    groups = np.repeat(np.arange(1000), 3)
+    tiles = build_quadtree(site_lon, site_lat, np.arange(3000), max_rows=90, groups=groups)
+    
+    owner = tile_of_rows(tiles)
+    assert len(owner) == 3000
+    for group in range(1000):
+        assert owner[group * 3] == owner[group * 3 + 1] == owner[group * 3 + 2]
+    for tile in tiles.values():
+        if tile["children"]:
+            assert 0 < len(tile["rows"]) <= 90 and len(tile["rows"]) % 3 == 0
@@ -0,0 +1,74 @@
+"""RSRP采样点去重抽稀测试"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.kml_service import KMLService
+from app.utils.geometry import METERS_PER_DEGREE
+
+
+LAT = 30.0
+LON_METER = 1 / (METERS_PER_DEGREE * np.cos(np.radians(LAT)))
+
+
+def track(east_meters, rsrp) -> pd.DataFrame:
+    """沿纬线向东的轨迹，east_meters为距起点的米数"""
+    return pd.DataFrame({
+        "经度": 120 + np.asarray(east_meters, dtype=np.float64) * LON_METER,
+        "纬度": LAT,
+        "RSRP": rsrp
+    })
+
+
+@pytest.fixture
+def service():
+    return KMLService()
+
+
+def test_unchanged_without_thinning(service):
+    df = track([0, 1, 2], [-80, -90, -100])
+    assert service.thin_rsrp_points(df)[0] is df
+    thinned, dropped = service.thin_rsrp_points(df, {"snap_tolerance": 5, "aggregate": "grid"})
+    assert thinned is df and dropped == 0
+
+
+@pytest.mark.parametrize("keep, expected", [
+    ("worst", [-100.0, -70.0]),
+    ("best", [-80.0, -70.0]),
+    ("mean", [-90.0, -70.0]),
+])
+def test_snap_merges_duplicates(service, keep, expected):
+    df = track([10.2, 10.5, 10.8, 200], [-80, -90, -100, -70])
+    thinned, dropped = service.thin_rsrp_points(df, {"snap_tolerance": 5, "dedup_keep": keep})
+    assert dropped == 2
+    assert thinned["RSRP"].tolist() == expected
+    # 合并后的点沿用第一个采样点的坐标，并保持原顺序
+    assert thinned["经度"].tolist() == df["经度"].iloc[[0, 3]].tolist()
+
+
+def test_min_distance_keeps_one_point_per_interval(service):
+    df = track(np.arange(0, 70, 10), np.arange(7) * -1.0)
+    thinned, dropped = service.thin_rsrp_points(df, {"min_distance": 24})
+    assert dropped == 4
+    assert thinned["RSRP"].tolist() == [0.0, -3.0, -5.0]
+
+
+def test_chunked_input_and_invalid_rows(service):
+    df = track(np.arange(0, 100, 5), np.arange(20) * -1.0)
+    df.loc[3, "RSRP"] = "无效"
+    config = {"snap_tolerance": 1, "min_distance": 20}
+    whole, _ = service.thin_rsrp_points(df, config)
+    chunked, _ = service.thin_rsrp_points(iter([df.iloc[:7], df.iloc[7:]]), config)
+    pd.testing.assert_frame_equal(whole, chunked)
+    assert -3.0 not in whole["RSRP"].tolist()
+
+
+@pytest.mark.parametrize("config", [
+    {"snap_tolerance": 5, "dedup_keep": "median"},
+    {"snap_tolerance": -1},
+    {"min_distance": -5},
+    {"min_distance": 10, "rsrp_col": "信号"},
+])
+def test_invalid_config(service, config):
+    with pytest.raises(ValueError):
+        service.thin_rsrp_points(track([0, 1], [-80, -90]), config)
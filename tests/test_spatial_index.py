@@ -0,0 +1,78 @@
+"""经纬度空间索引测试"""
+import os
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.services.file_service import FileService
+from app.utils.spatial_index import build_grid_index, points_in_polygon, query_bbox, query_polygon
+
+
+# 凹多边形（L形）
+L_SHAPE = [[0, 0], [2, 0], [2, 1], [1, 1], [1, 2], [0, 2]]
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(3)
+    lon = rng.uniform(-1, 3, 5000)
+    lat = rng.uniform(-1, 3, 5000)
+    lon[::50] = np.nan
+    return lon, lat
+
+
+def test_points_in_polygon():
+    lon = np.array([0.5, 1.5, 1.5, 0.5, 2.5, -0.5])
+    lat = np.array([0.5, 0.5, 1.5, 1.5, 0.5, 0.5])
+    assert points_in_polygon(lon, lat, L_SHAPE).tolist() == [True, True, False, True, False, False]
+
+
+def test_query_bbox_matches_scan(points):
+    lon, lat = points
+    index = build_grid_index(lon, lat)
+    for bbox in [(0, 0, 1, 1), (-5, -5, 5, 5), (2.5, -0.2, 2.9, 0.3), (0.1, 0.1, 0.1001, 0.1001)]:
+        west, south, east, north = bbox
+        expected = np.flatnonzero((lon >= west) & (lon <= east) & (lat >= south) & (lat <= north))
+        assert query_bbox(index, *bbox).tolist() == expected.tolist()
+
+
+def test_query_polygon_matches_scan(points):
+    lon, lat = points
+    index = build_grid_index(lon, lat)
+    valid = np.isfinite(lon) & np.isfinite(lat)
+    expected = np.flatnonzero(valid & points_in_polygon(lon, lat, L_SHAPE))
+    assert len(expected) > 0
+    assert query_polygon(index, L_SHAPE).tolist() == expected.tolist()
+
+
+def test_query_outside_bounds_and_empty_index(points):
+    index = build_grid_index(*points)
+    assert query_bbox(index, 10, 10, 11, 11).tolist() == []
+    
+    empty = build_grid_index(np.array([np.nan]), np.array([1.0]))
+    assert query_bbox(empty, -180, -90, 180, 90).tolist() == []
+    assert query_polygon(empty, L_SHAPE).tolist() == []
+
+
+def test_spatial_index_file_reload(points, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    lon, lat = points
+    file_path = str(tmp_path / "a.csv")
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write("经度,纬度,x,y\n")
+        f.writelines(f"{x},{y},{y},{x}\n" for x, y in zip(lon, lat))
+    
+    file_service = FileService()
+    built = file_service.get_spatial_index(file_path, "经度", "纬度")
+    loaded = file_service.get_spatial_index(file_path, "经度", "纬度")
+    assert isinstance(loaded["rows"], np.memmap)
+    assert query_bbox(loaded, 0, 0, 1, 1).tolist() == query_bbox(built, 0, 0, 1, 1).tolist()
+    
+    # 经纬度字段变化时重新构建
+    swapped = file_service.get_spatial_index(file_path, "x", "y")
+    assert not isinstance(swapped["rows"], np.memmap)
+    expected = np.flatnonzero((lat >= 0) & (lat <= 0.5) & (lon >= 1) & (lon <= 2))
+    assert query_bbox(swapped, 0, 1, 0.5, 2).tolist() == expected.tolist()
+    
+    file_service.delete_upload(file_path)
+    assert os.listdir(tmp_path) == []
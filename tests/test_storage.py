@@ -0,0 +1,107 @@
+"""S3存储后端测试，以moto模拟S3兼容对象存储"""
+import os
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from app.core.config import settings
+from app.core.storage import S3Storage
+
+
+BUCKET = "kml-test"
+PART_SIZE = 5 * 1024 * 1024
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(settings, "S3_ENDPOINT_URL", "")
+    monkeypatch.setattr(settings, "S3_PUBLIC_ENDPOINT_URL", "")
+    monkeypatch.setattr(settings, "S3_REGION", "us-east-1")
+    monkeypatch.setattr(settings, "S3_BUCKET", BUCKET)
+    monkeypatch.setattr(settings, "S3_PREFIX", "kml/")
+    monkeypatch.setattr(settings, "S3_MULTIPART_CHUNK_SIZE", PART_SIZE)
+    with moto.mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        yield S3Storage()
+
+
+def read_object(storage, key):
+    return storage.client.get_object(Bucket=BUCKET, Key=f"kml/{key}")["Body"].read()
+
+
+def pending_uploads(storage):
+    return storage.client.list_multipart_uploads(Bucket=BUCKET).get("Uploads", [])
+
+
+def test_open_writer_multipart(storage):
+    data = os.urandom(PART_SIZE * 2 + 1024)
+    with storage.open_writer("a.kml", "application/vnd.google-earth.kml+xml") as f:
+        for start in range(0, len(data), 1024 * 1024):
+            f.write(data[start:start + 1024 * 1024])
+        assert len(f.parts) == 2
+    
+    assert read_object(storage, "a.kml") == data
+    assert storage.size("a.kml") == len(data)
+    assert pending_uploads(storage) == []
+
+
+def test_open_writer_small_object(storage):
+    with storage.open_writer("small.kml", "application/vnd.google-earth.kml+xml") as f:
+        f.write(b"<kml/>")
+        assert f.upload_id is None
+    
+    assert storage.exists("small.kml")
+    assert read_object(storage, "small.kml") == b"<kml/>"
+
+
+def test_open_writer_abort(storage):
+    with pytest.raises(RuntimeError):
+        with storage.open_writer("broken.kml", "application/vnd.google-earth.kml+xml") as f:
+            f.write(os.urandom(PART_SIZE + 1))
+            assert f.upload_id is not None
+            raise RuntimeError("生成失败")
+    
+    assert not storage.exists("broken.kml")
+    assert pending_uploads(storage) == []
+
+
+def test_open_directory_and_delete_directory(storage):
+    with storage.open_directory("rsrp_pkg") as directory:
+        for name, content in [("doc.kml", b"root"), ("0_0_0.kml", b"tile")]:
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(content)
+    
+    assert read_object(storage, "rsrp_pkg/doc.kml") == b"root"
+    assert storage.exists("rsrp_pkg/0_0_0.kml")
+    assert storage.directory_size("rsrp_pkg") == 8
+    
+    storage.delete_directory("rsrp_pkg")
+    assert not storage.exists("rsrp_pkg/doc.kml")
+    assert storage.directory_size("rsrp_pkg") == 0
+
+
+def test_open_directory_discards_on_error(storage):
+    with pytest.raises(RuntimeError):
+        with storage.open_directory("rsrp_broken") as directory:
+            with open(os.path.join(directory, "doc.kml"), "wb") as f:
+                f.write(b"root")
+            raise RuntimeError("生成失败")
+    
+    assert storage.directory_size("rsrp_broken") == 0
+
+
+def test_download_url(storage, monkeypatch):
+    with storage.open_writer("a.kml", "application/vnd.google-earth.kml+xml") as f:
+        f.write(b"<kml/>")
+    
+    url = storage.download_url("a.kml", "a.kml")
+    assert f"/{BUCKET}/kml/a.kml?" in url
+    assert "X-Amz-Signature=" in url
+    assert "response-content-disposition=attachment" in url
+    
+    # 预签名地址使用对外地址
+    monkeypatch.setattr(settings, "S3_PUBLIC_ENDPOINT_URL", "https://files.example.com")
+    assert S3Storage().download_url("a.kml", "a.kml").startswith(f"https://files.example.com/{BUCKET}/kml/a.kml?")